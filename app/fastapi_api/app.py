@@ -3,7 +3,7 @@ import logging
 
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse, FileResponse
-from app.routes import predict, map_all_properties, map_properties_by_district
+from app.routes import predict, map_all_properties, map_properties_by_district, query_properties, tiles, stats
 
 
 app = FastAPI(
@@ -159,3 +159,17 @@ app.include_router(
     prefix="/api/v1/map_properties_by_district",
 )
 
+app.include_router(
+    query_properties.router,
+    prefix="/api/v1/properties/query",
+)
+
+app.include_router(
+    tiles.router,
+    prefix="/api/v1/tiles",
+)
+
+app.include_router(
+    stats.router,
+    prefix="/api/v1/stats",
+)
@@ -1,92 +1,136 @@
-import pandas as pd
-import geopandas as gpd
-import folium
 import os
+import folium
 import branca.colormap as cm
 
-from shapely import wkt
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import HTMLResponse
+from app.serving.canvas_layer import CanvasPointLayer, TileAggregateLayer
+from app.serving.property_store import load_all_properties, load_district_boundaries, dataset_version, \
+    ALL_PROPERTIES_STORE, DISTRICTS_GEOJSON_PATH
+from app.serving.render_cache import render_cache
+from app.serving.tiles import MIN_ZOOM, MAX_ZOOM
+
+# URL template of the tiles endpoint loaded by the `render=tiles` map. By default it is relative to the host
+# that serves the map; set TILES_BASE_URL (e.g. "https://api.example.com") when the map is embedded elsewhere
+TILES_BASE_URL = os.environ.get("TILES_BASE_URL", "").rstrip("/")
+TILES_URL = TILES_BASE_URL + "/api/v1/tiles/{z}/{x}/{y}"
 
 router = APIRouter()
 
+
 @router.get("", response_class=HTMLResponse, summary="Interactive Price Map of Madrid")
-def show_interactive_map():
+def show_interactive_map(
+        request: Request,
+        render: str = Query("canvas", pattern="^(canvas|markers|tiles)$",
+                            description="`canvas`: one compact payload drawn in the browser, "
+                                        "`markers`: one folium CircleMarker per property, "
+                                        "`tiles`: price aggregates loaded from `/api/v1/tiles` for the viewport"),
+       ):
     """
     Returns an interactive map of Madrid with:
     - District boundaries
     - Price-colored markers
     - Fixed color legend
 
+    With `render=canvas` (default) the properties are shipped as one compact typed-array payload and drawn
+    on a single Leaflet canvas (see `app/serving/canvas_layer.py`), which keeps the HTML small and fast to
+    load. `render=markers` keeps the previous output, with one CircleMarker per property. `render=tiles` does
+    not embed the properties: the map loads the price aggregates of the visible tiles from `/api/v1/tiles`.
+
+    The map only depends on the data files, so it is rendered once per data version and render mode and
+    kept in memory with its gzip (and brotli, if installed) variants (see `app/serving/render_cache.py`):
+    - The responses carry `ETag` and `Cache-Control` headers.
+    - A request whose `If-None-Match` matches the current version gets a `304 Not Modified`.
+
+    :param render: rendering mode of the properties, "canvas", "markers" or "tiles".
     :return: HTML with the interactive map
     :raises HTTPException 404: If files are missing
     :raises HTTPException 500: If a processing error occurs
     """
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-
-        # Load district boundaries
-        districts_path = os.path.join(script_dir, '..', '..', 'data/new_data', 'madrid-districts.geojson.txt')
-        gdf_districts = gpd.read_file(districts_path)
-
-        # Drop unnecessary columns that could cause JSON issues
-        gdf_districts = gdf_districts.drop(columns=['created_at', 'updated_at'], errors='ignore')
-
-        # Load property data
-        properties_path = os.path.join(script_dir, '..', '..', 'data/new_data', 'EDA_MADRID_SCALED_Geometry_Column.csv')
-        df_properties = pd.read_csv(properties_path, encoding='utf-8')
-        df_properties['GEOMETRY'] = df_properties['GEOMETRY'].apply(wkt.loads)
-
-        # Keep only necessary columns
-        df_clean = df_properties[['PRICE', 'GEOMETRY']].copy()
-
-        # Rename geometry column to 'geometry' as expected by GeoDataFrame
-        df_subset = df_clean.rename(columns={'GEOMETRY': 'geometry'})
-
-        gdf_properties = gpd.GeoDataFrame(df_subset, geometry='geometry', crs='EPSG:4326')
-
-        # Create base map centered in Madrid
-        m = folium.Map(location=[40.4168, -3.7038], zoom_start=12, tiles='CartoDB positron')
-
-        # Add districts with name tooltip and hover highlight
-        folium.GeoJson(
-            gdf_districts,
-            name="Districts",
-            style_function=lambda x: {
-                "fillColor": "gray",
-                "color": "black",
-                "weight": 1,
-                "fillOpacity": 0.1
-            },
-            highlight_function=lambda x: {
-                "color": "black",
-                "weight": 3,
-                "fillOpacity": 0.2
-            },
-            tooltip=folium.GeoJsonTooltip(
-                fields=["name"],
-                aliases=["District:"],
-                sticky=True,
-                opacity=0.8,
-                direction='top'
-            )
-        ).add_to(m)
+        # Load district boundaries and property data, both are read once per version of their files
+        gdf_districts = load_district_boundaries()
+        df_properties = load_all_properties()
+
+        # Build the map only if this version of the data has not been rendered yet
+        version = dataset_version(ALL_PROPERTIES_STORE, DISTRICTS_GEOJSON_PATH)
+        rendered = render_cache.get_or_render(
+            ("all_properties", render), version,
+            lambda: build_price_map(gdf_districts, df_properties, render, tiles_url=TILES_URL)
+        )
 
-        # Define color scale by price (from blue to red)
-        min_price = gdf_properties['PRICE'].min()
-        max_price = 1000000  # Optional cap to limit color scaling
+        # Return embedded HTML (or 304 if the client already has it)
+        return rendered.to_response(request)
 
-        colormap = cm.LinearColormap(
-            colors=['blue', 'lightblue', 'yellow', 'orange', 'red'],
-            vmin=min_price,
-            vmax=max_price,
-            caption='Property Prices (€)'
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+def build_price_map(gdf_districts, df_properties, render="canvas", tiles_url=None):
+    """
+    Render the price map of Madrid.
+
+    :param gdf_districts: GeoDataFrame of the district boundaries.
+    :param df_properties: DataFrame with the PRICE, LATITUDE and LONGITUDE of the properties.
+    :param render: rendering mode of the properties, "canvas", "markers" or "tiles".
+    :param tiles_url: URL template of the tiles endpoint, used with `render="tiles"`.
+    :return: HTML of the map
+    """
+    # Create base map centered in Madrid
+    m = folium.Map(location=[40.4168, -3.7038], zoom_start=12, tiles='CartoDB positron')
+
+    # Add districts with name tooltip and hover highlight
+    folium.GeoJson(
+        gdf_districts,
+        name="Districts",
+        style_function=lambda x: {
+            "fillColor": "gray",
+            "color": "black",
+            "weight": 1,
+            "fillOpacity": 0.1
+        },
+        highlight_function=lambda x: {
+            "color": "black",
+            "weight": 3,
+            "fillOpacity": 0.2
+        },
+        tooltip=folium.GeoJsonTooltip(
+            fields=["name"],
+            aliases=["District:"],
+            sticky=True,
+            opacity=0.8,
+            direction='top'
         )
+    ).add_to(m)
+
+    # Define color scale by price (from blue to red)
+    min_price = df_properties['PRICE'].min()
+    max_price = 1000000  # Optional cap to limit color scaling
+
+    colormap = cm.LinearColormap(
+        colors=['blue', 'lightblue', 'yellow', 'orange', 'red'],
+        vmin=min_price,
+        vmax=max_price,
+        caption='Property Prices (€)'
+    )
+
+    if render == "tiles":
+        # Load the price aggregates of the visible tiles from the tiles endpoint
+        TileAggregateLayer(tiles_url, colormap, MIN_ZOOM, MAX_ZOOM).add_to(m)
+
+    elif render == "canvas":
+        # Add all the properties as a single canvas layer colored by price
+        CanvasPointLayer(
+            df_properties['LATITUDE'], df_properties['LONGITUDE'], df_properties['PRICE'], colormap,
+            radius=1, fill_opacity=0.05
+        ).add_to(m)
 
+    else:
         # Add each property as a CircleMarker colored by price
-        for _, row in gdf_properties.iterrows():
-            price = row.PRICE
-            location = [row.geometry.y, row.geometry.x]
+        for price, latitude, longitude in zip(df_properties['PRICE'], df_properties['LATITUDE'], df_properties['LONGITUDE']):
+            location = [latitude, longitude]
             folium.CircleMarker(
                 location=location,
                 radius=1,
@@ -97,13 +141,7 @@ def show_interactive_map():
                 popup=f"Price: €{int(price):,}".replace(",", ".")
             ).add_to(m)
 
-        # Add fixed color legend
-        colormap.add_to(m)
+    # Add fixed color legend
+    colormap.add_to(m)
 
-        # Return embedded HTML
-        return HTMLResponse(content=m.get_root().render())
-
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="File not found")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    return m.get_root().render()
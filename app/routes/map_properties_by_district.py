@@ -1,19 +1,40 @@
-import folium
-import pandas as pd
 import os
-import geopandas as gpd
+import folium
 
 from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import Response
-from shapely import wkt
 from typing import Optional
 from folium import IFrame
+from app.serving.property_store import load_district_properties, load_district_polygons, dataset_version, \
+    DISTRICT_PROPERTIES_STORE, DISTRICTS_POLYGONS_PATH
+from app.serving.property_query import load_property_query_engine, filter_properties
+from app.serving.response_cache import ResponseCache
 
+# Cache of the rendered district maps: maximum total size (MB) and seconds an entry is valid
+DISTRICT_MAP_CACHE_MAX_MB = int(os.environ.get("DISTRICT_MAP_CACHE_MAX_MB", "64"))
+DISTRICT_MAP_CACHE_TTL_SECONDS = int(os.environ.get("DISTRICT_MAP_CACHE_TTL_SECONDS", "3600"))
 
+district_map_cache = ResponseCache(DISTRICT_MAP_CACHE_MAX_MB * 1024 ** 2, DISTRICT_MAP_CACHE_TTL_SECONDS)
 
 # Define the APIRouter instance
 router = APIRouter()
 
+
+def canonical_filters(district, room_number=None, bathroom_number=None, price_min=None, price_max=None,
+                      constructed_area_min=None, constructed_area_max=None):
+    """
+    Return the cache key of a request: a tuple with the value of every filter in a fixed order, so two
+    requests with the same filters always get the same key whatever the order of their query parameters.
+    """
+    return (
+        ('district', district),
+        ('room_number', room_number),
+        ('bathroom_number', bathroom_number),
+        ('price', price_min, price_max),
+        ('constructed_area', constructed_area_min, constructed_area_max),
+    )
+
+
 @router.get("", response_class=Response)
 def map(
         district: Optional[str] = Query(None, description="District name to filter by"),
@@ -29,15 +50,20 @@ def map(
     and optional property attributes.
 
     ## Features
-    - Loads geographic district boundaries from a CSV (with WKT geometries).
-    - Loads property listings from a separate CSV, also with geometries.
+    - Uses the geographic district boundaries and the property listings of the property store,
+      which are loaded again only when their files change (see `app/serving/property_store.py`).
     - Filters the properties by:
         - District name (required)
         - Number of rooms (exact match)
         - Number of bathrooms (exact match)
         - Price range (min and/or max)
         - Constructed area range (min and/or max)
-    - Performs a **spatial join** to match properties inside the selected district.
+    - Selects the properties with the in-memory query engine (`app/serving/property_query.py`): sorted
+      indexes for the price and area ranges and bitmap indexes for rooms, bathrooms and district. The district
+      of every listing is assigned once when the store is built, so no spatial join runs per request.
+    - The rendered maps are kept in a bounded LRU cache (`DISTRICT_MAP_CACHE_MAX_MB`, 64 MB by default) keyed
+      by the filters, whose entries expire after `DISTRICT_MAP_CACHE_TTL_SECONDS` and are dropped when the
+      data of the property store changes. See `/cache_stats` for the hit and miss counters.
     - Uses **Folium** to render an interactive web map with:
         - District polygons
         - Red circle markers for each property
@@ -60,120 +86,121 @@ def map(
     - HTTPException 500: For any unexpected errors during processing.
     """
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-
-        # Load districts
-        districts_path = os.path.join(script_dir, '..', '..', 'data/old_data', 'Madrid_Districts_Polygons.csv')
-        df_districts = pd.read_csv(districts_path, encoding='utf-8')
-        df_districts['geometry'] = df_districts['geometry'].apply(wkt.loads)
-        gdf_districts = gpd.GeoDataFrame(df_districts, geometry='geometry', crs='EPSG:4326')
+        # Load districts and properties, both are read from the property store once per version of its files
+        gdf_districts = load_district_polygons()
+        gdf_properties = load_district_properties()
 
-        # Load properties
-        properties_path = os.path.join(script_dir, '..', '..', 'data/new_data', 'EDA_MADRID_NOT_SCALED_DISTRICTS.csv')
-        df_properties = pd.read_csv(properties_path, encoding='utf-8')
-        df_properties['GEOMETRY'] = df_properties['GEOMETRY'].apply(wkt.loads)
-
-        # Ensure that the columns have the correct data types
-        df_properties['PRICE'] = pd.to_numeric(df_properties['PRICE'], errors='coerce')
-        df_properties['ROOMNUMBER'] = pd.to_numeric(df_properties['ROOMNUMBER'], errors='coerce')
-        df_properties['BATHNUMBER'] = pd.to_numeric(df_properties['BATHNUMBER'], errors='coerce')
-
-        gdf_properties = gpd.GeoDataFrame(
-            df_properties[[
-                'PRICE', 'UNITPRICE', 'ROOMNUMBER',
-                'BATHNUMBER','CADCONSTRUCTIONYEAR',
-                'GEOMETRY', 'CONSTRUCTEDAREA'
-            ]], geometry='GEOMETRY', crs='EPSG:4326')
-
-        # Create a Folium map centered on Madrid
-        m = folium.Map(location=[40.4168, -3.7038], zoom_start=12)
-
-        gdf_filtered = gdf_properties.copy()
-
-        # Filter properties based on query parameters
-        if room_number is not None:
-            gdf_filtered = gdf_filtered[gdf_filtered['ROOMNUMBER'] == room_number]
+        # Filter districts by name:
+        selected_district = gdf_districts[gdf_districts['DISTRICTS'] == district]
 
-        if bathroom_number is not None:
-            gdf_filtered = gdf_filtered[gdf_filtered['BATHNUMBER'] == bathroom_number]
+        if selected_district.empty:
+            raise HTTPException(status_code=404, detail="District not found")
 
-        if price_min is not None:
-            gdf_filtered = gdf_filtered[gdf_filtered['PRICE'] >= price_min]
+        # Return the cached map if these filters were already rendered for this version of the data
+        version = dataset_version(DISTRICT_PROPERTIES_STORE, DISTRICTS_POLYGONS_PATH)
+        key = canonical_filters(district, room_number, bathroom_number, price_min, price_max,
+                                constructed_area_min, constructed_area_max)
+        html = district_map_cache.get(version, key)
+
+        if html is None:
+            # Select the matching rows with the indexes of the query engine and take them once
+            rows = filter_properties(
+                load_property_query_engine(),
+                district=district,
+                room_number=room_number,
+                bathroom_number=bathroom_number,
+                price_min=price_min,
+                price_max=price_max,
+                constructed_area_min=constructed_area_min,
+                constructed_area_max=constructed_area_max,
+            )
+            gdf_filtered = gdf_properties.iloc[rows]
+
+            html = build_district_map(selected_district, gdf_filtered).encode("utf-8")
+            district_map_cache.put(version, key, html)
+
+        return Response(content=html, media_type="text/html")
+
+    except HTTPException:
+        raise
 
-        if price_max is not None:
-            gdf_filtered = gdf_filtered[gdf_filtered['PRICE'] <= price_max]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-        if constructed_area_min is not None:
-            gdf_filtered = gdf_filtered[gdf_filtered['CONSTRUCTEDAREA'] >= constructed_area_min]
 
-        if constructed_area_max is not None:
-            gdf_filtered = gdf_filtered[gdf_filtered['CONSTRUCTEDAREA'] <= constructed_area_max]
+@router.get("/cache_stats")
+def cache_stats():
+    """
+    Return the counters of the cache of the district maps (entries, size, hits, misses, evictions).
+    """
+    return district_map_cache.stats()
 
-        # Filter districts by name:
-        selected_district = gdf_districts[gdf_districts['DISTRICTS'] == district]
 
-        if selected_district.empty:
-            raise HTTPException(status_code=404, detail="District not found")
+def build_district_map(selected_district, gdf_filtered):
+    """
+    Render the map of a district with its properties.
 
-        # Make the spatial intersection
-        gdf_filtered = gpd.sjoin(gdf_filtered, selected_district, predicate="within")
-
-        # Add districts to the map
-        folium.GeoJson(
-            selected_district,
-            name='Districts',
-            # Define the general style of the map
-            style_function=lambda feature: {
-                'fillColor': 'lightblue',
-                'color': 'black',
-                'weight': 2,
-                'fillOpacity': 0.2,
-            },
-            # Define the style when hovering over a district with the mouse
-            highlight_function=lambda feature: {
-                'fillColor': 'lightblue',
-                'color': 'blue',
-                'weight': 2,
-                'fillOpacity': 0.6,
-            },
-            # Add a tooltip to show the district name when the mouse hovers over it
-            tooltip=folium.GeoJsonTooltip(fields=['DISTRICTS'], aliases=['District'])
+    :param selected_district: GeoDataFrame with the polygon of the district.
+    :param gdf_filtered: GeoDataFrame with the properties to draw.
+    :return: HTML of the map
+    """
+    # Create a Folium map centered on Madrid
+    m = folium.Map(location=[40.4168, -3.7038], zoom_start=12)
+
+    # Add districts to the map
+    folium.GeoJson(
+        selected_district,
+        name='Districts',
+        # Define the general style of the map
+        style_function=lambda feature: {
+            'fillColor': 'lightblue',
+            'color': 'black',
+            'weight': 2,
+            'fillOpacity': 0.2,
+        },
+        # Define the style when hovering over a district with the mouse
+        highlight_function=lambda feature: {
+            'fillColor': 'lightblue',
+            'color': 'blue',
+            'weight': 2,
+            'fillOpacity': 0.6,
+        },
+        # Add a tooltip to show the district name when the mouse hovers over it
+        tooltip=folium.GeoJsonTooltip(fields=['DISTRICTS'], aliases=['District'])
+    ).add_to(m)
+
+    # Create a popup
+    for _, row in gdf_filtered.iterrows():
+        lat, lon = row['LATITUDE'], row['LONGITUDE']
+        popup_html = f"""
+            <div style="font-size: 13px; padding: 5px;">
+                <table style="width: 100%; border-collapse: collapse;">
+                    <tr><td><b>Price:</b></td><td>{row['PRICE']:.0f} €</td></tr>
+                    <tr><td><b>Price/m²:</b></td><td>{row['UNITPRICE']:.0f} €/m²</td></tr>
+                    <tr><td><b>Constructed Area:</b></td><td>{row['CONSTRUCTEDAREA']} m²</td></tr>
+                    <tr><td><b>Rooms:</b></td><td>{row['ROOMNUMBER']}</td></tr>
+                    <tr><td><b>Bathrooms:</b></td><td>{row['BATHNUMBER']}</td></tr>
+                    <tr><td><b>Construction Year:</b></td><td>{row['CADCONSTRUCTIONYEAR']}</td></tr>
+                </table>
+            </div>
+        """
+
+        iframe = IFrame(popup_html, width=250, height=150)
+        popup = folium.Popup(iframe, max_width=300)
+
+        # Add properties to the map
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=5,
+            color='red',
+            fill=True,
+            fill_color='red',
+            fill_opacity=0.6,
+            popup=popup,
         ).add_to(m)
 
-        # Create a popup
-        for _, row in gdf_filtered.iterrows():
-            lat, lon = row['GEOMETRY'].x, row['GEOMETRY'].y
-            popup_html = f"""
-                <div style="font-size: 13px; padding: 5px;">
-                    <table style="width: 100%; border-collapse: collapse;">
-                        <tr><td><b>Price:</b></td><td>{row['PRICE']:.0f} €</td></tr>
-                        <tr><td><b>Price/m²:</b></td><td>{row['UNITPRICE']:.0f} €/m²</td></tr>
-                        <tr><td><b>Constructed Area:</b></td><td>{row['CONSTRUCTEDAREA']} m²</td></tr>
-                        <tr><td><b>Rooms:</b></td><td>{row['ROOMNUMBER']}</td></tr>
-                        <tr><td><b>Bathrooms:</b></td><td>{row['BATHNUMBER']}</td></tr>
-                        <tr><td><b>Construction Year:</b></td><td>{row['CADCONSTRUCTIONYEAR']}</td></tr>
-                    </table>
-                </div>
-            """
-
-            iframe = IFrame(popup_html, width=250, height=150)
-            popup = folium.Popup(iframe, max_width=300)
-
-            # Add properties to the map
-            folium.CircleMarker(
-                location=[lon, lat],
-                radius=5,
-                color='red',
-                fill=True,
-                fill_color='red',
-                fill_opacity=0.6,
-                popup=popup,
-            ).add_to(m)
-
-
-        # Add layer control
-        folium.LayerControl().add_to(m)
-        return Response(content=m._repr_html_(), media_type="text/html")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+    # Add layer control
+    folium.LayerControl().add_to(m)
+    return m._repr_html_()
+
@@ -1,14 +1,22 @@
-import mlflow.sklearn
-import os
-import joblib
-import pandas as pd
+import numpy as np
 import logging
-import json
-import unidecode
+import os
+import threading
+import time
+import warnings
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Body, HTTPException
+from pydantic import ValidationError
+from typing import Any, Dict, List, Union
 from .PropertyFeatures import PropertyFeatures
-from unidecode import unidecode
+from app.serving.micro_batcher import MicroBatcher
+from app.serving.inference_executor import InferenceExecutor
+from src.data_processing.compiled_trees import compile_serving_pipeline, check_parity, parity_rows
+from src.data_processing.feature_encoder import FeatureEncoder
+from src.data_processing.serving_pipeline import build_serving_pipeline, is_serving_pipeline
+from utils.model_cache import MODEL_CACHE_DIR, load_model
+from utils.thread_budget import limit_model_threads, thread_budget
+from utils.utils import load_scaler
 
 print("loaded predict.py")
 
@@ -16,80 +24,223 @@ print("loaded predict.py")
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Set the MLflow tracking URI
-mlflow_run_id = "http://127.0.0.1:5000"
-
 # Set the scaler run id
 scaler_run_id = "3235ac7dbbd24123a5954bc24351ea03"
 
-# URI where the MLFlow server is running
-mlflow.set_tracking_uri(mlflow_run_id)
-
-# Load the model from the Model Registry (last version of the model registered), if we want to use Random Forest
-#model = mlflow.sklearn.load_model("models:/random_forest_regressor/latest")
-
-# Load the model from the Model Registry (last version of the model registered), if we want to use Ensemble Voting
-# It is recommended to use the most stable model version, in these case, we use the latest one
-model = mlflow.sklearn.load_model("models:/voting_regressor/latest")
+# Serving mode of the model:
+# - "memory": every worker keeps a private copy of the model.
+# - "mmap": the large NumPy arrays of the model (the node arrays of the compiled Random Forest and XGBoost and
+#   the training rows of the KNN) are memory mapped read only from the local cache, so the Uvicorn workers
+#   share those pages through the OS page cache.
+MODEL_SERVING_MODE = os.environ.get("MODEL_SERVING_MODE", "memory")
+
+# Registered model served by the API:
+# - "ensemble": the Voting Regressor ("voting_regressor").
+# - "student": the single XGBoost model distilled from it ("voting_regressor_student", see
+#   src/models/distillation.py), faster and smaller at a small accuracy cost.
+# With SERVING_MODEL_FALLBACK=true the ensemble is served when the student cannot be loaded
+SERVING_MODEL = os.environ.get("SERVING_MODEL", "ensemble")
+SERVING_MODEL_FALLBACK = os.environ.get("SERVING_MODEL_FALLBACK", "true").lower() == "true"
+SERVING_MODEL_NAMES = {"ensemble": "voting_regressor", "student": "voting_regressor_student"}
+
+# Inference backend of the tree members of the model:
+# - "sklearn": the Random Forest and XGBoost predict with their own implementation.
+# - "compiled": they are converted into flat node arrays evaluated with NumPy (much faster for the small
+#   batches of the API). The arrays are cached next to the model cache, in "mmap" mode the trees are already
+#   compiled on load. The KNN index is private to each worker in both modes.
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "sklearn")
+
+# Micro-batching of the single predictions: the concurrent requests are predicted together, in batches of up
+# to PREDICT_BATCH_MAX_SIZE rows that wait at most PREDICT_BATCH_MAX_LATENCY_MS for other requests.
+# PREDICT_BATCH_MAX_SIZE=1 predicts every request on its own
+PREDICT_BATCH_MAX_SIZE = int(os.environ.get("PREDICT_BATCH_MAX_SIZE", "32"))
+PREDICT_BATCH_MAX_LATENCY_MS = float(os.environ.get("PREDICT_BATCH_MAX_LATENCY_MS", "2"))
+
+# Dedicated pool where the model predicts, so the predictions do not compete with the other routes in the
+# default threadpool of FastAPI:
+# - INFERENCE_EXECUTOR: "thread" (threads of the API process) or "process" (worker processes with their own
+#   copy of the model, use MODEL_SERVING_MODE=mmap to share its arrays).
+# - INFERENCE_PROFILE: thread budget of the pool, "latency" (one worker per core, one thread per prediction)
+#   or "throughput" (one worker, every core per prediction). See `thread_budget`.
+# - INFERENCE_WORKERS / INFERENCE_THREADS_PER_WORKER: override the workers of the pool and the threads each
+#   prediction may use (XGBoost, scikit-learn and BLAS).
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread")
+INFERENCE_PROFILE = os.environ.get("INFERENCE_PROFILE", "latency")
+INFERENCE_WORKERS, INFERENCE_THREADS_PER_WORKER = thread_budget(
+    INFERENCE_PROFILE,
+    workers=int(os.environ["INFERENCE_WORKERS"]) if "INFERENCE_WORKERS" in os.environ else None,
+    threads_per_worker=int(os.environ["INFERENCE_THREADS_PER_WORKER"])
+    if "INFERENCE_THREADS_PER_WORKER" in os.environ else None,
+)
+
+# The model is loaded lazily by get_model(), the first time a worker needs it
+model = None
+model_load_stats = {}
+model_lock = threading.Lock()
+
+# The layout of the encoded matrix is checked when the pipeline is built, so the warning about the
+# missing feature names of the NumPy input can be ignored
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+
+def load_serving_model():
+    """
+    Load the serving pipeline (folded scaler + Voting Regressor or its distilled student) and record the
+    startup stats.
 
-# Directory of predict.py
-current_dir = os.path.dirname(__file__)
+    The model is resolved from the local cache or the local mlruns store first, the MLflow tracking server
+    (MLFLOW_TRACKING_URI) is only contacted when the cache misses.
+    """
+    start = time.perf_counter()
 
-# Going up 3 levels to reach the root of the project
-project_root = os.path.abspath(os.path.join(current_dir, "../.."))
+    # Load the model from the Model Registry (last version of the model registered), if we want to use Random Forest
+    #loaded_model, stats = load_model("random_forest_regressor", mmap=MODEL_SERVING_MODE == "mmap")
 
-# Import the scale object (scale.pkl) from the correct path
-scaler_path = os.path.join(project_root, "src", "eda", "scaler.pkl")
+    # Load the model from the Model Registry (last version of the model registered), if we want to use Ensemble Voting
+    # It is recommended to use the most stable model version, in these case, we use the latest one
+    model_name = SERVING_MODEL_NAMES[SERVING_MODEL]
+    try:
+        loaded_model, stats = load_model(model_name, mmap=MODEL_SERVING_MODE == "mmap")
+    except Exception as e:
+        if model_name == SERVING_MODEL_NAMES["ensemble"] or not SERVING_MODEL_FALLBACK:
+            raise
+        # The student is not registered (or cannot be loaded), serve the full ensemble
+        logger.warning(f"Could not load the model {model_name}, falling back to the ensemble: {e}")
+        loaded_model, stats = load_model(SERVING_MODEL_NAMES["ensemble"], mmap=MODEL_SERVING_MODE == "mmap")
+        stats["fallback_from"] = model_name
+
+    # Models registered with `save_model(..., scaler=scaler)` already contain the folded scaler. For older
+    # versions, the scaler is downloaded once and folded in front of the model, so every prediction is a single
+    # array-in/array-out call without an intermediate DataFrame
+    if not is_serving_pipeline(loaded_model):
+        # The scaler.pkl is in the directory "scaler" of the MLFlow experiment
+        scaler = load_scaler(scaler_run_id)
+        loaded_model = build_serving_pipeline(scaler, loaded_model)
+
+    stats["backend"] = "sklearn"
+    if MODEL_BACKEND == "compiled":
+        try:
+            compiled_model = compile_serving_pipeline(
+                loaded_model,
+                cache_dir=os.path.join(MODEL_CACHE_DIR, "compiled", stats["sha256"]),
+                mmap=MODEL_SERVING_MODE == "mmap",
+            )
+            stats["compiled_max_relative_difference"] = check_parity(
+                loaded_model, compiled_model, parity_rows(loaded_model))
+            loaded_model = compiled_model
+            stats["backend"] = "compiled"
+        except ValueError as e:
+            # Keep serving with the original model if it cannot be compiled or the predictions differ
+            logger.error(f"Compiled backend disabled: {e}")
+
+    # The members of the ensemble were pickled with n_jobs=-1, pin their threads to the budget of a worker
+    limit_model_threads(loaded_model, INFERENCE_THREADS_PER_WORKER)
+
+    # Startup time of the model, reported by the /model_info endpoint
+    stats["startup_seconds"] = time.perf_counter() - start
+    logger.info(f"Model ready in {stats['startup_seconds']:.2f}s (source: {stats['source']}, mode: {MODEL_SERVING_MODE}, "
+                f"backend: {stats['backend']})")
+
+    model_load_stats.update(stats)
+    return loaded_model
+
+
+def get_model():
+    """Return the serving pipeline, loading it the first time it is needed."""
+    global model
+
+    if model is None:
+        with model_lock:
+            if model is None:
+                model = load_serving_model()
+
+    return model
 
-# Load the scaler object
-try:
-    # The scaler.pkl is in the directory "scaler" of the MLFlow experiment, it can be loaded ussing the directory where
-    # the scaler.pkl is stored
-    # scaler_path = os.path.join(project_root, "src", "eda", "scaler.pkl")
-    logged_run_uri = f"runs:/{scaler_run_id}/scaler/scaler.pkl"
-    scaler = joblib.load(mlflow.artifacts.download_artifacts(logged_run_uri))
-except Exception as e:
-    print("Error loading scaler:", e)
 
 # Register the router, it is used to define the endpoints of the API
 router = APIRouter()
 
-# Define the columns for the district features
-DISTRICT_COLUMNS = [
-    'DISTRICTS_ARGANZUELA', 'DISTRICTS_BARAJAS', 'DISTRICTS_CARABANCHEL', 'DISTRICTS_CENTRO',
-    'DISTRICTS_CHAMARTIN', 'DISTRICTS_CHAMBERI', 'DISTRICTS_CIUDAD LINEAL',
-    'DISTRICTS_FUENCARRAL-EL PARDO', 'DISTRICTS_HORTALEZA', 'DISTRICTS_LATINA',
-    'DISTRICTS_MONCLOA-ARAVACA', 'DISTRICTS_MORATALAZ', 'DISTRICTS_PUENTE DE VALLECAS',
-    'DISTRICTS_RETIRO', 'DISTRICTS_SALAMANCA', 'DISTRICTS_SAN BLAS-CANILLEJAS',
-    'DISTRICTS_TETUAN', 'DISTRICTS_USERA', 'DISTRICTS_VICALVARO',
-    'DISTRICTS_VILLA DE VALLECAS', 'DISTRICTS_VILLAVERDE'
-]
-
-# Define the columns for the location features
-LOCATION_COLUMNS = [
-    'LOCATIONNAME_0', 'LOCATIONNAME_1', 'LOCATIONNAME_2',
-    'LOCATIONNAME_3', 'LOCATIONNAME_4', 'LOCATIONNAME_5',
-    'LOCATIONNAME_6', 'LOCATIONNAME_7', 'LOCATIONNAME_8', 'LOCATIONNAME_9'
-]
-
-# Read the json where location name is map to its group
-json_path = r'C:\Users\34651\Desktop\MASTER\TFM\madrid_rental_prediction_ml\data\new_data\locationnameGroup.json'
-with open(json_path, 'r', encoding='utf-8') as file:
-    location_name_map = json.load(file)
-
-print("0: Loaded the model and the scaler")
+# Build the feature encoder once, it holds the column layout used to train the model. The raw features are
+# encoded in float64 because they are scaled afterwards: rounding them to float32 before scaling can move a
+# value to the other side of an XGBoost split condition
+encoder = FeatureEncoder.from_json(dtype=np.float64)
+
+print("0: Loaded the feature encoder, the model is loaded on the first prediction")
+
+
+def read_model_load_stats():
+    """Return the startup stats of the model of the current process, run inside the worker processes."""
+    return dict(model_load_stats)
+
+
+def run_model(X):
+    """Predict an encoded matrix with the serving pipeline, runs inside the inference executor."""
+    return get_model().predict(X)
+
+
+inference_executor = InferenceExecutor(
+    predict_fn=run_model,
+    load_fn=load_serving_model,
+    max_workers=INFERENCE_WORKERS,
+    threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+    mode=INFERENCE_EXECUTOR,
+)
+
+
+def predict_batch(X):
+    """
+    Predict all the rows of an encoded matrix with a single call to the serving pipeline, in the inference
+    executor.
+
+    :param X: matrix returned by the feature encoder.
+    :returns: NumPy array with one predicted price per row.
+    """
+    if len(X) == 0:
+        return np.empty(0)
+
+    return inference_executor.submit(X).result()
+
+
+# Coalesces the concurrent single predictions into batched calls to the inference executor, with one batch
+# in flight per worker of the executor
+batcher = MicroBatcher(inference_executor.predict, max_batch_size=PREDICT_BATCH_MAX_SIZE,
+                       max_latency_ms=PREDICT_BATCH_MAX_LATENCY_MS, max_concurrency=INFERENCE_WORKERS)
+
+
+def rows_from_payload(payload):
+    """
+    Convert the body of the batch endpoint into a list of raw rows.
+
+    The body can be either a list of property objects or a columnar object where every field of
+    `PropertyFeatures` maps to a list of values of the same length.
+
+    :param payload: parsed JSON body.
+    :returns: list of dictionaries, one per property.
+    :raises HTTPException 422: if the columnar body has lists of different lengths.
+    """
+    if isinstance(payload, list):
+        return payload
+
+    lengths = {len(values) for values in payload.values()}
+    if len(lengths) > 1:
+        raise HTTPException(status_code=422, detail="All the columns of the batch must have the same length")
+
+    n_rows = lengths.pop() if lengths else 0
+    return [{field: values[i] for field, values in payload.items()} for i in range(n_rows)]
+
 
 # Define the prediction endpoint
 @router.post("", summary="Predict the price of a property")
-def predict(features: PropertyFeatures):
+async def predict(features: PropertyFeatures):
     """
     Predict the price of a property based on its features.
 
     - Accepts a POST request with structured property features.
     - Encodes categorical variables for district and location using one-hot encoding.
-    - Normalizes continuous features using a pre-trained scaler (`scaler.pkl`).
-    - Loads a Voting Regressor model from the MLflow Model Registry.
-    - Performs inference using the processed input data.
+    - Performs inference with the serving pipeline loaded from the MLflow Model Registry, which
+      normalizes the continuous features with the folded scaler and runs the Voting Regressor.
+    - Concurrent requests are coalesced by the micro-batcher and predicted with a single call to the model
+      (see `PREDICT_BATCH_MAX_SIZE` and `PREDICT_BATCH_MAX_LATENCY_MS`).
     - Returns the predicted property price.
 
     :param features: a `PropertyFeatures` object containing the input data for prediction.
@@ -100,64 +251,121 @@ def predict(features: PropertyFeatures):
     :raises 500 if any error occurs during data preparation, transformation, or prediction.
     """
 
-    district_name = 'DISTRICTS_'+unidecode(features.district).upper()
-    location_name = unidecode(features.location).upper()
+    try:
+        # The row is copied, the buffer of the encoder is shared by all the requests of the event loop
+        row = encoder.encode_row(features)[0].copy()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        data_dict = {
-            'CONSTRUCTEDAREA': features.constructed_area,
-            'HASTERRACE': features.has_terrace,
-            'ISPARKINGSPACEINCLUDEDINPRICE': features.is_parkingspace_included,
-            'ROOMNUMBER': features.number_of_rooms,
-            'BATHNUMBER': features.number_of_bathrooms,
-            'HASSWIMMINGPOOL': features.has_swimming_pool,
-            'ISINTOPFLOOR': features.is_top_floor,
-            'DISTANCE_TO_CITY_CENTER': features.distance_to_city_center,
-            'DISTANCE_TO_METRO': features.distance_to_city_metro,
-            'DISTANCE_TO_CASTELLANA': features.distance_to_city_castellana,
-            'CADMAXBUILDINGFLOOR': features.constructed_year,
-            'FLOORCLEAN': features.floorclean
-        }
-
-        group_name = None
-
-        # Find which group the location belongs to
-        for key, value in location_name_map.items():
-            if location_name == key:
-                group_name = 'LOCATIONNAME_' + str(value)
-                break
-
-        if group_name is None:
-            raise HTTPException(status_code=400, detail=f"Invalid location name: {location_name}")
-
-        # Add the value of each location column to the data_dict
-        for location in LOCATION_COLUMNS:
-            if group_name == location:
-                data_dict[location] = 1
-            else:
-                data_dict[location] = 0
-
-        # Add the value of each district column to the data_dict
-        for district in DISTRICT_COLUMNS:
-            if district_name == district:
-                data_dict[district] = 1
-            else:
-                data_dict[district] = 0
-
-        if district_name not in DISTRICT_COLUMNS:
-            raise HTTPException(status_code=400, detail=f"Invalid district name: {district_name}")
-
-        df = pd.DataFrame([data_dict])
-
-        continuous_features = ['CONSTRUCTEDAREA', 'CADMAXBUILDINGFLOOR',
-                               'DISTANCE_TO_CITY_CENTER', 'DISTANCE_TO_METRO', 'DISTANCE_TO_CASTELLANA', 'ROOMNUMBER',
-                               'BATHNUMBER', 'FLOORCLEAN']
-        df[continuous_features] = scaler.transform(df[continuous_features])
-
-        prediction = model.predict(df)
-
-        return {"Predicted label": prediction[0]}
+        prediction = await batcher.predict(row)
+
+        return {"Predicted label": float(prediction)}
 
     except Exception as e:
         logger.exception("Prediction failed")
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+
+# Define the endpoint with the information of the loaded model
+@router.get("/model_info", summary="Information about the model used for predictions")
+def model_info():
+    """
+    Return the registered model name, version and artifact hash of the model in use, where it was
+    loaded from (`cache`, `local` store or tracking `server`), the serving mode, the thread profile and how long
+    the startup took.
+
+    With `INFERENCE_EXECUTOR=process` the API process does not hold the model: the stats are read from one of
+    the worker processes, which load it when the pool starts.
+    """
+    if INFERENCE_EXECUTOR == "process":
+        stats = inference_executor.call(read_model_load_stats)
+    else:
+        get_model()
+        stats = model_load_stats
+
+    return dict(stats, serving_mode=MODEL_SERVING_MODE, inference_executor=INFERENCE_EXECUTOR,
+                thread_profile=INFERENCE_PROFILE, inference_workers=INFERENCE_WORKERS,
+                threads_per_worker=INFERENCE_THREADS_PER_WORKER)
+
+
+# Define the endpoint with the metrics of the micro-batcher
+@router.get("/batching_stats", summary="Batch sizes achieved by the micro-batcher")
+def batching_stats():
+    """
+    Return the configuration of the micro-batcher and the number of batches, rows and the histogram of the
+    batch sizes it achieved.
+    """
+    return batcher.stats()
+
+
+# Define the endpoint with the metrics of the inference executor
+@router.get("/metrics", summary="Metrics of the inference executor and the micro-batcher")
+def metrics():
+    """
+    Return the metrics of the predictions:
+    - `inference`: configuration of the inference executor, queue depth (predictions waiting for a free
+      worker) and the wait and run times in milliseconds (mean, p50, p95 and max of the last predictions).
+    - `batching`: batch sizes achieved by the micro-batcher.
+    """
+    return {"inference": inference_executor.stats(), "batching": batcher.stats()}
+
+
+# Define the batch prediction endpoint
+@router.post("/batch", summary="Predict the price of a batch of properties")
+def predict_many(
+        payload: Union[List[Dict[str, Any]], Dict[str, List[Any]]] = Body(
+            ..., description="List of properties or columnar object with one list per feature"),
+       ):
+    """
+    Predict the price of many properties with a single call to the model.
+
+    - Accepts a list of `PropertyFeatures` objects, or a columnar object where each feature
+      of `PropertyFeatures` maps to a list of values (one per property).
+    - Validates every row independently, so an invalid property does not fail the whole batch.
+    - Encodes all the valid rows into one NumPy matrix and predicts it with a single call to the
+      serving pipeline (folded scaler + Voting Regressor).
+
+    :param payload: list of properties or columnar object.
+
+    :returns: JSON with the predicted labels in the same order as the input (`null` for the rows
+        that failed) and the list of errors with the index of the row they refer to.
+
+    :raises 422 if the columnar body has lists of different lengths.
+    :raises 500 if any error occurs during the prediction of the batch.
+    """
+    rows = rows_from_payload(payload)
+
+    features = []
+    positions = []
+    errors = []
+
+    # Validate every row on its own
+    for position, row in enumerate(rows):
+        try:
+            features.append(PropertyFeatures.model_validate(row))
+            positions.append(position)
+        except ValidationError as e:
+            errors.append({"index": position, "detail": e.errors(include_url=False, include_input=False)})
+
+    X, valid_positions, encoding_errors = encoder.encode_batch(features)
+
+    # Translate the positions of the encoder back to the positions of the request
+    for error in encoding_errors:
+        error["index"] = positions[error["index"]]
+    errors.extend(encoding_errors)
+
+    try:
+        predictions = predict_batch(X)
+    except Exception as e:
+        logger.exception("Batch prediction failed")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+    predicted_labels = [None] * len(rows)
+    for position, prediction in zip(valid_positions, predictions):
+        predicted_labels[positions[position]] = float(prediction)
+
+    return {
+        "Predicted labels": predicted_labels,
+        "errors": sorted(errors, key=lambda error: error["index"]),
+    }
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from app.serving.property_store import load_district_properties
+from app.serving.property_query import load_property_query_engine, filter_properties
+
+# Columns of every property in the response
+RESPONSE_COLUMNS = [
+    'PRICE', 'UNITPRICE', 'CONSTRUCTEDAREA', 'ROOMNUMBER', 'BATHNUMBER',
+    'CADCONSTRUCTIONYEAR', 'DISTRICT', 'LATITUDE', 'LONGITUDE'
+]
+
+# Define the APIRouter instance
+router = APIRouter()
+
+
+@router.get("")
+def query_properties(
+        district: Optional[str] = Query(None, description="District name to filter by"),
+        room_number: Optional[int] = Query(None, description="Number of rooms to filter by"),
+        bathroom_number: Optional[int] = Query(None, description="Number of bathrooms to filter by"),
+        price_min: Optional[int] = Query(None, description="Minimum price to filter by"),
+        price_max: Optional[int] = Query(None, description="Maximum price to filter by"),
+        constructed_area_min: Optional[int] = Query(None, description="Minimum constructed area to filter by"),
+        constructed_area_max: Optional[int] = Query(None, description="Maximum constructed area to filter by"),
+        limit: int = Query(100, ge=1, le=1000, description="Maximum number of properties to return"),
+        offset: int = Query(0, ge=0, description="Number of matching properties to skip"),
+       ):
+    """
+    Return the properties that match the filters as JSON.
+
+    ## Features
+    - Same filters as the map by district, but every filter is optional (district included).
+    - The filters are resolved with the in-memory query engine (`app/serving/property_query.py`), so only
+      the returned page of properties is materialized.
+    - Paginated with `limit` and `offset`. `total` is the number of matching properties.
+
+    ## Returns
+    - JSON with `total`, `offset`, `limit` and the list of `properties` (missing values are `null`).
+
+    ## Raises
+    - HTTPException 404: If the district is not found.
+    - HTTPException 500: For any unexpected errors during processing.
+    """
+    try:
+        gdf_properties = load_district_properties()
+        engine = load_property_query_engine()
+
+        if district is not None and district not in gdf_properties['DISTRICT'].cat.categories:
+            raise HTTPException(status_code=404, detail="District not found")
+
+        rows = filter_properties(
+            engine,
+            district=district,
+            room_number=room_number,
+            bathroom_number=bathroom_number,
+            price_min=price_min,
+            price_max=price_max,
+            constructed_area_min=constructed_area_min,
+            constructed_area_max=constructed_area_max,
+        )
+
+        # Take only the rows of the requested page
+        page = gdf_properties.iloc[rows[offset:offset + limit]][RESPONSE_COLUMNS]
+        page = page.astype(object).where(page.notna(), None)
+
+        return {
+            "total": int(len(rows)),
+            "offset": offset,
+            "limit": limit,
+            "properties": page.to_dict(orient="records"),
+        }
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from app.serving.property_store import load_stats_cube
+from src.data_processing.build_stats_cube import load_location_name_map
+from src.data_processing.feature_encoder import normalize_name
+
+# Define the APIRouter instance
+router = APIRouter()
+
+# Dictionary from normalized location name to its group, loaded once
+location_name_map = load_location_name_map()
+
+
+@router.get("")
+def get_stats(
+        district: Optional[str] = Query(None, description="District name"),
+        location: Optional[str] = Query(None, description="Location name, its location group is used"),
+        room_number: Optional[int] = Query(None, ge=0, description="Number of rooms"),
+        bathroom_number: Optional[int] = Query(None, ge=0, description="Number of bathrooms"),
+       ):
+    """
+    Return price statistics of the listings from the precomputed statistics cube.
+
+    ## Features
+    - The cube (`python -m src.data_processing.build_stats_cube`) keeps, for every district x location group
+      x rooms x bathrooms cell, the number of listings, the mean and a histogram of `PRICE` and `UNITPRICE`.
+    - Every parameter is optional, the dimensions that are not given are aggregated. The cost does not
+      depend on the number of listings.
+    - The quantiles are approximated from the histograms (log spaced bins, about 5% wide).
+    - Rooms above `MAX_ROOMS` (6) and bathrooms above `MAX_BATHS` (4) share the last bucket.
+
+    ## Returns
+    - JSON with the filters, the `count` of listings and the `mean` and quantiles (`p10`, `p25`, `p50`, `p75`,
+      `p90`) of `PRICE` and `UNITPRICE`. The statistics of an empty cell are `null`.
+
+    ## Raises
+    - HTTPException 404: If the district or the location is not found.
+    - HTTPException 500: For any unexpected errors during processing.
+    """
+    try:
+        cube = load_stats_cube()
+
+        district_index = None
+        if district is not None:
+            if district not in cube.districts:
+                raise HTTPException(status_code=404, detail="District not found")
+            district_index = cube.districts.index(district)
+
+        location_group = None
+        if location is not None:
+            location_group = location_name_map.get(normalize_name(location))
+            if location_group is None:
+                raise HTTPException(status_code=404, detail="Location not found")
+
+        stats = cube.summary(district=district_index, location_group=location_group,
+                             room_number=room_number, bathroom_number=bathroom_number)
+
+        return {
+            "filters": {
+                "district": district,
+                "location_group": location_group,
+                "room_number": room_number,
+                "bathroom_number": bathroom_number,
+            },
+            **stats,
+        }
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
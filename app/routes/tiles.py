@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException
+from app.serving.tiles import load_price_tiles, BIN_DEPTH
+
+# Define the APIRouter instance
+router = APIRouter()
+
+
+@router.get("/{z}/{x}/{y}")
+def get_tile(z: int, x: int, y: int):
+    """
+    Return the price aggregates of the properties inside a map tile.
+
+    ## Features
+    - Tiles follow the usual `z/x/y` Web Mercator scheme used by Leaflet.
+    - Every tile is divided into 2^BIN_DEPTH x 2^BIN_DEPTH quadkey bins. The count, mean and median `PRICE`
+      and mean `UNITPRICE` of every non empty bin are precomputed for every zoom level once per version of the
+      property store (see `app/serving/tiles.py`), so only the aggregates of the visible tiles are sent to the map.
+
+    ## Returns
+    - JSON with the tile coordinates, the bins per side and the list of non empty `bins`.
+
+    ## Raises
+    - HTTPException 404: If the zoom level has no tiles or the tile is outside the grid.
+    - HTTPException 500: For any unexpected errors during processing.
+    """
+    try:
+        tiles = load_price_tiles()
+
+        if z not in tiles.levels:
+            raise HTTPException(status_code=404,
+                                detail=f"Zoom level not available, use {tiles.min_zoom} to {tiles.max_zoom}")
+
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise HTTPException(status_code=404, detail="Tile not found")
+
+        return {"z": z, "x": x, "y": y, "bins_per_side": 2 ** BIN_DEPTH, "bins": tiles.tile(z, x, y)}
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -0,0 +1,159 @@
+import base64
+import numpy as np
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+# Number of colors the price scale is quantized into
+PALETTE_SIZE = 64
+
+
+def encode_array(values, dtype):
+    """Return the base64 of the raw bytes of `values` cast to `dtype` (read as a JS typed array)."""
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+def build_palette(colormap):
+    """Quantize the price scale of a colormap into PALETTE_SIZE colors."""
+    return [colormap(value) for value in np.linspace(colormap.vmin, colormap.vmax, PALETTE_SIZE)]
+
+
+class CanvasPointLayer(MacroElement):
+    """
+    Folium layer that draws every point on a single Leaflet canvas from one compact payload.
+
+    Instead of one `folium.CircleMarker` (with its own JS statement and popup) per row, the coordinates,
+    prices and color indexes are shipped as base64 typed arrays and the markers are created in the browser
+    with a shared `L.canvas` renderer. The popup is built on click.
+
+    :param latitude: array with the latitude of the points.
+    :param longitude: array with the longitude of the points.
+    :param price: array with the price of the points.
+    :param colormap: branca colormap used to color the points by price.
+    :param radius: radius of the markers in pixels.
+    :param fill_opacity: fill opacity of the markers.
+    """
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            function decode(data, type) {
+                var bytes = Uint8Array.from(atob(data), function(c) { return c.charCodeAt(0); });
+                return new type(bytes.buffer);
+            }
+
+            var latitude = decode("{{ this.latitude }}", Float32Array);
+            var longitude = decode("{{ this.longitude }}", Float32Array);
+            var price = decode("{{ this.price }}", Uint32Array);
+            var color = decode("{{ this.color }}", Uint8Array);
+            var palette = {{ this.palette|tojson }};
+
+            var renderer = L.canvas({padding: 0.5});
+            var layer = L.featureGroup();
+            for (var i = 0; i < latitude.length; i++) {
+                var marker = L.circleMarker([latitude[i], longitude[i]], {
+                    renderer: renderer,
+                    radius: {{ this.radius }},
+                    color: palette[color[i]],
+                    fill: true,
+                    fillColor: palette[color[i]],
+                    fillOpacity: {{ this.fill_opacity }}
+                });
+                marker.price = price[i];
+                layer.addLayer(marker);
+            }
+
+            layer.on("click", function(e) {
+                var text = "Price: €" + e.layer.price.toString().replace(/\\B(?=(\\d{3})+(?!\\d))/g, ".");
+                L.popup().setLatLng(e.latlng).setContent(text).openOn({{ this._parent.get_name() }});
+            });
+            layer.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, latitude, longitude, price, colormap, radius=1, fill_opacity=0.05):
+        super().__init__()
+        self._name = "CanvasPointLayer"
+
+        # Rows without price or coordinates cannot be drawn
+        latitude, longitude, price = (np.asarray(values, dtype=np.float64) for values in (latitude, longitude, price))
+        valid = ~(np.isnan(latitude) | np.isnan(longitude) | np.isnan(price))
+        latitude, longitude, price = latitude[valid], longitude[valid], price[valid]
+
+        # Quantize the price scale into a palette, so every point only carries a one byte color index
+        self.palette = build_palette(colormap)
+        color = np.clip(np.rint((price - colormap.vmin) / (colormap.vmax - colormap.vmin) * (PALETTE_SIZE - 1)),
+                        0, PALETTE_SIZE - 1)
+
+        self.latitude = encode_array(latitude, np.float32)
+        self.longitude = encode_array(longitude, np.float32)
+        self.price = encode_array(np.clip(price, 0, np.iinfo(np.uint32).max), np.uint32)
+        self.color = encode_array(color, np.uint8)
+        self.radius = radius
+        self.fill_opacity = fill_opacity
+
+
+class TileAggregateLayer(MacroElement):
+    """
+    Folium layer that draws the price aggregates served by `/api/v1/tiles/{z}/{x}/{y}`.
+
+    Leaflet only requests the tiles of the current viewport. Every bin is drawn on the canvas of its tile as
+    a circle colored by its mean price, with a radius that grows with the number of properties.
+
+    :param url: URL template of the tiles (with `{z}`, `{x}` and `{y}`).
+    :param colormap: branca colormap used to color the bins by mean price.
+    :param min_zoom: lowest zoom level with tiles.
+    :param max_zoom: highest zoom level with tiles, the map scales them beyond it.
+    """
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var palette = {{ this.palette|tojson }};
+            var vmin = {{ this.vmin }}, vmax = {{ this.vmax }};
+            var url = {{ this.url|tojson }};
+
+            var layer = L.gridLayer({minZoom: {{ this.min_zoom }}, maxNativeZoom: {{ this.max_zoom }}});
+            layer.createTile = function(coords, done) {
+                var tile = L.DomUtil.create("canvas", "leaflet-tile");
+                var size = this.getTileSize();
+                tile.width = size.x;
+                tile.height = size.y;
+
+                var tileUrl = url.replace("{z}", coords.z).replace("{x}", coords.x).replace("{y}", coords.y);
+                fetch(tileUrl).then(function(response) {
+                    return response.ok ? response.json() : {bins: [], bins_per_side: 1};
+                }).then(function(data) {
+                    var context = tile.getContext("2d");
+                    var cell = size.x / data.bins_per_side;
+                    context.globalAlpha = 0.6;
+                    data.bins.forEach(function(bin) {
+                        var index = Math.round((bin.mean_price - vmin) / (vmax - vmin) * (palette.length - 1));
+                        context.fillStyle = palette[Math.max(0, Math.min(palette.length - 1, index))];
+                        context.beginPath();
+                        context.arc((bin.column + 0.5) * cell, (bin.row + 0.5) * cell,
+                                    Math.min(cell / 2, 2 + Math.log2(1 + bin.count)), 0, 2 * Math.PI);
+                        context.fill();
+                    });
+                    done(null, tile);
+                }).catch(function(error) {
+                    done(error, tile);
+                });
+
+                return tile;
+            };
+            layer.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, colormap, min_zoom, max_zoom):
+        super().__init__()
+        self._name = "TileAggregateLayer"
+        self.url = url
+        self.palette = build_palette(colormap)
+        self.vmin = float(colormap.vmin)
+        self.vmax = float(colormap.vmax)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+import numpy as np
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
+from utils.thread_budget import limit_model_threads, limit_process_threads
+
+# Number of recent predictions used to compute the percentiles of the metrics
+METRICS_WINDOW = 1024
+
+# Model of the worker processes, loaded by `init_process_worker`
+worker_model = None
+
+
+def init_process_worker(load_fn, n_threads):
+    """Initializer of the worker processes: limit the native thread pools and load the model."""
+    global worker_model
+
+    limit_process_threads(n_threads)
+    worker_model = limit_model_threads(load_fn(), n_threads)
+
+
+def init_thread_worker(n_threads):
+    """
+    Initializer of the worker threads: limit the native thread pools. The OpenMP limit of XGBoost and
+    scikit-learn applies to the thread that sets it, so every worker thread sets its own.
+    """
+    threadpool_limits(limits=n_threads)
+
+
+def predict_in_worker(X):
+    """Predict with the model of the worker process."""
+    return worker_model.predict(X)
+
+
+def _timed(fn, X):
+    """Run a prediction and return the wall clock time it started and finished, with its result."""
+    start = time.time()
+    result = fn(X)
+    return start, time.time(), result
+
+
+class InferenceExecutor:
+    """
+    Dedicated, size-bounded pool where the model predicts.
+
+    The predictions do not run in the default threadpool of FastAPI, where they would compete with the other
+    sync routes (e.g. the map renderers), but in their own pool:
+    - `mode="thread"`: `max_workers` threads of the API process calling `predict_fn`. The BLAS/OpenMP thread
+      pools are limited to `threads_per_worker` with threadpoolctl.
+    - `mode="process"`: `max_workers` processes, each one loads the model with `load_fn` and limits its
+      native thread pools to `threads_per_worker` before predicting.
+
+    The queue depth (predictions waiting for a free worker), the wait time in the queue and the run time of
+    the predictions are recorded.
+
+    :param predict_fn: function that predicts a matrix in the API process (thread mode).
+    :param load_fn: module level function that returns the model (process mode).
+    :param max_workers: number of threads or processes.
+    :param threads_per_worker: threads each prediction may use.
+    :param mode: "thread" or "process".
+    """
+
+    def __init__(self, predict_fn=None, load_fn=None, max_workers=1, threads_per_worker=1, mode="thread"):
+        self.predict_fn = predict_fn
+        self.load_fn = load_fn
+        self.max_workers = max_workers
+        self.threads_per_worker = threads_per_worker
+        self.mode = mode
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = deque(maxlen=METRICS_WINDOW)
+        self.run_seconds = deque(maxlen=METRICS_WINDOW)
+
+    def _get_pool(self):
+        """Create the pool the first time it is needed."""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    if self.mode == "process":
+                        self._pool = ProcessPoolExecutor(
+                            self.max_workers, initializer=init_process_worker,
+                            initargs=(self.load_fn, self.threads_per_worker)
+                        )
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            self.max_workers, thread_name_prefix="inference", initializer=init_thread_worker,
+                            initargs=(self.threads_per_worker,)
+                        )
+        return self._pool
+
+    def submit(self, X):
+        """
+        Submit the prediction of a matrix.
+
+        :param X: encoded matrix.
+        :return: concurrent.futures.Future with the predictions
+        """
+        fn = predict_in_worker if self.mode == "process" else self.predict_fn
+        submitted_at = time.time()
+
+        with self._stats_lock:
+            self.submitted += 1
+            self.in_flight += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue_depth())
+
+        result = Future()
+        future = self._get_pool().submit(_timed, fn, X)
+        future.add_done_callback(lambda done: self._record(done, submitted_at, result))
+        return result
+
+    def _queue_depth(self):
+        # The pool runs one prediction per worker, the rest are waiting in its queue
+        return max(self.in_flight - self.max_workers, 0)
+
+    async def predict(self, X):
+        """Predict a matrix in the pool without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(X))
+
+    def call(self, fn, *args):
+        """
+        Run a module level function in a worker of the pool and return its result, e.g. to read the state of a
+        worker process. The call is not recorded in the metrics.
+        """
+        return self._get_pool().submit(fn, *args).result()
+
+    def _record(self, future, submitted_at, result):
+        """Record the metrics of a finished prediction and set the predictions as result."""
+        try:
+            started_at, finished_at, predictions = future.result()
+        except BaseException as e:
+            with self._stats_lock:
+                self.in_flight -= 1
+                self.failed += 1
+            result.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.wait_seconds.append(max(started_at - submitted_at, 0.0))
+            self.run_seconds.append(finished_at - started_at)
+        result.set_result(predictions)
+
+    def stats(self):
+        """Return the configuration of the pool, the queue depth and the wait and run times in milliseconds."""
+        def summary(values):
+            if not values:
+                return None
+            values = np.array(values) * 1000
+            return {
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+            }
+
+        with self._stats_lock:
+            return {
+                "mode": self.mode,
+                "max_workers": self.max_workers,
+                "threads_per_worker": self.threads_per_worker,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "in_flight": self.in_flight,
+                "queue_depth": self._queue_depth(),
+                "max_queue_depth": self.max_queue_depth,
+                "wait_ms": summary(self.wait_seconds),
+                "run_ms": summary(self.run_seconds),
+            }
+
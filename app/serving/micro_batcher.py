@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-row predictions into batched calls to the model.
+
+    Every request puts its encoded row in a queue and awaits its result. A background task takes the first
+    queued row, keeps collecting rows until `max_batch_size` rows are queued or `max_latency_ms` have passed
+    since the first one, predicts them with a single call to `predict_fn` (a coroutine, e.g. the prediction
+    in the inference executor, so the event loop keeps accepting requests) and sets the result of every
+    request.
+
+    Every batch is predicted in its own task, so up to `max_concurrency` batches are in flight at the same
+    time (one per worker of the inference executor). When all of them are busy, the next batch is only
+    collected once one finishes, so the rows that arrive in the meantime join it instead of queueing behind it.
+
+    The model is much cheaper per row on a batch: XGBoost and the Random Forest traverse their trees for
+    the whole matrix at once and the Voting Regressor overhead is paid once per batch.
+
+    :param predict_fn: coroutine function that predicts an (n_rows, n_features) matrix and returns n_rows values.
+    :param max_batch_size: maximum number of rows predicted at once.
+    :param max_latency_ms: maximum time the first row of a batch waits for other rows.
+    :param max_concurrency: maximum number of batches predicted at the same time.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_latency_ms=2.0, max_concurrency=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.max_concurrency = max_concurrency
+
+        self._loop = None
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._batch_tasks = set()
+        self._start_lock = threading.Lock()
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.batch_sizes = {}
+
+    def _ensure_started(self):
+        """Start the batching task on the running event loop (again if the loop changed)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+
+        with self._start_lock:
+            if self._loop is not loop or self._task is None or self._task.done():
+                self._loop = loop
+                self._queue = asyncio.Queue()
+                self._slots = asyncio.Semaphore(self.max_concurrency)
+                self._task = loop.create_task(self._run())
+
+    async def predict(self, row):
+        """
+        Predict a single encoded row, batched with the other rows that arrive at the same time.
+
+        :param row: encoded row with n_features values. It is not copied, so it must not be reused by the
+            caller until the result is returned.
+        :return: the prediction of the row.
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((row, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for the first row, then collect rows until the batch is full or the latency budget is spent."""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_latency
+
+        while len(batch) < self.max_batch_size:
+            # Take the rows that are already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot before collecting, the rows keep queueing while every slot is busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            # Predict the batch in its own task and go back to collecting the next one
+            task = self._loop.create_task(self._predict_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _predict_batch(self, batch):
+        """Predict a batch and set the result of every request, then free its slot."""
+        try:
+            # Requests cancelled while waiting (e.g. the client disconnected) are not predicted
+            batch = [(row, future) for row, future in batch if not future.done()]
+            if not batch:
+                return
+
+            try:
+                X = np.stack([row for row, _ in batch])
+                predictions = await self.predict_fn(X)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+
+            self._record(len(batch))
+        finally:
+            self._slots.release()
+
+    def _record(self, batch_size):
+        with self._stats_lock:
+            self.batches += 1
+            self.rows += batch_size
+            self.batch_sizes[batch_size] = self.batch_sizes.get(batch_size, 0) + 1
+
+    def stats(self):
+        """Return the configuration and the achieved batch sizes."""
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_latency_ms": self.max_latency * 1000,
+                "max_concurrency": self.max_concurrency,
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches else None,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
@@ -0,0 +1,116 @@
+import numpy as np
+
+from app.serving.property_store import load_district_properties, reload_on_change, DISTRICT_PROPERTIES_STORE, \
+    DISTRICTS_POLYGONS_PATH
+
+# Columns with a sorted index, filtered with range predicates (min and/or max)
+RANGE_COLUMNS = ['PRICE', 'CONSTRUCTEDAREA']
+
+# Columns with a bitmap index, filtered with equality predicates
+BITMAP_COLUMNS = ['ROOMNUMBER', 'BATHNUMBER', 'DISTRICT']
+
+
+class PropertyQueryEngine:
+    """
+    Filter the rows of the property store with indexes built once, instead of chaining boolean masks over
+    copies of the DataFrame on every request.
+
+    - Sorted index per range column: the positions of the rows sorted by value, so a range predicate is two
+      binary searches and returns a contiguous slice of positions.
+    - Bitmap index per equality column: a packed bitmap (one bit per row) for every distinct value.
+
+    The predicates are combined with bitwise AND over the packed bitmaps, and only the final row positions
+    are materialized.
+
+    :param df: DataFrame of the property store.
+    :param range_columns: columns with a sorted index.
+    :param bitmap_columns: columns with a bitmap index.
+    """
+
+    def __init__(self, df, range_columns=RANGE_COLUMNS, bitmap_columns=BITMAP_COLUMNS):
+        self.n_rows = len(df)
+
+        # Sorted indexes, the rows with a missing value never match a range predicate
+        self.sorted_indexes = {}
+        for column in range_columns:
+            values = df[column].to_numpy(dtype=np.float64)
+            positions = np.flatnonzero(~np.isnan(values))
+            order = positions[np.argsort(values[positions], kind='stable')]
+            self.sorted_indexes[column] = (values[order], order)
+
+        # Bitmap indexes, one packed bitmap per distinct value
+        self.bitmaps = {}
+        for column in bitmap_columns:
+            codes, uniques = df[column].factorize()
+            self.bitmaps[column] = {
+                value: np.packbits(codes == code)
+                for code, value in enumerate(uniques)
+            }
+
+        self._empty = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def _range_bitmap(self, column, low=None, high=None):
+        """Return the packed bitmap of the rows with `low <= column <= high` (None means unbounded)."""
+        sorted_values, order = self.sorted_indexes[column]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[order[start:stop]] = True
+        return np.packbits(mask)
+
+    def query(self, equals=None, ranges=None):
+        """
+        Return the positions of the rows that match every predicate.
+
+        :param equals: dictionary from bitmap column to the value it must be equal to.
+        :param ranges: dictionary from range column to a (min, max) tuple, either bound can be None.
+        :return: sorted array with the positions of the matching rows.
+        """
+        bitmap = None
+
+        # Equality predicates, an unknown value matches no row
+        for column, value in (equals or {}).items():
+            value_bitmap = self.bitmaps[column].get(value, self._empty)
+            bitmap = value_bitmap.copy() if bitmap is None else np.bitwise_and(bitmap, value_bitmap, out=bitmap)
+
+        # Range predicates
+        for column, (low, high) in (ranges or {}).items():
+            if low is None and high is None:
+                continue
+            value_bitmap = self._range_bitmap(column, low, high)
+            bitmap = value_bitmap if bitmap is None else np.bitwise_and(bitmap, value_bitmap, out=bitmap)
+
+        if bitmap is None:
+            return np.arange(self.n_rows)
+
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.n_rows))
+
+
+@reload_on_change(DISTRICT_PROPERTIES_STORE, DISTRICTS_POLYGONS_PATH)
+def load_property_query_engine():
+    """Return the query engine over the properties of the map by district, built once per version of the store."""
+    return PropertyQueryEngine(load_district_properties())
+
+
+def filter_properties(engine, district=None, room_number=None, bathroom_number=None, price_min=None,
+                      price_max=None, constructed_area_min=None, constructed_area_max=None):
+    """
+    Translate the filters of the property endpoints into a query of the engine.
+
+    :return: sorted array with the positions of the matching rows.
+    """
+    equals = {}
+    if district is not None:
+        equals['DISTRICT'] = district
+    if room_number is not None:
+        equals['ROOMNUMBER'] = room_number
+    if bathroom_number is not None:
+        equals['BATHNUMBER'] = bathroom_number
+
+    ranges = {
+        'PRICE': (price_min, price_max),
+        'CONSTRUCTEDAREA': (constructed_area_min, constructed_area_max),
+    }
+
+    return engine.query(equals=equals, ranges=ranges)
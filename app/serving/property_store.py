@@ -0,0 +1,150 @@
+import os
+import hashlib
+import functools
+import logging
+import threading
+import pandas as pd
+import geopandas as gpd
+
+from src.data_processing import build_property_store
+from src.data_processing.build_property_store import ALL_PROPERTIES_CSV, ALL_PROPERTIES_STORE, \
+    ALL_PROPERTIES_COLUMNS, DISTRICT_PROPERTIES_CSV, DISTRICT_PROPERTIES_STORE, DISTRICT_PROPERTIES_COLUMNS, \
+    DISTRICTS_POLYGONS_PATH, project_root, build_store, assign_districts
+from src.data_processing.build_stats_cube import STATS_CUBE_PATH, StatsCube, build_stats_cube
+from utils.file_hash import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# District boundaries of the map of all Madrid
+DISTRICTS_GEOJSON_PATH = os.path.join(project_root, 'data', 'new_data', 'madrid-districts.geojson.txt')
+
+
+def read_store(store_path, csv_path, columns, with_districts=False):
+    """
+    Read a Parquet file of the property store. If it has not been built yet, it is built from its source
+    CSV (only once, the result is written to disk for the next processes).
+    """
+    if not os.path.exists(store_path):
+        logger.warning(f"{store_path} not found, building it from {csv_path}. "
+                       f"Run `python -m src.data_processing.build_property_store` to build it in advance")
+        return build_store(csv_path, store_path, columns, with_districts=with_districts)
+
+    return pd.read_parquet(store_path)
+
+
+def file_signature(path):
+    """
+    Return the (mtime in nanoseconds, size) of a data file, or None if it does not exist.
+
+    The data files are only replaced as a whole (the builders write a temporary file and rename it), so a new
+    file always has a new signature. Reading it is one `os.stat`, cheap enough to run on every request.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def dataset_version(*paths):
+    """
+    Return a hash of the signatures of the data files a response is built from, used to key the response
+    caches. It changes as soon as one of the files is rebuilt.
+
+    :param paths: paths of the data files.
+    :return: hexadecimal sha256
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(repr(file_signature(path)).encode("ascii"))
+    return digest.hexdigest()
+
+
+def reload_on_change(*paths):
+    """
+    Cache the result of a loader until one of its data files changes.
+
+    The loader runs on the first call and again on the first call after the signature of one of the files
+    changed (see `file_signature`), so a running process serves a rebuilt store without a restart. Concurrent
+    calls wait for a single reload.
+
+    :param paths: paths of the data files the loader reads, directly or through other loaders.
+    """
+    def decorator(loader):
+        lock = threading.Lock()
+        cached = {}
+
+        @functools.wraps(loader)
+        def wrapper():
+            signature = tuple(file_signature(path) for path in paths)
+            if cached.get("signature") != signature:
+                with lock:
+                    if cached.get("signature") != signature:
+                        cached["value"] = loader()
+                        cached["signature"] = signature
+            return cached["value"]
+
+        return wrapper
+
+    return decorator
+
+
+@reload_on_change(ALL_PROPERTIES_STORE)
+def load_all_properties():
+    """
+    Return the properties of the map of all Madrid (PRICE, LONGITUDE, LATITUDE).
+
+    The store is read once per version of its file, the returned DataFrame is shared and must not be modified.
+    """
+    return read_store(ALL_PROPERTIES_STORE, ALL_PROPERTIES_CSV, ALL_PROPERTIES_COLUMNS)
+
+
+@reload_on_change(DISTRICT_PROPERTIES_STORE, DISTRICTS_POLYGONS_PATH)
+def load_district_properties():
+    """
+    Return the properties of the map by district as a GeoDataFrame with point geometries built from the
+    LONGITUDE/LATITUDE columns and the categorical DISTRICT column assigned when the store was built.
+
+    The store is read once per version of its file, the returned GeoDataFrame is shared and must not be
+    modified.
+    """
+    df = read_store(DISTRICT_PROPERTIES_STORE, DISTRICT_PROPERTIES_CSV, DISTRICT_PROPERTIES_COLUMNS,
+                    with_districts=True)
+
+    # Stores built before the districts were pre-assigned get them once here
+    if 'DISTRICT' not in df.columns:
+        df['DISTRICT'] = assign_districts(df['LONGITUDE'], df['LATITUDE'], load_district_polygons())
+
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df['LONGITUDE'], df['LATITUDE']), crs='EPSG:4326')
+
+
+@reload_on_change(DISTRICTS_GEOJSON_PATH)
+def load_district_boundaries():
+    """Return the GeoDataFrame of the district boundaries of the map of all Madrid."""
+    gdf_districts = gpd.read_file(DISTRICTS_GEOJSON_PATH)
+
+    # Drop unnecessary columns that could cause JSON issues
+    return gdf_districts.drop(columns=['created_at', 'updated_at'], errors='ignore')
+
+
+@reload_on_change(DISTRICTS_POLYGONS_PATH)
+def load_district_polygons():
+    """Return the GeoDataFrame of the district polygons (column DISTRICTS) drawn on the map by district."""
+    return build_property_store.load_district_polygons()
+
+
+@reload_on_change(STATS_CUBE_PATH)
+def load_stats_cube():
+    """
+    Return the price statistics cube (see `src/data_processing/build_stats_cube.py`). If it has not been
+    built yet, it is built from the district property store. It is loaded again when the cube file changes,
+    e.g. after new listings were appended to it.
+    """
+    if not os.path.exists(STATS_CUBE_PATH):
+        logger.warning(f"{STATS_CUBE_PATH} not found, building it from the property store. "
+                       f"Run `python -m src.data_processing.build_stats_cube` to build it in advance")
+        # The store is built from the district CSV, recorded as the source of the cube so it is not appended again
+        source = file_sha256(DISTRICT_PROPERTIES_CSV) if os.path.exists(DISTRICT_PROPERTIES_CSV) else None
+        return build_stats_cube(load_district_properties(), source=source)
+
+    return StatsCube.load(STATS_CUBE_PATH)
@@ -0,0 +1,122 @@
+import gzip
+import os
+import threading
+
+from fastapi.responses import Response
+
+# Brotli is optional, without it only the gzip variant is stored
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Seconds the clients may reuse a rendered response before revalidating it with If-None-Match
+RENDER_CACHE_MAX_AGE = int(os.environ.get("RENDER_CACHE_MAX_AGE", "3600"))
+
+
+class RenderedResponse:
+    """
+    A rendered response body with its compressed variants, compressed once when it is rendered.
+
+    :param body: rendered body (str or bytes).
+    :param version: version of the data the body was rendered from, used as ETag.
+    :param media_type: media type of the body.
+    """
+
+    def __init__(self, body, version, media_type="text/html"):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        self.version = version
+        self.media_type = media_type
+
+        # Encoding -> body, in order of preference
+        self.variants = {}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body)
+        self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        self.variants["identity"] = body
+
+    def etag(self, encoding):
+        """Return the ETag of a variant. The compressed variants have their own ETag, as their bytes differ."""
+        if encoding == "identity":
+            return f'"{self.version}"'
+        return f'"{self.version}-{encoding}"'
+
+    def select_encoding(self, accept_encoding):
+        """Return the preferred encoding accepted by the client (brotli, then gzip, then identity)."""
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in (accept_encoding or "").split(",")
+            if not part.strip().endswith(";q=0")
+        }
+        return next((encoding for encoding in self.variants if encoding in accepted), "identity")
+
+    def to_response(self, request, max_age=RENDER_CACHE_MAX_AGE):
+        """
+        Build the response for a request: a 304 if its If-None-Match matches, otherwise the preferred variant.
+
+        :param request: FastAPI request.
+        :param max_age: value of `max-age` in the Cache-Control header.
+        :return: Response
+        """
+        encoding = self.select_encoding(request.headers.get("accept-encoding"))
+        headers = {
+            "ETag": self.etag(encoding),
+            "Cache-Control": f"public, max-age={max_age}",
+            "Vary": "Accept-Encoding",
+        }
+
+        # Any variant of the same version is still valid for the client
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            client_etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+            if "*" in client_etags or client_etags & {self.etag(name) for name in self.variants}:
+                return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        return Response(content=self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+class RenderCache:
+    """
+    Cache of rendered responses keyed by the rendering options (e.g. map name and render mode) and the
+    version of the data they were rendered from, so a response is only rendered again when the data
+    changes. Only the latest version of every key is kept.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, version, render, media_type="text/html"):
+        """
+        Return the cached response of `key`, rendering it with `render()` on the first hit.
+
+        :param key: tuple with the rendering options.
+        :param version: version of the data the response is rendered from (see `dataset_version`).
+        :param render: function that returns the body of the response.
+        :return: RenderedResponse
+        """
+        key = tuple(key)
+        etag_version = "-".join([version[:32]] + [str(option) for option in key])
+
+        entry = self._entries.get(key)
+        if entry is None or entry.version != etag_version:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry.version != etag_version:
+                    entry = RenderedResponse(render(), etag_version, media_type=media_type)
+                    self._entries[key] = entry
+
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+# Cache of the rendered maps, shared by the whole process
+render_cache = RenderCache()
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of response bodies with a time to live.
+
+    - The entries are evicted in least recently used order when the total size of the bodies would exceed
+      `max_bytes`. A body larger than `max_bytes` is not cached.
+    - An entry older than `ttl_seconds` is treated as a miss.
+    - Every entry belongs to a version of the data. When a different version is requested, every entry of
+      the previous one is dropped.
+
+    :param max_bytes: maximum total size of the cached bodies.
+    :param ttl_seconds: seconds an entry is valid (None: no expiration).
+    """
+
+    def __init__(self, max_bytes, ttl_seconds=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.size_bytes = 0
+            self.version = version
+
+    def get(self, version, key):
+        """
+        Return the cached body of `key` for this version of the data, or None.
+
+        :param version: version of the data the body was rendered from (see `dataset_version`).
+        :param key: canonical tuple of the request parameters.
+        :return: bytes or None
+        """
+        with self._lock:
+            self._set_version(version)
+            entry = self._entries.get(key)
+
+            if entry is not None and self.ttl_seconds is not None \
+                    and time.monotonic() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, version, key, body):
+        """
+        Cache the body of `key` and evict the least recently used entries until it fits.
+
+        :param version: version of the data the body was rendered from (see `dataset_version`).
+        :param key: canonical tuple of the request parameters.
+        :param body: bytes of the response.
+        """
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._set_version(version)
+            if key in self._entries:
+                self._remove(key)
+
+            while self._entries and self.size_bytes + len(body) > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            self._entries[key] = (body, time.monotonic())
+            self.size_bytes += len(body)
+
+    def _remove(self, key):
+        body, _ = self._entries.pop(key)
+        self.size_bytes -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """Return the counters of the cache."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+                "version": self.version,
+            }
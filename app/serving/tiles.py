@@ -0,0 +1,170 @@
+import math
+import numpy as np
+
+from app.serving.property_store import load_district_properties, reload_on_change, DISTRICT_PROPERTIES_STORE, \
+    DISTRICTS_POLYGONS_PATH
+
+# Zoom levels with aggregation tiles
+MIN_ZOOM = 8
+MAX_ZOOM = 16
+
+# Every tile is divided into 2^BIN_DEPTH x 2^BIN_DEPTH bins (16 x 16 bins of 16 pixels in a 256 pixel tile)
+BIN_DEPTH = 4
+
+# Latitude limits of the Web Mercator projection
+MAX_LATITUDE = 85.05112878
+
+
+def lonlat_to_pixels(longitude, latitude, level):
+    """
+    Project coordinates to the integer cell indexes of a Web Mercator grid of 2^level x 2^level cells.
+
+    :return: tuple of int64 arrays (x, y)
+    """
+    n = 2 ** level
+    latitude = np.radians(np.clip(latitude, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitude) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(latitude) + 1.0 / np.cos(latitude)) / math.pi) / 2.0 * n
+    return np.clip(x.astype(np.int64), 0, n - 1), np.clip(y.astype(np.int64), 0, n - 1)
+
+
+def cell_center(x, y, level):
+    """Return the (latitude, longitude) of the center of a cell of the grid of `level`."""
+    n = 2 ** level
+    longitude = (x + 0.5) / n * 360.0 - 180.0
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return latitude, longitude
+
+
+def quadkey(x, y, level):
+    """Return the quadkey of a cell of the grid of `level`."""
+    digits = []
+    for i in range(level, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return "".join(digits)
+
+
+class PriceTiles:
+    """
+    Price aggregates of the properties in quadkey bins, precomputed for every zoom level.
+
+    At zoom `z` the bins are the cells of the grid of level `z + BIN_DEPTH`, and the tile `(z, x, y)` holds
+    the bins whose indexes shifted by BIN_DEPTH are `(x, y)`. For every non empty bin the count, the mean
+    and median PRICE and the mean UNITPRICE are stored. The aggregation is done once per zoom level with a
+    single sort of the properties, so serving a tile is a dictionary lookup plus a slice.
+
+    :param df: DataFrame with PRICE, UNITPRICE, LATITUDE and LONGITUDE columns.
+    :param min_zoom: lowest zoom level with tiles.
+    :param max_zoom: highest zoom level with tiles.
+    """
+
+    def __init__(self, df, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+        # Only the properties with coordinates and price are aggregated
+        longitude = df['LONGITUDE'].to_numpy(dtype=np.float64)
+        latitude = df['LATITUDE'].to_numpy(dtype=np.float64)
+        price = df['PRICE'].to_numpy(dtype=np.float64)
+        unit_price = df['UNITPRICE'].to_numpy(dtype=np.float64)
+        valid = ~(np.isnan(longitude) | np.isnan(latitude) | np.isnan(price))
+        longitude, latitude, price, unit_price = longitude[valid], latitude[valid], price[valid], unit_price[valid]
+
+        # Cells of the finest level, the coarser ones are obtained with bit shifts
+        finest_level = max_zoom + BIN_DEPTH
+        finest_x, finest_y = lonlat_to_pixels(longitude, latitude, finest_level)
+
+        self.levels = {}
+        for zoom in range(min_zoom, max_zoom + 1):
+            shift = finest_level - (zoom + BIN_DEPTH)
+            self.levels[zoom] = self._aggregate(finest_x >> shift, finest_y >> shift, price, unit_price)
+
+    @staticmethod
+    def _aggregate(x, y, price, unit_price):
+        """Aggregate the properties by cell and index the cells by tile."""
+        if len(x) == 0:
+            return {"tiles": {}}
+
+        # Sort by tile, then by cell inside the tile, then by price (for the medians)
+        order = np.lexsort((price, y, x, y >> BIN_DEPTH, x >> BIN_DEPTH))
+        x, y, price, unit_price = x[order], y[order], price[order], unit_price[order]
+
+        # Boundaries of the groups of properties in the same cell
+        new_cell = np.empty(len(x), dtype=bool)
+        new_cell[0] = True
+        new_cell[1:] = (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+        starts = np.flatnonzero(new_cell)
+        counts = np.diff(np.append(starts, len(x)))
+
+        # Mean and median price, the prices of every cell are sorted
+        mean_price = np.add.reduceat(price, starts) / counts
+        median_price = (price[starts + (counts - 1) // 2] + price[starts + counts // 2]) / 2
+
+        # Mean unit price, ignoring the properties without it
+        has_unit_price = ~np.isnan(unit_price)
+        unit_price_counts = np.add.reduceat(has_unit_price.astype(np.int64), starts)
+        unit_price_sums = np.add.reduceat(np.where(has_unit_price, unit_price, 0.0), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_unit_price = np.where(unit_price_counts > 0, unit_price_sums / unit_price_counts, np.nan)
+
+        cell_x, cell_y = x[starts], y[starts]
+
+        # Contiguous range of cells of every tile
+        tile_x, tile_y = cell_x >> BIN_DEPTH, cell_y >> BIN_DEPTH
+        new_tile = np.empty(len(starts), dtype=bool)
+        new_tile[0] = True
+        new_tile[1:] = (tile_x[1:] != tile_x[:-1]) | (tile_y[1:] != tile_y[:-1])
+        tile_starts = np.flatnonzero(new_tile)
+        tile_stops = np.append(tile_starts[1:], len(starts))
+
+        return {
+            "tiles": {
+                (int(tile_x[start]), int(tile_y[start])): (int(start), int(stop))
+                for start, stop in zip(tile_starts, tile_stops)
+            },
+            "x": cell_x,
+            "y": cell_y,
+            "count": counts,
+            "mean_price": mean_price,
+            "median_price": median_price,
+            "mean_unit_price": mean_unit_price,
+        }
+
+    def tile(self, z, x, y):
+        """
+        Return the bins of a tile.
+
+        :param z: zoom level.
+        :param x: column of the tile.
+        :param y: row of the tile.
+        :return: list of dictionaries, one per non empty bin, with its quadkey, position in the tile
+            (`column`, `row` from 0 to 2^BIN_DEPTH - 1), center and price aggregates.
+        """
+        level = self.levels[z]
+        start, stop = level["tiles"].get((x, y), (0, 0))
+
+        bins = []
+        for i in range(start, stop):
+            cell_x, cell_y = int(level["x"][i]), int(level["y"][i])
+            latitude, longitude = cell_center(cell_x, cell_y, z + BIN_DEPTH)
+            mean_unit_price = level["mean_unit_price"][i]
+            bins.append({
+                "quadkey": quadkey(cell_x, cell_y, z + BIN_DEPTH),
+                "column": cell_x - (x << BIN_DEPTH),
+                "row": cell_y - (y << BIN_DEPTH),
+                "latitude": latitude,
+                "longitude": longitude,
+                "count": int(level["count"][i]),
+                "mean_price": float(level["mean_price"][i]),
+                "median_price": float(level["median_price"][i]),
+                "mean_unit_price": None if np.isnan(mean_unit_price) else float(mean_unit_price),
+            })
+
+        return bins
+
+
+@reload_on_change(DISTRICT_PROPERTIES_STORE, DISTRICTS_POLYGONS_PATH)
+def load_price_tiles():
+    """Return the price tiles of the properties, built once per version of the store."""
+    return PriceTiles(load_district_properties())
@@ -12,13 +12,23 @@ endpoint_properties = "/api/v1/map_all_properties"
 api_url_endpoint_properties = api_url + endpoint_properties
 
 try:
-    # Make the API request to get the map of Madrid
-    response = requests.get(api_url_endpoint_properties)
+    # Make the API request to get the map of Madrid, sending the ETag of the map we already have
+    cached_map = st.session_state.get("map_all_properties")
+    headers = {"If-None-Match": cached_map["etag"]} if cached_map else {}
+    response = requests.get(api_url_endpoint_properties, headers=headers)
+
+    # The map has not changed, reuse the one we already have
+    if response.status_code == 304:
+        components.html(cached_map["html"], height=600, scrolling=True)
 
     # Check if the request was successful
-    if response.status_code == 200:
+    elif response.status_code == 200:
+        html = response.content.decode("utf-8")
+        if response.headers.get("ETag"):
+            st.session_state["map_all_properties"] = {"etag": response.headers["ETag"], "html": html}
+
         # ✅ Display the interactive folium map as HTML
-        components.html(response.content.decode("utf-8"), height=600, scrolling=True)
+        components.html(html, height=600, scrolling=True)
     else:
         st.error("Error in the properties request")
         st.error(f"Error: {response.status_code} - {response.text}")
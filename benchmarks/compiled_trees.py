@@ -0,0 +1,86 @@
+import argparse
+import pickle
+import time
+
+from threadpoolctl import threadpool_limits
+
+from benchmarks.thread_budget import load_benchmark_model, build_rows
+from src.data_processing.compiled_trees import CompiledTreeEnsemble, NODE_ARRAYS, compile_model, check_parity
+from utils.thread_budget import limit_model_threads
+
+BATCH_SIZES = [1, 8, 32, 256, 1000, 10000]
+
+
+def best_time(model, X, repeat):
+    """Return the best prediction time of `X` in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict(X)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def size_mb(member, compiled):
+    """Return the pickled size of a member and the size of its compiled node arrays in MB."""
+    original = len(pickle.dumps(member)) / 1024 ** 2
+    if not isinstance(compiled, CompiledTreeEnsemble):
+        return original, None
+    return original, sum(getattr(compiled, name).nbytes for name in NODE_ARRAYS) / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency of the compiled tree backend vs scikit-learn "
+                                                 "and XGBoost")
+    parser.add_argument("--model-name", default=None, help="Registered model to load through the local cache "
+                                                           "(default: a synthetic model)")
+    parser.add_argument("--model-version", default="latest")
+    parser.add_argument("--synthetic-rows", type=int, default=50000, help="Training rows of the synthetic model")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--threads", type=int, default=1, help="Threads per prediction of the original members")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pipeline = load_benchmark_model(args.model_name, args.model_version, args.synthetic_rows)
+    limit_model_threads(pipeline, args.threads)
+
+    # The registered model is a serving pipeline: compare the members on the scaled rows they receive
+    X_all = build_rows(args.model_name, max(args.batch_sizes))
+    model = pipeline
+    if hasattr(pipeline, "steps"):
+        X_all = pipeline[:-1].transform(X_all)
+        model = pipeline.steps[-1][1]
+
+    start = time.perf_counter()
+    compiled = compile_model(model)
+    print(f"Compiled in {time.perf_counter() - start:.2f}s")
+
+    members = list(zip(compiled.names, model.estimators_, compiled.estimators_)) \
+        if hasattr(compiled, "names") else []
+    members.append(("ensemble", model, compiled))
+
+    for name, member, compiled_member in members:
+        difference = check_parity(member, compiled_member, X_all)
+        if name != "ensemble":
+            original_mb, compiled_mb = size_mb(member, compiled_member)
+            size = f", {original_mb:.1f} MB pickled -> {compiled_mb:.1f} MB of node arrays" if compiled_mb else ""
+        else:
+            size = ""
+        print(f"{name}: max relative difference {difference:.2e}{size}")
+
+    print(f"{'member':>8} {'batch':>6} {'original ms':>12} {'compiled ms':>12} {'speedup':>8}")
+    with threadpool_limits(limits=args.threads):
+        for name, member, compiled_member in members:
+            if compiled_member is member:
+                continue
+            for batch_size in args.batch_sizes:
+                X = X_all[:batch_size]
+                repeat = max(1, min(args.repeat, 10000 // batch_size))
+                original = best_time(member, X, repeat)
+                fast = best_time(compiled_member, X, repeat)
+                print(f"{name:>8} {batch_size:>6} {original * 1000:>12.2f} {fast * 1000:>12.2f} "
+                      f"{original / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
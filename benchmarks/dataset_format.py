@@ -0,0 +1,112 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from src.data_processing.build_training_dataset import convert_dataset
+from src.data_processing.data_preprocessing import read_dataset
+from src.data_processing.feature_encoder import TARGET_COLUMNS, FEATURE_COLUMNS, CONTINUOUS_FEATURES
+
+# Columns of the EDA dataset that are not in the feature group of the models
+EXTRA_FLAG_COLUMNS = ['HASLIFT', 'HASAIRCONDITIONING', 'HASNORTHORIENTATION', 'HASSOUTHORIENTATION',
+                      'HASEASTORIENTATION', 'HASWESTORIENTATION', 'HASBOXROOM', 'HASWARDROBE', 'HASDOORMAN',
+                      'HASGARDEN', 'ISDUPLEX', 'ISSTUDIO', 'BUILTTYPEID_1', 'BUILTTYPEID_2', 'BUILTTYPEID_3',
+                      'PERIOD_201803', 'PERIOD_201806', 'PERIOD_201809', 'PERIOD_201812']
+EXTRA_CONTINUOUS_COLUMNS = ['PARKINGSPACEPRICE', 'CADCONSTRUCTIONYEAR', 'CADDWELLINGCOUNT', 'CADASTRALQUALITYID']
+
+
+def build_synthetic_csv(path, n_rows):
+    """Write a CSV with the columns of the scaled EDA dataset and random values."""
+    rng = np.random.default_rng(42)
+    columns = {'PRICE': rng.integers(50, 2000, n_rows) * 1000.0}
+    columns['UNITPRICE'] = columns['PRICE'] / rng.uniform(30, 300, n_rows)
+    for column in FEATURE_COLUMNS + EXTRA_FLAG_COLUMNS + EXTRA_CONTINUOUS_COLUMNS:
+        if column in CONTINUOUS_FEATURES or column in EXTRA_CONTINUOUS_COLUMNS:
+            columns[column] = rng.normal(size=n_rows)
+        else:
+            columns[column] = (rng.random(n_rows) < 0.1).astype(int)
+    pd.DataFrame(columns).to_csv(path, index=False)
+
+
+def load_csv(path):
+    """Previous loader: parse the full CSV and keep the columns of the feature group."""
+    return pd.read_csv(path)[TARGET_COLUMNS + FEATURE_COLUMNS]
+
+
+def load_csv_projected(path):
+    """Parse only the columns of the feature group of the CSV."""
+    return pd.read_csv(path, usecols=TARGET_COLUMNS + FEATURE_COLUMNS)[TARGET_COLUMNS + FEATURE_COLUMNS]
+
+
+def load_parquet_projected(path):
+    """Read only the columns of the feature group of the typed Parquet file."""
+    return read_dataset(path, TARGET_COLUMNS + FEATURE_COLUMNS)
+
+
+LOADERS = {
+    "csv": load_csv,
+    "csv_projected": load_csv_projected,
+    "parquet_projected": load_parquet_projected,
+}
+
+
+def read_memory_mb(field):
+    """Return a memory field of /proc/self/status (VmRSS, VmHWM) in MB (Linux only)."""
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+
+
+def measure(loader, path):
+    """Load the dataset and return the load time, the peak memory of the load and the DataFrame size."""
+    # Reset the peak resident memory (VmHWM) of the process to its current value
+    with open("/proc/self/clear_refs", "w") as file:
+        file.write("5")
+    before = read_memory_mb("VmRSS")
+
+    start = time.perf_counter()
+    df = LOADERS[loader](path)
+    load_time = time.perf_counter() - start
+
+    return load_time, read_memory_mb("VmHWM") - before, df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load time and memory of the dataset: full CSV vs projected CSV "
+                                                 "vs projected typed Parquet")
+    parser.add_argument("--data", default=None, help="Dataset CSV (default: a synthetic CSV)")
+    parser.add_argument("--synthetic-rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = args.data
+        if csv_path is None:
+            csv_path = os.path.join(tmp_dir, "EDA_Madrid_SCALED.csv")
+            build_synthetic_csv(csv_path, args.synthetic_rows)
+
+        start = time.perf_counter()
+        parquet_path = convert_dataset(csv_path, os.path.join(tmp_dir, "dataset.parquet"))
+        print(f"Converted in {time.perf_counter() - start:.2f}s: CSV {os.path.getsize(csv_path) / 1024 ** 2:.1f} MB "
+              f"-> Parquet {os.path.getsize(parquet_path) / 1024 ** 2:.1f} MB")
+
+        # Every load runs in a fresh process, so the memory freed by a load is not reused by the next one
+        context = multiprocessing.get_context("spawn")
+        print(f"{'loader':>18} {'load s':>8} {'peak MB':>8} {'frame MB':>9}")
+        for loader in LOADERS:
+            path = parquet_path if loader.startswith("parquet") else csv_path
+            results = []
+            for _ in range(args.repeat):
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(measure, (loader, path)))
+            load_time = min(result[0] for result in results)
+            peak = min(result[1] for result in results)
+            print(f"{loader:>18} {load_time:>8.3f} {peak:>8.1f} {results[0][2]:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import json
+import timeit
+import pandas as pd
+
+from unidecode import unidecode
+
+from app.routes.PropertyFeatures import PropertyFeatures
+from src.data_processing.feature_encoder import FeatureEncoder, LOCATION_GROUPS_PATH, LOCATION_COLUMNS, \
+    DISTRICT_COLUMNS
+
+# Example of a request sent by the dashboard
+features = PropertyFeatures(
+    constructed_area=100, has_terrace=1, is_parkingspace_included=0, number_of_rooms=3,
+    number_of_bathrooms=2, has_swimming_pool=0, is_top_floor=0, distance_to_city_center=5.0,
+    distance_to_city_metro=0.5, distance_to_city_castellana=3.0, constructed_year=2010, floorclean=4,
+    location='Vallehermoso', district='Chamberí',
+)
+
+with open(LOCATION_GROUPS_PATH, 'r', encoding='utf-8') as file:
+    location_name_map = json.load(file)
+
+
+def legacy_encode(features):
+    """Encoding done by `predict()` before the FeatureEncoder: linear scans, one-hot loops and a DataFrame."""
+    district_name = 'DISTRICTS_' + unidecode(features.district).upper()
+    location_name = unidecode(features.location).upper()
+
+    data_dict = {
+        'CONSTRUCTEDAREA': features.constructed_area,
+        'HASTERRACE': features.has_terrace,
+        'ISPARKINGSPACEINCLUDEDINPRICE': features.is_parkingspace_included,
+        'ROOMNUMBER': features.number_of_rooms,
+        'BATHNUMBER': features.number_of_bathrooms,
+        'HASSWIMMINGPOOL': features.has_swimming_pool,
+        'ISINTOPFLOOR': features.is_top_floor,
+        'DISTANCE_TO_CITY_CENTER': features.distance_to_city_center,
+        'DISTANCE_TO_METRO': features.distance_to_city_metro,
+        'DISTANCE_TO_CASTELLANA': features.distance_to_city_castellana,
+        'CADMAXBUILDINGFLOOR': features.constructed_year,
+        'FLOORCLEAN': features.floorclean
+    }
+
+    group_name = None
+    for key, value in location_name_map.items():
+        if location_name == key:
+            group_name = 'LOCATIONNAME_' + str(value)
+            break
+
+    for location in LOCATION_COLUMNS:
+        data_dict[location] = 1 if group_name == location else 0
+
+    for district in DISTRICT_COLUMNS:
+        data_dict[district] = 1 if district_name == district else 0
+
+    return pd.DataFrame([data_dict])
+
+
+def main(number=20000):
+    encoder = FeatureEncoder.from_json()
+
+    # Both encoders must produce the same row
+    assert (legacy_encode(features).to_numpy() == encoder.encode_row(features)).all()
+
+    results = {
+        "legacy (DataFrame per request)": timeit.timeit(lambda: legacy_encode(features), number=number // 10) / (number // 10),
+        "FeatureEncoder.encode_row": timeit.timeit(lambda: encoder.encode_row(features), number=number) / number,
+    }
+
+    batch = [features] * 1000
+    results["FeatureEncoder.encode_batch (per row, 1000 rows)"] = \
+        timeit.timeit(lambda: encoder.encode_batch(batch), number=20) / 20 / len(batch)
+
+    print("Per-request encode cost:")
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
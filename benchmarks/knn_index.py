@@ -0,0 +1,110 @@
+import argparse
+import time
+import numpy as np
+
+from sklearn.neighbors import KNeighborsRegressor
+
+from src.data_processing.feature_encoder import FEATURE_COLUMNS, CONTINUOUS_FEATURES, LOCATION_COLUMNS, \
+    DISTRICT_COLUMNS
+from src.data_processing.partitioned_knn import PartitionedKNNRegressor
+
+BATCH_SIZES = [1, 8, 32, 256, 1000]
+
+# Binary flags of the dataset
+FLAG_COLUMNS = ['HASTERRACE', 'ISPARKINGSPACEINCLUDEDINPRICE', 'HASSWIMMINGPOOL', 'ISINTOPFLOOR']
+
+
+def build_synthetic_rows(n_rows, rng):
+    """
+    Scaled rows with the structure of the listings: every district has its own location groups and its own
+    range of distances to the center, the metro and the Castellana.
+    """
+    X = np.zeros((n_rows, len(FEATURE_COLUMNS)))
+    column = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+
+    district = rng.integers(0, len(DISTRICT_COLUMNS), n_rows)
+    X[np.arange(n_rows), [column[DISTRICT_COLUMNS[d]] for d in district]] = 1
+    location = (district // 2 + rng.integers(0, 2, n_rows)) % len(LOCATION_COLUMNS)
+    X[np.arange(n_rows), [column[LOCATION_COLUMNS[g]] for g in location]] = 1
+
+    district_center = np.linspace(-1.5, 2.5, len(DISTRICT_COLUMNS))
+    for name in ['DISTANCE_TO_CITY_CENTER', 'DISTANCE_TO_METRO', 'DISTANCE_TO_CASTELLANA']:
+        X[:, column[name]] = district_center[district] + rng.normal(scale=0.2, size=n_rows)
+    area = rng.normal(size=n_rows)
+    X[:, column['CONSTRUCTEDAREA']] = area
+    X[:, column['ROOMNUMBER']] = np.round(area + rng.normal(scale=0.5, size=n_rows))
+    X[:, column['BATHNUMBER']] = np.round(area * 0.7 + rng.normal(scale=0.5, size=n_rows))
+    for name in ['CADMAXBUILDINGFLOOR', 'FLOORCLEAN']:
+        X[:, column[name]] = np.round(rng.normal(size=n_rows) * 2) / 2
+    for name in FLAG_COLUMNS:
+        X[:, column[name]] = rng.random(n_rows) < 0.2
+    return X
+
+
+def load_knn(model_name, version, synthetic_rows, rng):
+    """Return the KNN member of a registered Voting Regressor, or a synthetic KNN, and its training rows."""
+    if model_name:
+        from src.score import load_scoring_model
+        pipeline = load_scoring_model(model_name, version)
+        ensemble = pipeline.steps[-1][1]
+        knn = next(e for e in ensemble.estimators_ if isinstance(e, KNeighborsRegressor))
+        return knn, np.asarray(knn._fit_X)
+
+    X = build_synthetic_rows(synthetic_rows, rng)
+    y = 300_000 + 100_000 * X[:, 0] + rng.normal(scale=20_000, size=len(X))
+    knn = KNeighborsRegressor(n_neighbors=7, metric='manhattan', weights='distance', n_jobs=1).fit(X, y)
+    return knn, X
+
+
+def best_time(model, X, repeat):
+    """Return the best prediction time of `X` in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict(X)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exactness and latency of the partitioned KNN index vs the stock "
+                                                 "KNeighborsRegressor")
+    parser.add_argument("--model-name", default=None, help="Registered Voting Regressor to load through the local "
+                                                           "cache (default: a synthetic KNN)")
+    parser.add_argument("--model-version", default="latest")
+    parser.add_argument("--synthetic-rows", type=int, default=50000, help="Training rows of the synthetic KNN")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    knn, X_train = load_knn(args.model_name, args.model_version, args.synthetic_rows, rng)
+    knn.n_jobs = 1
+
+    start = time.perf_counter()
+    index = PartitionedKNNRegressor.from_estimator(knn)
+    print(f"Training rows: {len(X_train)}, groups: {len(index.signatures)}, "
+          f"index built in {time.perf_counter() - start:.2f}s")
+
+    # Queries: training rows with jittered continuous features
+    X_all = X_train[rng.integers(0, len(X_train), max(args.batch_sizes))].copy()
+    continuous = [FEATURE_COLUMNS.index(name) for name in CONTINUOUS_FEATURES]
+    X_all[:, continuous] += rng.normal(scale=0.05, size=(len(X_all), len(continuous)))
+
+    distance, _ = knn.kneighbors(X_all)
+    index_distance, _ = index.kneighbors(X_all)
+    visited = (index.lower_bounds(X_all) < index_distance[:, -1:]).sum(axis=1).mean()
+    print(f"Max difference of the neighbor distances: {np.abs(distance - index_distance).max():.2e}, "
+          f"of the predictions: {np.abs(knn.predict(X_all) - index.predict(X_all)).max():.2e}")
+    print(f"Groups searched per query: {visited:.1f} of {len(index.signatures)}")
+
+    print(f"{'batch':>6} {'stock ms':>10} {'index ms':>10} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        X = X_all[:batch_size]
+        stock = best_time(knn, X, args.repeat)
+        indexed = best_time(index, X, args.repeat)
+        print(f"{batch_size:>6} {stock * 1000:>10.2f} {indexed * 1000:>10.2f} {stock / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import gzip
+import time
+
+from app.routes.map_all_properties import build_price_map
+from app.serving.property_store import load_all_properties, load_district_boundaries
+
+
+def measure(gdf_districts, df_properties, render, repeat):
+    """Return the best render time (seconds) of the map and its HTML."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        html = build_price_map(gdf_districts, df_properties, render)
+        best = min(best, time.perf_counter() - start)
+    return best, html
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size and render time of the price map: canvas layer vs one marker per row")
+    parser.add_argument("--rows", type=int, default=None,
+                        help="Resample the property store to this number of rows (default: the whole store)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    gdf_districts = load_district_boundaries()
+    df_properties = load_all_properties()
+    if args.rows:
+        df_properties = df_properties.sample(args.rows, replace=args.rows > len(df_properties), random_state=42)
+
+    print(f"Properties: {len(df_properties)}")
+    for render in ("markers", "canvas"):
+        seconds, html = measure(gdf_districts, df_properties, render, args.repeat)
+        html = html.encode("utf-8")
+        print(f"{render}: render {seconds * 1000:.0f} ms, HTML {len(html) / 1024 ** 2:.2f} MB "
+              f"(gzip {len(gzip.compress(html)) / 1024 ** 2:.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import joblib
+import numpy as np
+
+from src.data_processing.compiled_trees import attach_tree_members, detach_tree_members
+from src.data_processing.feature_encoder import FEATURE_COLUMNS
+
+
+def read_memory():
+    """Return the resident (RSS) and proportional (PSS) memory of the current process in MB (Linux only)."""
+    memory = {}
+    with open("/proc/self/smaps_rollup", "r") as file:
+        for line in file:
+            key, value = line.split(":", 1)
+            if key in ("Rss", "Pss"):
+                memory[key.lower()] = int(value.split()[0]) / 1024
+    return memory
+
+
+def build_synthetic_model(n_rows):
+    """Train a Voting Regressor with the hyperparameters of `train_ensemble_model` on random data."""
+    from sklearn.ensemble import RandomForestRegressor, VotingRegressor
+    from sklearn.neighbors import KNeighborsRegressor
+    from xgboost import XGBRegressor
+
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(n_rows, len(FEATURE_COLUMNS)))
+    y = X[:, 0] * 1000 + rng.normal(size=n_rows)
+
+    return VotingRegressor(estimators=[
+        ('xgb', XGBRegressor(objective='reg:squarederror', n_jobs=-1, max_depth=6, n_estimators=200, subsample=0.8)),
+        ('rf', RandomForestRegressor(n_jobs=-1, max_depth=30, min_samples_split=3, n_estimators=150)),
+        ('svr', KNeighborsRegressor(n_jobs=-1, metric='manhattan', n_neighbors=7, weights='distance')),
+    ]).fit(X, y)
+
+
+def worker(model_path, trees_dir, barrier, results):
+    before = read_memory()
+    if trees_dir:
+        # Same as `load_model(mmap=True)`: mapped joblib file plus mapped node arrays of the trees
+        model = attach_tree_members(joblib.load(model_path, mmap_mode="r"), trees_dir, mmap=True)
+    else:
+        model = joblib.load(model_path)
+    model.predict(np.zeros((1, len(FEATURE_COLUMNS))))
+
+    # Wait until every worker has loaded the model, so the shared pages are counted in all of them
+    barrier.wait()
+    after = read_memory()
+    results.append({"pid": os.getpid(), "before": before, "after": after})
+    barrier.wait()
+
+
+def measure(model_path, trees_dir, n_workers):
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    barrier = manager.Barrier(n_workers)
+    results = manager.list()
+
+    processes = [context.Process(target=worker, args=(model_path, trees_dir, barrier, results)) for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    return list(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory of the model loaded in memory vs memory mapped")
+    parser.add_argument("--model-name", default=None, help="Registered model to load through the local cache")
+    parser.add_argument("--synthetic-rows", type=int, default=50000, help="Training rows of the synthetic model")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, "model.joblib")
+        if args.model_name:
+            import mlflow.sklearn
+            from utils.model_cache import fetch_model, export_mmap_model
+            entry_path = fetch_model(args.model_name)[0]
+            joblib.dump(mlflow.sklearn.load_model(entry_path), model_path)
+            mmap_path, trees_dir = export_mmap_model(entry_path)
+        else:
+            model = build_synthetic_model(args.synthetic_rows)
+            joblib.dump(model, model_path)
+            # Same export as `export_mmap_model`
+            mmap_path, trees_dir = os.path.join(tmp_dir, "model.mmap.joblib"), os.path.join(tmp_dir, "trees")
+            joblib.dump(detach_tree_members(model, trees_dir), mmap_path)
+
+        print(f"Model file: {os.path.getsize(model_path) / 1024 ** 2:.1f} MB, workers: {args.workers}")
+        for mmap in (False, True):
+            results = measure(mmap_path if mmap else model_path, trees_dir if mmap else None, args.workers)
+            rss = np.mean([r["after"]["rss"] - r["before"]["rss"] for r in results])
+            pss = np.mean([r["after"]["pss"] - r["before"]["pss"] for r in results])
+            print(f"{'mmap' if mmap else 'memory'}: model RSS per worker {rss:.1f} MB, "
+                  f"PSS per worker {pss:.1f} MB (total {pss * args.workers:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
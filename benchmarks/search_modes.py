@@ -0,0 +1,61 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from sklearn.model_selection import train_test_split
+
+from benchmarks.knn_index import build_synthetic_rows
+from src.data_processing.feature_encoder import FEATURE_COLUMNS
+from src.models.random_forest import search_random_forest_hyperparameters
+from src.models.search_modes import SEARCH_MODES
+from src.models.xgboost_regressor import search_xgboost_hyperparameters
+from utils.utils import calculate_metrics
+
+SEARCHES = {
+    "random_forest": search_random_forest_hyperparameters,
+    "xgboost": search_xgboost_hyperparameters,
+}
+
+
+def load_dataset(data, test_size_fraction, synthetic_rows):
+    """Return the train and test sets of the scaled dataset, or of synthetic rows with a non-linear price."""
+    if data:
+        from src.data_processing.session_cache import TrainingSession
+        return TrainingSession.load(data, test_size_fraction).data()
+
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame(build_synthetic_rows(synthetic_rows, rng), columns=FEATURE_COLUMNS)
+    column = X.columns.get_loc
+    y = 300_000 + 120_000 * X.iloc[:, column('CONSTRUCTEDAREA')] \
+        - 60_000 * np.tanh(X.iloc[:, column('DISTANCE_TO_CITY_CENTER')]) \
+        + 40_000 * X.iloc[:, column('HASTERRACE')] * X.iloc[:, column('BATHNUMBER')] \
+        + rng.normal(scale=20_000, size=synthetic_rows)
+    return train_test_split(X, pd.Series(y, name='PRICE'), test_size=0.2, random_state=42)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wall-clock and best score of the exhaustive grid search vs the "
+                                                 "successive halving and warm start searches of the XGBoost and "
+                                                 "Random Forest trainers")
+    parser.add_argument("--data", default=None, help="Scaled dataset CSV used by src/main.py "
+                                                     "(default: synthetic rows)")
+    parser.add_argument("--test-size-fraction", type=float, default=0.8)
+    parser.add_argument("--synthetic-rows", type=int, default=20000)
+    parser.add_argument("--models", nargs="+", choices=list(SEARCHES), default=list(SEARCHES))
+    parser.add_argument("--modes", nargs="+", choices=SEARCH_MODES, default=list(SEARCH_MODES))
+    args = parser.parse_args()
+
+    X_train, X_test, y_train, y_test = load_dataset(args.data, args.test_size_fraction, args.synthetic_rows)
+    print(f"Training rows: {len(X_train)}, test rows: {len(X_test)}")
+
+    print(f"{'model':>14} {'mode':>8} {'time s':>8} {'cv r2':>8} {'test r2':>8}  best params")
+    for model in args.models:
+        for mode in args.modes:
+            search, results, best_idx, search_time = SEARCHES[model](X_train, y_train, mode)
+            r2_test = calculate_metrics(y_test, search.predict(X_test))['r2']
+            print(f"{model:>14} {mode:>8} {search_time:>8.1f} {results['mean_test_r2'][best_idx]:>8.4f} "
+                  f"{r2_test:>8.4f}  {search.best_params_}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import os
+import time
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from threadpoolctl import threadpool_limits
+
+from benchmarks.model_memory import build_synthetic_model
+from src.data_processing.feature_encoder import FEATURE_COLUMNS
+from utils.thread_budget import limit_model_threads
+
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+
+
+def load_benchmark_model(model_name, version, synthetic_rows):
+    """Return the serving pipeline of a registered model, or a synthetic Voting Regressor."""
+    if model_name:
+        from src.score import load_scoring_model
+        return load_scoring_model(model_name, version)
+    return build_synthetic_model(synthetic_rows)
+
+
+def build_rows(model_name, n_rows):
+    """Return `n_rows` encoded rows: jittered copies of a dashboard request, or random rows."""
+    rng = np.random.default_rng(42)
+    if not model_name:
+        return rng.normal(size=(n_rows, len(FEATURE_COLUMNS)))
+
+    from app.routes.PropertyFeatures import PropertyFeatures
+    from benchmarks.encode_features import features
+    from src.data_processing.feature_encoder import FeatureEncoder
+
+    rows = []
+    for area, distance in zip(rng.uniform(30, 300, n_rows), rng.uniform(0, 15, n_rows)):
+        rows.append(PropertyFeatures(**dict(features.model_dump(), constructed_area=float(area),
+                                            distance_to_city_center=float(distance))))
+    return FeatureEncoder.from_json(dtype=np.float64).encode_batch(rows)[0]
+
+
+def measure(model, X, n_threads, concurrency, repeat):
+    """
+    Predict `X` from `concurrency` client threads at the same time with a budget of `n_threads` threads per
+    prediction.
+
+    :return: tuple (mean latency of a prediction in seconds, rows predicted per second)
+    """
+    limit_model_threads(model, n_threads)
+
+    def predict_once(_):
+        start = time.perf_counter()
+        model.predict(X)
+        return time.perf_counter() - start
+
+    with threadpool_limits(limits=n_threads), ThreadPoolExecutor(concurrency) as pool:
+        # Warm up the thread pools of the model
+        list(pool.map(predict_once, range(concurrency)))
+
+        start = time.perf_counter()
+        latencies = list(pool.map(predict_once, range(concurrency * repeat)))
+        elapsed = time.perf_counter() - start
+
+    return float(np.mean(latencies)), len(X) * concurrency * repeat / elapsed
+
+
+def main():
+    cores = os.cpu_count() or 1
+
+    parser = argparse.ArgumentParser(description="Latency and throughput of the model by threads per prediction "
+                                                 "and batch size")
+    parser.add_argument("--model-name", default=None, help="Registered model to load through the local cache "
+                                                           "(default: a synthetic model)")
+    parser.add_argument("--model-version", default="latest")
+    parser.add_argument("--synthetic-rows", type=int, default=50000, help="Training rows of the synthetic model")
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({1, 2, 4, cores}),
+                        help="Threads per prediction to compare (default: 1, 2, 4 and all the cores)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Predictions running at the same time, e.g. the number of cores to simulate the "
+                             "concurrent load of the API")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model = load_benchmark_model(args.model_name, args.model_version, args.synthetic_rows)
+    X_all = build_rows(args.model_name, max(args.batch_sizes))
+
+    print(f"Cores: {cores}, concurrent predictions: {args.concurrency}")
+    if max(args.threads) * args.concurrency > cores:
+        print(f"Warning: {max(args.threads)} threads x {args.concurrency} predictions is more than the {cores} cores, "
+              f"the larger thread counts only measure the cost of oversubscription")
+    print(f"{'batch':>6} {'threads':>7} {'latency ms':>11} {'rows/s':>12}")
+    for batch_size in args.batch_sizes:
+        X = X_all[:batch_size]
+        for n_threads in args.threads:
+            # Large batches take long enough with a single repetition
+            repeat = max(1, min(args.repeat, 10000 // batch_size))
+            latency, rows_per_second = measure(model, X, n_threads, args.concurrency, repeat)
+            print(f"{batch_size:>6} {n_threads:>7} {latency * 1000:>11.2f} {rows_per_second:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
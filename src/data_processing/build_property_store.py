@@ -0,0 +1,130 @@
+import os
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Root of the project, two levels above src/data_processing
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# Directory where the property CSVs and the property store are kept
+DATA_DIR = os.path.join(project_root, "data", "new_data")
+
+# Source CSVs used by the map endpoints
+ALL_PROPERTIES_CSV = os.path.join(DATA_DIR, "EDA_MADRID_SCALED_Geometry_Column.csv")
+DISTRICT_PROPERTIES_CSV = os.path.join(DATA_DIR, "EDA_MADRID_NOT_SCALED_DISTRICTS.csv")
+
+# District polygons, used to assign each listing to its district
+DISTRICTS_POLYGONS_PATH = os.path.join(project_root, "data", "old_data", "Madrid_Districts_Polygons.csv")
+
+# Columnar property store read by the API
+ALL_PROPERTIES_STORE = os.path.join(DATA_DIR, "properties_all.parquet")
+DISTRICT_PROPERTIES_STORE = os.path.join(DATA_DIR, "properties_districts.parquet")
+
+# Columns kept for the map of all the properties
+ALL_PROPERTIES_COLUMNS = ['PRICE']
+
+# Columns kept for the map of properties by district
+DISTRICT_PROPERTIES_COLUMNS = [
+    'PRICE', 'UNITPRICE', 'ROOMNUMBER',
+    'BATHNUMBER', 'CADCONSTRUCTIONYEAR', 'CONSTRUCTEDAREA'
+]
+
+# Optional columns kept if the source CSV has them
+OPTIONAL_COLUMNS = ['LOCATIONNAME']
+
+
+def geometry_to_coordinates(geometry):
+    """
+    Parse a column of WKT points with a single vectorized call and return their coordinates.
+
+    :param geometry: pandas Series with WKT points ("POINT (lon lat)").
+    :return: tuple of float64 arrays (longitude, latitude)
+    """
+    points = shapely.from_wkt(geometry.to_numpy())
+    return shapely.get_x(points), shapely.get_y(points)
+
+
+def load_district_polygons(polygons_path=DISTRICTS_POLYGONS_PATH):
+    """Return the GeoDataFrame of the district polygons (column DISTRICTS)."""
+    df_districts = pd.read_csv(polygons_path, encoding='utf-8')
+    df_districts['geometry'] = shapely.from_wkt(df_districts['geometry'].to_numpy())
+    return gpd.GeoDataFrame(df_districts, geometry='geometry', crs='EPSG:4326')
+
+
+def assign_districts(longitude, latitude, gdf_districts):
+    """
+    Assign every point to the district polygon it lies within, with a single spatial join.
+
+    District membership never changes for a listing, so it is computed once when the store is built
+    instead of joining the properties with the district on every request.
+
+    :param longitude: array with the longitude of the points.
+    :param latitude: array with the latitude of the points.
+    :param gdf_districts: GeoDataFrame of the district polygons (column DISTRICTS).
+    :return: categorical Series with the district of each point (NaN if it is outside every district)
+    """
+    gdf_points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(longitude, latitude), crs='EPSG:4326')
+    joined = gpd.sjoin(gdf_points, gdf_districts[['DISTRICTS', 'geometry']], predicate="within", how="left")
+
+    # A point on the border of two districts matches both of them, keep the first one
+    districts = joined.loc[~joined.index.duplicated(keep='first'), 'DISTRICTS']
+
+    return pd.Categorical(districts, categories=list(gdf_districts['DISTRICTS']))
+
+
+def read_properties(csv_path, columns, with_districts=False):
+    """
+    Read a property CSV with a WKT `GEOMETRY` column into a typed DataFrame.
+
+    - The WKT points are parsed once and stored as float `LONGITUDE`/`LATITUDE` columns.
+    - The numeric columns are coerced to numbers, the same way the map endpoints did on every request.
+
+    :param csv_path: path of the source CSV.
+    :param columns: numeric columns to keep.
+    :param with_districts: add the categorical `DISTRICT` column with the district of each listing.
+    :return: DataFrame
+    """
+    df = pd.read_csv(csv_path, encoding='utf-8')
+
+    store = pd.DataFrame({column: pd.to_numeric(df[column], errors='coerce') for column in columns})
+    for column in OPTIONAL_COLUMNS:
+        if column in df.columns:
+            store[column] = df[column].astype('category')
+
+    store['LONGITUDE'], store['LATITUDE'] = geometry_to_coordinates(df['GEOMETRY'])
+
+    if with_districts:
+        store['DISTRICT'] = assign_districts(store['LONGITUDE'], store['LATITUDE'], load_district_polygons())
+
+    return store
+
+
+def build_store(csv_path, store_path, columns, with_districts=False):
+    """
+    Convert a property CSV into a typed Parquet file (see `read_properties`).
+
+    :param csv_path: path of the source CSV.
+    :param store_path: path of the Parquet file to write.
+    :param columns: numeric columns to keep.
+    :param with_districts: add the categorical `DISTRICT` column with the district of each listing.
+    :return: the stored DataFrame
+    """
+    store = read_properties(csv_path, columns, with_districts=with_districts)
+
+    # Write into a temporary file first, so the API never reads a half written store
+    tmp_path = f"{store_path}.tmp"
+    store.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, store_path)
+
+    return store
+
+
+def build_property_store():
+    """Build the Parquet files of the property store from the source CSVs."""
+    build_store(ALL_PROPERTIES_CSV, ALL_PROPERTIES_STORE, ALL_PROPERTIES_COLUMNS)
+    build_store(DISTRICT_PROPERTIES_CSV, DISTRICT_PROPERTIES_STORE, DISTRICT_PROPERTIES_COLUMNS, with_districts=True)
+
+
+if __name__ == "__main__":
+    build_property_store()
+    print("Property store built!")
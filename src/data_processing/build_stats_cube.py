@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from src.data_processing.build_property_store import DATA_DIR, DISTRICT_PROPERTIES_CSV, \
+    DISTRICT_PROPERTIES_COLUMNS, read_properties, load_district_polygons
+from src.data_processing.feature_encoder import LOCATION_GROUPS_PATH, LOCATION_COLUMNS, normalize_name
+from utils.file_hash import file_sha256
+
+# File of the statistics cube
+STATS_CUBE_PATH = os.path.join(DATA_DIR, "stats_cube.npz")
+
+# Location groups of `locationnameGroup.json`, plus one for the locations that are not in it
+N_LOCATION_GROUPS = len(LOCATION_COLUMNS) + 1
+UNKNOWN_LOCATION_GROUP = len(LOCATION_COLUMNS)
+
+# Rooms and bathrooms above these values share the last bucket
+MAX_ROOMS = 6
+MAX_BATHS = 4
+
+# Log spaced histogram bins used to compute the quantiles, the values outside the range go to the first or
+# last bin
+PRICE_EDGES = np.geomspace(10_000, 10_000_000, 129)
+UNITPRICE_EDGES = np.geomspace(250, 25_000, 129)
+
+# Measures of the cube and their histogram bins
+MEASURES = {'PRICE': PRICE_EDGES, 'UNITPRICE': UNITPRICE_EDGES}
+
+
+class StatsCube:
+    """
+    Price statistics of the listings by district x location group x rooms x bathrooms.
+
+    Every cell keeps the number of listings, the sum of every measure (for the means) and a histogram of
+    every measure over fixed log spaced bins (for the quantiles). All of them are additive, so new listings
+    are added to the cube without reading the previous ones again, and any dimension can be aggregated by
+    summing over its axis.
+
+    The cube also records the sha256 of the source files whose listings it counts, so the same file is never
+    added twice (see `update_stats_cube`).
+
+    :param districts: list with the names of the districts.
+    :param sources: sha256 of the source files already added to the cube.
+    """
+
+    def __init__(self, districts, sources=()):
+        self.districts = list(districts)
+        self.sources = list(sources)
+        self.shape = (len(self.districts), N_LOCATION_GROUPS, MAX_ROOMS + 1, MAX_BATHS + 1)
+        self.count = np.zeros(self.shape, dtype=np.uint32)
+        self.sums = {measure: np.zeros(self.shape, dtype=np.float64) for measure in MEASURES}
+        self.counts = {measure: np.zeros(self.shape, dtype=np.uint32) for measure in MEASURES}
+        self.histograms = {
+            measure: np.zeros(self.shape + (len(edges) - 1,), dtype=np.uint32)
+            for measure, edges in MEASURES.items()
+        }
+
+    def cell_indexes(self, df, location_name_map):
+        """
+        Return the cell of every listing as a tuple of index arrays, and the mask of the listings with a cell.
+
+        :param df: DataFrame with DISTRICT, LOCATIONNAME, ROOMNUMBER and BATHNUMBER columns.
+        :param location_name_map: dictionary from normalized location name to its group.
+        """
+        district = pd.Categorical(df['DISTRICT'], categories=self.districts).codes.astype(np.int64)
+
+        # Location group of every location name, computed once per distinct name
+        if 'LOCATIONNAME' in df.columns:
+            location = pd.Series(df['LOCATIONNAME'], dtype='category')
+            groups = np.array([location_name_map.get(normalize_name(str(name)), UNKNOWN_LOCATION_GROUP)
+                               for name in location.cat.categories] + [UNKNOWN_LOCATION_GROUP], dtype=np.int64)
+            location_group = groups[location.cat.codes.to_numpy()]
+        else:
+            location_group = np.full(len(df), UNKNOWN_LOCATION_GROUP, dtype=np.int64)
+
+        rooms = df['ROOMNUMBER'].to_numpy(dtype=np.float64)
+        baths = df['BATHNUMBER'].to_numpy(dtype=np.float64)
+        valid = (district >= 0) & ~np.isnan(rooms) & ~np.isnan(baths)
+
+        rooms = np.clip(np.nan_to_num(rooms), 0, MAX_ROOMS).astype(np.int64)
+        baths = np.clip(np.nan_to_num(baths), 0, MAX_BATHS).astype(np.int64)
+
+        return (district[valid], location_group[valid], rooms[valid], baths[valid]), valid
+
+    def add(self, df, location_name_map):
+        """
+        Add listings to the cube. Listings outside every district or without rooms/bathrooms are skipped.
+
+        :param df: DataFrame with the columns of the district property store.
+        :param location_name_map: dictionary from normalized location name to its group.
+        :return: number of listings added
+        """
+        cells, valid = self.cell_indexes(df, location_name_map)
+        flat_cells = np.ravel_multi_index(cells, self.shape)
+        size = int(np.prod(self.shape))
+
+        self.count += np.bincount(flat_cells, minlength=size).reshape(self.shape).astype(np.uint32)
+
+        for measure, edges in MEASURES.items():
+            values = df[measure].to_numpy(dtype=np.float64)[valid]
+            has_value = ~np.isnan(values)
+            measure_cells = flat_cells[has_value]
+            values = values[has_value]
+
+            self.sums[measure] += np.bincount(measure_cells, weights=values, minlength=size).reshape(self.shape)
+            self.counts[measure] += np.bincount(measure_cells, minlength=size).reshape(self.shape).astype(np.uint32)
+
+            bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+            n_bins = len(edges) - 1
+            self.histograms[measure] += np.bincount(
+                measure_cells * n_bins + bins, minlength=size * n_bins
+            ).reshape(self.shape + (n_bins,)).astype(np.uint32)
+
+        return int(valid.sum())
+
+    def summary(self, district=None, location_group=None, room_number=None, bathroom_number=None,
+                quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+        """
+        Return the statistics of a cell. A dimension set to None is aggregated (all its values).
+
+        The cost does not depend on the number of listings: a fully specified cell is a direct lookup and an
+        aggregated dimension is a sum over the (small) axis of the cube.
+
+        :param district: index of the district in `districts`.
+        :param location_group: location group (0-9, or UNKNOWN_LOCATION_GROUP).
+        :param room_number: number of rooms (values above MAX_ROOMS share its bucket).
+        :param bathroom_number: number of bathrooms (values above MAX_BATHS share its bucket).
+        :param quantiles: quantiles to compute from the histograms.
+        :return: dictionary with the count and, for every measure, its mean and quantiles
+        """
+        index = (
+            slice(None) if district is None else district,
+            slice(None) if location_group is None else location_group,
+            slice(None) if room_number is None else min(room_number, MAX_ROOMS),
+            slice(None) if bathroom_number is None else min(bathroom_number, MAX_BATHS),
+        )
+        summed_axes = tuple(axis for axis, value in enumerate(index) if isinstance(value, slice))
+
+        result = {"count": int(self.count[index].sum())}
+        for measure, edges in MEASURES.items():
+            count = int(self.counts[measure][index].sum())
+            histogram = self.histograms[measure][index]
+            if summed_axes:
+                histogram = histogram.sum(axis=tuple(range(len(summed_axes))))
+
+            result[measure] = {
+                "mean": float(self.sums[measure][index].sum() / count) if count else None,
+                **{f"p{round(q * 100)}": histogram_quantile(histogram, edges, q) for q in quantiles},
+            }
+
+        return result
+
+    def save(self, path=STATS_CUBE_PATH):
+        """Save the cube into a compressed `.npz` file (written atomically)."""
+        arrays = {"districts": np.array(self.districts), "sources": np.array(self.sources, dtype=str),
+                  "count": self.count}
+        for measure in MEASURES:
+            arrays[f"{measure}_sum"] = self.sums[measure]
+            arrays[f"{measure}_count"] = self.counts[measure]
+            arrays[f"{measure}_histogram"] = self.histograms[measure]
+            arrays[f"{measure}_edges"] = MEASURES[measure]
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=STATS_CUBE_PATH):
+        """Load a cube saved with `save`."""
+        with np.load(path) as data:
+            # Cubes saved before the sources were recorded have none
+            sources = data["sources"].tolist() if "sources" in data.files else []
+            cube = cls(data["districts"].tolist(), sources)
+            if data["count"].shape != cube.shape:
+                raise ValueError(f"The cube of {path} was built with other dimensions, rebuild it")
+
+            cube.count = data["count"]
+            for measure, edges in MEASURES.items():
+                if not np.array_equal(data[f"{measure}_edges"], edges):
+                    raise ValueError(f"The cube of {path} was built with other histogram bins, rebuild it")
+                cube.sums[measure] = data[f"{measure}_sum"]
+                cube.counts[measure] = data[f"{measure}_count"]
+                cube.histograms[measure] = data[f"{measure}_histogram"]
+
+        return cube
+
+
+def histogram_quantile(histogram, edges, q):
+    """
+    Approximate a quantile from a histogram, interpolating inside the bin in log scale.
+
+    :param histogram: counts of every bin.
+    :param edges: edges of the bins (log spaced).
+    :param q: quantile between 0 and 1.
+    :return: the quantile, or None if the histogram is empty
+    """
+    cumulative = np.cumsum(histogram)
+    total = cumulative[-1] if len(cumulative) else 0
+    if total == 0:
+        return None
+
+    target = q * total
+    bin_index = int(np.searchsorted(cumulative, target, side='left'))
+    previous = cumulative[bin_index - 1] if bin_index > 0 else 0
+    fraction = (target - previous) / histogram[bin_index] if histogram[bin_index] else 0.0
+
+    low, high = np.log(edges[bin_index]), np.log(edges[bin_index + 1])
+    return float(np.exp(low + fraction * (high - low)))
+
+
+def load_location_name_map(json_path=LOCATION_GROUPS_PATH):
+    with open(json_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def build_stats_cube(df, path=STATS_CUBE_PATH, source=None):
+    """
+    Build the statistics cube of the listings and save it.
+
+    :param df: DataFrame with the columns of the district property store.
+    :param path: path of the cube.
+    :param source: sha256 of the file the listings were read from, recorded in the cube.
+    :return: StatsCube
+    """
+    cube = StatsCube(load_district_polygons()['DISTRICTS'], [source] if source else [])
+    cube.add(df, load_location_name_map())
+    cube.save(path)
+    return cube
+
+
+def update_stats_cube(df, source, path=STATS_CUBE_PATH):
+    """
+    Add new listings to the saved statistics cube, without reading the listings it already has.
+
+    :param df: DataFrame with the new listings, with the columns of the district property store.
+    :param source: sha256 of the file the listings were read from.
+    :param path: path of the cube.
+    :return: StatsCube
+    :raises ValueError: If the listings of this file are already in the cube, or the cube does not record
+        the files it was built from.
+    """
+    cube = StatsCube.load(path)
+    if not cube.sources:
+        # The listings of the cube can not be told apart from the new ones
+        raise ValueError(f"The statistics cube of {path} does not record the files it was built from, rebuild it "
+                         f"with `python -m src.data_processing.build_stats_cube` before appending listings")
+    if source in cube.sources:
+        raise ValueError(f"The listings of this file (sha256 {source[:12]}) are already in the statistics cube")
+
+    added = cube.add(df, load_location_name_map())
+    cube.sources.append(source)
+    cube.save(path)
+    print(f"Added {added} listings to the statistics cube ({int(cube.count.sum())} in total)")
+    return cube
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the price statistics cube of the listings")
+    parser.add_argument("--append", default=None,
+                        help="CSV with new listings (same layout as the district CSV) to add to the existing cube")
+    args = parser.parse_args()
+
+    if args.append:
+        source = file_sha256(args.append)
+        try:
+            update_stats_cube(read_properties(args.append, DISTRICT_PROPERTIES_COLUMNS, with_districts=True), source)
+        except ValueError as e:
+            raise SystemExit(str(e))
+    else:
+        build_stats_cube(read_properties(DISTRICT_PROPERTIES_CSV, DISTRICT_PROPERTIES_COLUMNS, with_districts=True),
+                         source=file_sha256(DISTRICT_PROPERTIES_CSV))
+        print("Statistics cube built!")
@@ -0,0 +1,87 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.data_processing.feature_encoder import TARGET_COLUMNS
+from utils.file_hash import file_sha256
+
+# Key of the Parquet metadata with the sha256 of the CSV the file was converted from
+SOURCE_SHA256_KEY = b"source_sha256"
+
+
+def dataset_parquet_path(csv_path):
+    """Return the path of the Parquet file converted from a dataset CSV (same folder and name)."""
+    return f"{os.path.splitext(csv_path)[0]}.parquet"
+
+
+def parquet_source_sha256(parquet_path):
+    """Return the sha256 of the CSV a Parquet file was converted from, or None if it was not recorded."""
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    source = metadata.get(SOURCE_SHA256_KEY)
+    return source.decode("ascii") if source else None
+
+
+def typed_dataset(df):
+    """
+    Cast the columns of the dataset to compact types.
+
+    - The target columns are kept as they are, so the prices and the stratified split do not change.
+    - The columns with only 0/1 values (one-hot location and district columns and boolean flags) are int8.
+    - The other numeric columns (continuous features) are float32.
+    - The non numeric columns are categorical.
+
+    :param df: DataFrame read from the dataset CSV.
+    :return: DataFrame
+    """
+    typed = {}
+    for column in df.columns:
+        values = df[column]
+        if column in TARGET_COLUMNS:
+            typed[column] = values
+        elif not pd.api.types.is_numeric_dtype(values):
+            typed[column] = values.astype('category')
+        elif values.notna().all() and values.isin((0, 1)).all():
+            typed[column] = values.astype(np.int8)
+        else:
+            typed[column] = values.astype(np.float32)
+
+    return pd.DataFrame(typed)
+
+
+def convert_dataset(csv_path, parquet_path=None):
+    """
+    Convert a dataset CSV into a typed Parquet file (see `typed_dataset`).
+
+    All the columns are converted, so any column group can be read from it, and `load_and_preproces_data`
+    only reads the columns of the selected group. The sha256 of the CSV is stored in the metadata of the
+    Parquet file, so the loader can tell whether the file is still up to date with the CSV.
+
+    :param csv_path: path of the dataset CSV.
+    :param parquet_path: path of the Parquet file (default: next to the CSV, see `dataset_parquet_path`).
+    :return: path of the Parquet file
+    """
+    parquet_path = parquet_path or dataset_parquet_path(csv_path)
+    source_sha256 = file_sha256(csv_path)
+    table = pa.Table.from_pandas(typed_dataset(pd.read_csv(csv_path)), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           SOURCE_SHA256_KEY: source_sha256.encode("ascii")})
+
+    # Write into a temporary file first, so the loader never reads a half written dataset
+    tmp_path = f"{parquet_path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, parquet_path)
+
+    return parquet_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a dataset CSV into a typed Parquet file")
+    parser.add_argument("csv_path", help="Dataset CSV, e.g. EDA_Madrid_SCALED.csv")
+    parser.add_argument("--output", default=None, help="Parquet file (default: next to the CSV)")
+    args = parser.parse_args()
+
+    path = convert_dataset(args.csv_path, args.output)
+    print(f"Dataset converted to {path}")
@@ -0,0 +1,449 @@
+import json
+import os
+import shutil
+import numpy as np
+
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.ensemble import VotingRegressor
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.pipeline import Pipeline
+
+from src.data_processing.partitioned_knn import PartitionedKNNRegressor
+
+# Node arrays of a compiled tree ensemble, saved as one `.npy` file each
+NODE_ARRAYS = ["feature", "threshold", "left", "default_left", "value"]
+METADATA_NAME = "compiled_trees.json"
+
+# XGBoost objectives whose prediction is the raw sum of the trees (identity link)
+XGBOOST_IDENTITY_OBJECTIVES = {"reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror"}
+
+# Rows traversed at once, bounds the (rows x trees) node matrix of the traversal
+TRAVERSAL_CHUNK_ROWS = 4096
+
+
+def flatten_trees(left, right, feature, threshold, default_left, value, roots):
+    """
+    Renumber the nodes of a set of trees level by level into contiguous node arrays.
+
+    After the renumbering the root of the tree `i` is the node `i`, the right child of a node is always next
+    to its left child (`left + 1`) and the leaves point to themselves, so every row walks every tree with the
+    same number of steps and a single gather per array.
+
+    :param left: left child of every node (-1 for the leaves), with the nodes of all the trees concatenated.
+    :param right: right child of every node (-1 for the leaves).
+    :param feature: column of the split of every node.
+    :param threshold: threshold of every node, rows with `x <= threshold` go to the left child.
+    :param default_left: whether the rows with a missing value go to the left child.
+    :param value: value of every node (used for the leaves).
+    :param roots: root node of every tree.
+    :return: tuple with the node arrays (feature, threshold, left, default_left, value) and the depth
+    """
+    n_nodes = len(left)
+    order = np.empty(n_nodes, dtype=np.int64)
+    new_left = np.empty(n_nodes, dtype=np.int32)
+
+    frontier = np.asarray(roots, dtype=np.int64)
+    start, depth = 0, -1
+    while len(frontier):
+        new_ids = np.arange(start, start + len(frontier))
+        order[new_ids] = frontier
+        next_id = start + len(frontier)
+
+        # The children of the internal nodes of this level are the next level, the left and right children
+        # of every node next to each other
+        internal = left[frontier] >= 0
+        n_internal = int(internal.sum())
+        new_left[new_ids] = new_ids
+        new_left[new_ids[internal]] = next_id + 2 * np.arange(n_internal)
+
+        frontier = np.column_stack([left[frontier[internal]], right[frontier[internal]]]).ravel()
+        start, depth = next_id, depth + 1
+
+    # The rows are float32, so `x <= threshold` is the same as `x <= largest float32 <= threshold`
+    threshold = np.asarray(threshold, dtype=np.float64)[order]
+    threshold32 = threshold.astype(np.float32)
+    rounded_up = threshold32 > threshold
+    threshold32[rounded_up] = np.nextafter(threshold32[rounded_up], np.float32(-np.inf))
+
+    is_leaf = left[order] < 0
+    return (
+        np.where(is_leaf, 0, feature[order]).astype(np.int32),
+        # The leaves always go to the "left" child, which is the leaf itself
+        np.where(is_leaf, np.float32(np.inf), threshold32),
+        new_left,
+        (is_leaf | default_left[order].astype(bool)),
+        value[order].astype(np.float64),
+    ), depth
+
+
+class CompiledTreeEnsemble(BaseEstimator, RegressorMixin):
+    """
+    Tree ensemble (Random Forest or XGBoost) stored as flat node arrays and evaluated with NumPy.
+
+    All the rows walk all the trees at the same time: every step gathers the split of the current node of
+    every (row, tree) pair and moves to its left or right child, the leaves point to themselves. The rows are
+    compared in float32 like scikit-learn and XGBoost do, so the same leaves are reached.
+
+    :param feature: column of the split of every node.
+    :param threshold: threshold of every node, rows with `x <= threshold` go to the left child.
+    :param left: left child of every node, the right child is `left + 1`.
+    :param default_left: whether the rows with a missing value go to the left child.
+    :param value: value of every leaf.
+    :param n_trees: number of trees, the root of the tree `i` is the node `i`.
+    :param depth: depth of the deepest tree.
+    :param aggregation: "mean" (Random Forest) or "sum" (XGBoost) of the leaves of every tree.
+    :param base_score: value added to the aggregation (base score of XGBoost).
+    """
+
+    def __init__(self, feature, threshold, left, default_left, value, n_trees, depth, aggregation="mean",
+                 base_score=0.0):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.default_left = default_left
+        self.value = value
+        self.n_trees = n_trees
+        self.depth = depth
+        self.aggregation = aggregation
+        self.base_score = base_score
+
+    def fit(self, X=None, y=None):
+        # Compiled from a fitted model, there is nothing to fit
+        return self
+
+    def __sklearn_is_fitted__(self):
+        return True
+
+    @classmethod
+    def from_forest(cls, forest):
+        """Compile a fitted scikit-learn Random Forest (or Extra Trees) regressor."""
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+        def concatenate(attribute):
+            return np.concatenate([getattr(tree, attribute) for tree in trees])
+
+        # Shift the children of every tree to the global numbering, keeping -1 for the leaves
+        left = np.concatenate([np.where(tree.children_left >= 0, tree.children_left + offset, -1)
+                               for tree, offset in zip(trees, offsets)])
+        right = np.concatenate([np.where(tree.children_right >= 0, tree.children_right + offset, -1)
+                                for tree, offset in zip(trees, offsets)])
+        if hasattr(trees[0], "missing_go_to_left"):
+            default_left = concatenate("missing_go_to_left")
+        else:
+            default_left = np.zeros(len(left), dtype=bool)
+
+        arrays, depth = flatten_trees(left, right, concatenate("feature"), concatenate("threshold"), default_left,
+                                      np.concatenate([tree.value[:, 0, 0] for tree in trees]), offsets[:-1])
+        return cls(*arrays, n_trees=len(trees), depth=depth, aggregation="mean")
+
+    @classmethod
+    def from_xgboost(cls, model):
+        """Compile a fitted XGBRegressor from the JSON dump of its booster."""
+        booster = model.get_booster()
+        learner = json.loads(booster.save_raw("json"))["learner"]
+
+        objective = learner["objective"]["name"]
+        if objective not in XGBOOST_IDENTITY_OBJECTIVES:
+            raise ValueError(f"Only the regression objectives with identity link can be compiled, not {objective}")
+        gradient_booster = learner["gradient_booster"]
+        if gradient_booster["name"] != "gbtree":
+            raise ValueError(f"Only the gbtree booster can be compiled, not {gradient_booster['name']}")
+
+        trees = gradient_booster["model"]["trees"]
+
+        # Trees of the best iteration when the model was trained with early stopping, like `predict` does
+        best_iteration = booster.attr("best_iteration")
+        if best_iteration is not None:
+            trees_per_iteration = int(gradient_booster["model"]["gbtree_model_param"].get("num_parallel_tree", 1))
+            trees = trees[:(int(best_iteration) + 1) * trees_per_iteration]
+
+        if any(any(tree.get("split_type", [])) for tree in trees):
+            raise ValueError("The XGBoost model has categorical splits, they cannot be compiled")
+
+        offsets = np.cumsum([0] + [len(tree["left_children"]) for tree in trees])
+
+        def concatenate(key, dtype):
+            return np.concatenate([np.asarray(tree[key], dtype=dtype) for tree in trees])
+
+        left = np.concatenate([np.where(np.asarray(tree["left_children"]) >= 0,
+                                        np.asarray(tree["left_children"]) + offset, -1)
+                               for tree, offset in zip(trees, offsets)])
+        right = np.concatenate([np.where(np.asarray(tree["right_children"]) >= 0,
+                                         np.asarray(tree["right_children"]) + offset, -1)
+                                for tree, offset in zip(trees, offsets)])
+
+        # XGBoost sends `x < condition` to the left child: for float32 rows it is the same as
+        # `x <= previous float32 of condition`. The leaves keep their value in `split_conditions`
+        conditions = concatenate("split_conditions", np.float32)
+        threshold = np.nextafter(conditions, np.float32(-np.inf))
+
+        arrays, depth = flatten_trees(left, right, concatenate("split_indices", np.int64), threshold,
+                                      concatenate("default_left", np.int64), conditions, offsets[:-1])
+
+        base_score = float(str(learner["learner_model_param"]["base_score"]).strip("[]"))
+        return cls(*arrays, n_trees=len(trees), depth=depth, aggregation="sum", base_score=base_score)
+
+    def _leaf_values(self, X):
+        """Return the value of the leaf reached by every row in every tree, shape (n_rows, n_trees)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_columns = X.shape
+        has_missing = bool(np.isnan(X).any())
+
+        # Position of the first value of every row in the flattened matrix, so the split value of every
+        # (row, tree) pair is a single flat gather
+        flat_X = X.ravel()
+        row_start = (np.arange(n_rows, dtype=np.int32) * n_columns)[:, None]
+
+        node = np.broadcast_to(np.arange(self.n_trees, dtype=np.int32), (n_rows, self.n_trees))
+        for _ in range(self.depth):
+            x = np.take(flat_X, np.take(self.feature, node) + row_start)
+            go_right = x > np.take(self.threshold, node)
+            if has_missing:
+                go_right |= np.isnan(x) & ~np.take(self.default_left, node)
+            node = np.take(self.left, node) + go_right
+
+        return np.take(self.value, node)
+
+    def predict(self, X):
+        X = np.asarray(X)
+        predictions = np.empty(len(X))
+
+        for start in range(0, len(X), TRAVERSAL_CHUNK_ROWS):
+            leaves = self._leaf_values(X[start:start + TRAVERSAL_CHUNK_ROWS])
+            if self.aggregation == "mean":
+                predictions[start:start + len(leaves)] = leaves.mean(axis=1)
+            else:
+                # XGBoost adds the leaves in float32
+                predictions[start:start + len(leaves)] = np.float32(self.base_score) + \
+                    leaves.astype(np.float32).sum(axis=1, dtype=np.float32)
+
+        return predictions
+
+    def save(self, directory):
+        """Save the node arrays as `.npy` files (they can be memory mapped) and the metadata as JSON."""
+        os.makedirs(directory, exist_ok=True)
+        for name in NODE_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+        metadata = {"n_trees": self.n_trees, "depth": self.depth, "aggregation": self.aggregation,
+                    "base_score": self.base_score}
+        with open(os.path.join(directory, METADATA_NAME), "w") as file:
+            json.dump(metadata, file)
+
+    @classmethod
+    def load(cls, directory, mmap=False):
+        """Load a compiled ensemble saved with `save`, with memory mapped node arrays if `mmap`."""
+        with open(os.path.join(directory, METADATA_NAME), "r") as file:
+            metadata = json.load(file)
+
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in NODE_ARRAYS]
+        return cls(*arrays, **metadata)
+
+
+class CompiledVotingRegressor(BaseEstimator, RegressorMixin):
+    """
+    Voting Regressor whose members are compiled (trees) or indexed (Manhattan KNN), the others are kept as
+    they are.
+
+    :param names: names of the members.
+    :param estimators_: compiled or original members.
+    :param weights: weights of the members (None: equal weights).
+    """
+
+    def __init__(self, names, estimators_, weights=None):
+        self.names = names
+        self.estimators_ = estimators_
+        self.weights = weights
+
+    def fit(self, X=None, y=None):
+        # Compiled from a fitted model, there is nothing to fit
+        return self
+
+    def __sklearn_is_fitted__(self):
+        return True
+
+    def predict(self, X):
+        return np.average(np.column_stack([estimator.predict(X) for estimator in self.estimators_]),
+                          axis=1, weights=self.weights)
+
+
+def is_compilable(model):
+    """Return True if `model` is a tree ensemble that `compile_model` converts."""
+    if hasattr(model, "get_booster"):
+        return True
+    estimators = getattr(model, "estimators_", None)
+    return isinstance(estimators, list) and len(estimators) > 0 and hasattr(estimators[0], "tree_")
+
+
+def compile_model(model, cache_dir=None, mmap=False):
+    """
+    Compile the Random Forest and XGBoost members of a model and index its Manhattan KNN member (see
+    `PartitionedKNNRegressor`). Other models are returned as they are.
+
+    With `cache_dir` the node arrays of every compiled member are saved in a subdirectory the first time and
+    loaded from it afterwards (memory mapped with `mmap=True`, so the processes share them). The KNN index
+    is rebuilt on every load, it only takes a fraction of a second, and it is private to each process even with
+    `mmap=True`. The members already compiled by `load_model(mmap=True)` are kept as they are.
+
+    :param model: fitted model (VotingRegressor, Random Forest, XGBRegressor or KNeighborsRegressor).
+    :param cache_dir: directory of the compiled node arrays (None: compile in memory).
+    :param mmap: load the cached node arrays memory mapped.
+    :return: compiled model
+    """
+    if isinstance(model, VotingRegressor):
+        kept = [i for i, (_, estimator) in enumerate(model.estimators) if estimator != "drop"]
+        names = [model.estimators[i][0] for i in kept]
+        weights = None if model.weights is None else [model.weights[i] for i in kept]
+        members = [compile_model(estimator, os.path.join(cache_dir, name) if cache_dir else None, mmap)
+                   for name, estimator in zip(names, model.estimators_)]
+        return CompiledVotingRegressor(names, members, weights)
+
+    if isinstance(model, KNeighborsRegressor):
+        try:
+            return PartitionedKNNRegressor.from_estimator(model)
+        except ValueError:
+            # Other metrics or layouts cannot be indexed exactly
+            return model
+
+    if not is_compilable(model):
+        return model
+
+    if cache_dir and os.path.exists(os.path.join(cache_dir, METADATA_NAME)):
+        return CompiledTreeEnsemble.load(cache_dir, mmap=mmap)
+
+    if hasattr(model, "get_booster"):
+        compiled = CompiledTreeEnsemble.from_xgboost(model)
+    else:
+        compiled = CompiledTreeEnsemble.from_forest(model)
+
+    if cache_dir:
+        # Save into a temporary directory and rename it, another worker may be compiling the same model
+        tmp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+        compiled.save(tmp_dir)
+        try:
+            os.replace(tmp_dir, cache_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if mmap:
+            compiled = CompiledTreeEnsemble.load(cache_dir, mmap=True)
+
+    return compiled
+
+
+def detach_tree_members(model, directory):
+    """
+    Save the Random Forest and XGBoost members of a model as compiled node arrays and remove them from it.
+
+    Every tree member is compiled and saved in a subdirectory of `directory` named after it (see
+    `CompiledTreeEnsemble.save`) and replaced by None, so the rest of the model can be pickled without the
+    trees. `attach_tree_members` puts them back. The members that cannot be compiled are kept as they are.
+
+    :param model: fitted model (Pipeline, VotingRegressor, Random Forest or XGBRegressor), modified in place.
+    :param directory: directory of the compiled node arrays.
+    :return: the model without its tree members (None if the model itself is a tree ensemble)
+    """
+    if isinstance(model, Pipeline):
+        name, final_step = model.steps[-1]
+        model.steps[-1] = (name, detach_tree_members(final_step, os.path.join(directory, name)))
+        return model
+
+    if isinstance(model, VotingRegressor):
+        names = [name for name, estimator in model.estimators if estimator != "drop"]
+        model.estimators_ = [detach_tree_members(estimator, os.path.join(directory, name))
+                             for name, estimator in zip(names, model.estimators_)]
+        # `named_estimators_` keeps its own references to the members
+        for name, estimator in zip(names, model.estimators_):
+            model.named_estimators_[name] = estimator
+        return model
+
+    if not is_compilable(model):
+        return model
+
+    try:
+        if hasattr(model, "get_booster"):
+            compiled = CompiledTreeEnsemble.from_xgboost(model)
+        else:
+            compiled = CompiledTreeEnsemble.from_forest(model)
+    except ValueError:
+        # Objectives or splits that cannot be compiled, the member stays in the pickled model
+        return model
+
+    compiled.save(directory)
+    return None
+
+
+def attach_tree_members(model, directory, mmap=False):
+    """
+    Put back the tree members removed by `detach_tree_members` as compiled ensembles.
+
+    :param model: model returned by `detach_tree_members`, modified in place.
+    :param directory: directory of the compiled node arrays.
+    :param mmap: load the node arrays memory mapped.
+    :return: the model with its compiled tree members
+    """
+    if model is None:
+        return CompiledTreeEnsemble.load(directory, mmap=mmap)
+
+    if isinstance(model, Pipeline):
+        name, final_step = model.steps[-1]
+        model.steps[-1] = (name, attach_tree_members(final_step, os.path.join(directory, name), mmap))
+        return model
+
+    if isinstance(model, VotingRegressor):
+        names = [name for name, estimator in model.estimators if estimator != "drop"]
+        model.estimators_ = [attach_tree_members(estimator, os.path.join(directory, name), mmap)
+                             for name, estimator in zip(names, model.estimators_)]
+        for name, estimator in zip(names, model.estimators_):
+            model.named_estimators_[name] = estimator
+
+    return model
+
+
+def compile_serving_pipeline(pipeline, cache_dir=None, mmap=False):
+    """
+    Return the serving pipeline with its model compiled (see `compile_model`), the scaler is kept.
+
+    :param pipeline: serving pipeline (folded scaler + model).
+    :param cache_dir: directory of the compiled node arrays (None: compile in memory).
+    :param mmap: load the cached node arrays memory mapped.
+    :return: sklearn Pipeline
+    """
+    name, model = pipeline.steps[-1]
+    return Pipeline(pipeline.steps[:-1] + [(name, compile_model(model, cache_dir, mmap))])
+
+
+def parity_rows(pipeline, n_rows=256, seed=0):
+    """
+    Random raw rows around the scaled range of the model, to compare a compiled pipeline with the original.
+
+    :param pipeline: serving pipeline (folded scaler + model).
+    :return: (n_rows, n_features) matrix
+    """
+    scaler = pipeline.steps[0][1]
+    rng = np.random.default_rng(seed)
+    return scaler.shift + scaler.scale * rng.normal(size=(n_rows, len(scaler.shift)))
+
+
+def check_parity(reference, compiled, X, rtol=1e-5):
+    """
+    Check that a compiled model predicts the same as the original one.
+
+    :param reference: original model.
+    :param compiled: compiled model.
+    :param X: rows to predict.
+    :param rtol: maximum difference relative to the largest prediction (XGBoost adds its trees in float32).
+    :return: maximum relative difference
+    :raises ValueError: if a prediction differs more than `rtol`.
+    """
+    expected = reference.predict(X)
+    if len(expected) == 0:
+        return 0.0
+
+    scale = max(float(np.abs(expected).max()), np.finfo(np.float64).tiny)
+    max_difference = float(np.abs(compiled.predict(X) - expected).max()) / scale
+    if max_difference > rtol:
+        raise ValueError(f"The compiled model differs from the original one (max relative difference "
+                         f"{max_difference:.2e})")
+    return max_difference
@@ -1,26 +1,57 @@
+import os
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
-def load_and_preproces_data(URL, test_size_fraction):
+from src.data_processing.build_training_dataset import dataset_parquet_path, parquet_source_sha256
+from src.data_processing.feature_encoder import TARGET_COLUMNS, FEATURE_COLUMNS
+from utils.file_hash import file_sha256
+
+def read_dataset(path, columns):
+    """
+    Read only the given columns of the dataset.
+
+    A Parquet file converted with `src/data_processing/build_training_dataset.py` is read directly. For a CSV,
+    its converted Parquet file is read instead when it exists next to it and was converted from this exact CSV
+    (the sha256 of the CSV recorded in its metadata); otherwise only the given columns of the CSV are parsed.
+
+    :param path: path or URL of the dataset (CSV or Parquet).
+    :param columns: columns to read.
+    :return: DataFrame with the columns in the given order
+    """
+    if not path.endswith(".parquet"):
+        parquet_path = dataset_parquet_path(path)
+        if os.path.isfile(path) and os.path.isfile(parquet_path) and \
+                parquet_source_sha256(parquet_path) == file_sha256(path):
+            path = parquet_path
+
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)[columns]
+
+def load_and_preproces_data(URL, test_size_fraction, columns=FEATURE_COLUMNS, random_state=42):
     """
     Load and preprocess the dataset from the given CSV URL, selecting relevant features for training a regression model to predict property prices.
 
-    - Reads the dataset from the specified CSV file.
+    - Reads only the target and feature columns of the dataset, from its typed Parquet file if it was converted (see `read_dataset`).
     - Selects a predefined subset of features (Group 1) considered important for the model.
     - Separates the target variables ('PRICE' and 'UNITPRICE') from the predictors.
     - Handles class stratification by splitting the data into frequent and rare target price classes to ensure a balanced train-test split.
     - Returns the training and testing sets for both features and target.
 
-    :param URL: Path or URL to the CSV dataset file.
+    :param URL: Path or URL to the CSV (or converted Parquet) dataset file.
     :type URL: str
     :param test_size_fraction: Fraction of the dataset to include in the test split.
     :type test_size_fraction: float
+    :param columns: Feature columns (column group) selected for the model.
+    :type columns: list
+    :param random_state: Seed of the train-test split.
+    :type random_state: int
     :return: Four pandas DataFrames: X_train, X_test, y_train, y_test
     :rtype: tuple
     """
 
-    # Load the data
-    df = pd.read_csv(URL)
+    # Load the data, only the columns of the selected group
+    df = read_dataset(URL, TARGET_COLUMNS + list(columns))
 
     # Select important feautres
     # Group 2
@@ -32,21 +63,8 @@ def load_and_preproces_data(URL, test_size_fraction):
                  'PERIOD_201803', 'PERIOD_201806', 'PERIOD_201809', 'PERIOD_201812']]'''
 
     # Group 1
-    df_new = df[['PRICE', 'UNITPRICE', 'CONSTRUCTEDAREA',
-                 'HASTERRACE', 'ISPARKINGSPACEINCLUDEDINPRICE',
-                 'ROOMNUMBER', 'BATHNUMBER', 'HASSWIMMINGPOOL',
-                 'ISINTOPFLOOR', 'DISTANCE_TO_CITY_CENTER', 'DISTANCE_TO_METRO',
-                 'DISTANCE_TO_CASTELLANA', 'CADMAXBUILDINGFLOOR', 'FLOORCLEAN',
-                 'LOCATIONNAME_0', 'LOCATIONNAME_1', 'LOCATIONNAME_2',
-                 'LOCATIONNAME_3', 'LOCATIONNAME_4', 'LOCATIONNAME_5', 'LOCATIONNAME_6',
-                 'LOCATIONNAME_7', 'LOCATIONNAME_8', 'LOCATIONNAME_9', 'DISTRICTS_ARGANZUELA',
-                 'DISTRICTS_BARAJAS', 'DISTRICTS_CARABANCHEL', 'DISTRICTS_CENTRO',
-                 'DISTRICTS_CHAMARTIN', 'DISTRICTS_CHAMBERI', 'DISTRICTS_CIUDAD LINEAL',
-                 'DISTRICTS_FUENCARRAL-EL PARDO', 'DISTRICTS_HORTALEZA', 'DISTRICTS_LATINA',
-                 'DISTRICTS_MONCLOA-ARAVACA', 'DISTRICTS_MORATALAZ', 'DISTRICTS_PUENTE DE VALLECAS',
-                 'DISTRICTS_RETIRO', 'DISTRICTS_SALAMANCA', 'DISTRICTS_SAN BLAS-CANILLEJAS',
-                 'DISTRICTS_TETUAN', 'DISTRICTS_USERA', 'DISTRICTS_VICALVARO',
-                 'DISTRICTS_VILLA DE VALLECAS', 'DISTRICTS_VILLAVERDE']]
+    # The column layout is shared with the FeatureEncoder used by the API, so both can not drift apart
+    df_new = df[TARGET_COLUMNS + list(columns)]
 
     # Try with all the features do not give a good result
     # Group 3
@@ -82,12 +100,12 @@ def load_and_preproces_data(URL, test_size_fraction):
     X_stratified = X.loc[y.isin(frequent_classes)]
     y_stratified = y.loc[y.isin(frequent_classes)]
     X_train_st, X_test_st, y_train_st, y_test_st = train_test_split(
-        X_stratified, y_stratified, test_size=test_size_fraction, stratify=y_stratified, random_state=42)
+        X_stratified, y_stratified, test_size=test_size_fraction, stratify=y_stratified, random_state=random_state)
 
     X_rare = X.loc[y.isin(rare_classes)]
     y_rare = y.loc[y.isin(rare_classes)]
     X_train_rare, X_test_rare, y_train_rare, y_test_rare = train_test_split(
-        X_rare, y_rare, test_size=test_size_fraction, random_state=42)
+        X_rare, y_rare, test_size=test_size_fraction, random_state=random_state)
 
     # Concat frequent and not frequent classes
     X_train = pd.concat([X_train_st, X_train_rare])
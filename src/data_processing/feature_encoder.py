@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from operator import attrgetter
+from unidecode import unidecode
+
+# Root of the project, two levels above src/data_processing
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# Path of the json where each location name is mapped to its group
+LOCATION_GROUPS_PATH = os.path.join(project_root, "data", "new_data", "locationnameGroup.json")
+
+# Target columns of the dataset
+TARGET_COLUMNS = ['PRICE', 'UNITPRICE']
+
+# Numeric columns of the model, in the same order as the training dataset (Group 1)
+NUMERIC_COLUMNS = [
+    'CONSTRUCTEDAREA', 'HASTERRACE', 'ISPARKINGSPACEINCLUDEDINPRICE',
+    'ROOMNUMBER', 'BATHNUMBER', 'HASSWIMMINGPOOL', 'ISINTOPFLOOR',
+    'DISTANCE_TO_CITY_CENTER', 'DISTANCE_TO_METRO', 'DISTANCE_TO_CASTELLANA',
+    'CADMAXBUILDINGFLOOR', 'FLOORCLEAN'
+]
+
+# Define the columns for the location features
+LOCATION_COLUMNS = [
+    'LOCATIONNAME_0', 'LOCATIONNAME_1', 'LOCATIONNAME_2',
+    'LOCATIONNAME_3', 'LOCATIONNAME_4', 'LOCATIONNAME_5',
+    'LOCATIONNAME_6', 'LOCATIONNAME_7', 'LOCATIONNAME_8', 'LOCATIONNAME_9'
+]
+
+# Define the columns for the district features
+DISTRICT_COLUMNS = [
+    'DISTRICTS_ARGANZUELA', 'DISTRICTS_BARAJAS', 'DISTRICTS_CARABANCHEL', 'DISTRICTS_CENTRO',
+    'DISTRICTS_CHAMARTIN', 'DISTRICTS_CHAMBERI', 'DISTRICTS_CIUDAD LINEAL',
+    'DISTRICTS_FUENCARRAL-EL PARDO', 'DISTRICTS_HORTALEZA', 'DISTRICTS_LATINA',
+    'DISTRICTS_MONCLOA-ARAVACA', 'DISTRICTS_MORATALAZ', 'DISTRICTS_PUENTE DE VALLECAS',
+    'DISTRICTS_RETIRO', 'DISTRICTS_SALAMANCA', 'DISTRICTS_SAN BLAS-CANILLEJAS',
+    'DISTRICTS_TETUAN', 'DISTRICTS_USERA', 'DISTRICTS_VICALVARO',
+    'DISTRICTS_VILLA DE VALLECAS', 'DISTRICTS_VILLAVERDE'
+]
+
+# Columns used to train the model, in order
+FEATURE_COLUMNS = NUMERIC_COLUMNS + LOCATION_COLUMNS + DISTRICT_COLUMNS
+
+# Continuous features normalized with the StandardScaler
+CONTINUOUS_FEATURES = ['CONSTRUCTEDAREA', 'CADMAXBUILDINGFLOOR',
+                       'DISTANCE_TO_CITY_CENTER', 'DISTANCE_TO_METRO', 'DISTANCE_TO_CASTELLANA', 'ROOMNUMBER',
+                       'BATHNUMBER', 'FLOORCLEAN']
+
+# Attributes of PropertyFeatures that fill NUMERIC_COLUMNS, in the same order
+NUMERIC_FIELDS = [
+    'constructed_area', 'has_terrace', 'is_parkingspace_included',
+    'number_of_rooms', 'number_of_bathrooms', 'has_swimming_pool', 'is_top_floor',
+    'distance_to_city_center', 'distance_to_city_metro', 'distance_to_city_castellana',
+    'constructed_year', 'floorclean'
+]
+
+
+@lru_cache(maxsize=4096)
+def normalize_name(name):
+    """
+    Normalize a location or district name the same way the one-hot columns were built
+    (accents removed and upper case). The result is cached, so `unidecode` only runs once per distinct name.
+    """
+    return unidecode(name).upper()
+
+
+class FeatureEncoder:
+    """
+    Encode property features into the column layout used to train the model.
+
+    The encoder is built once and keeps:
+    - A fixed column order (`FEATURE_COLUMNS`), the same one selected by `load_and_preproces_data`.
+    - O(1) dictionaries from location and district names to the index of their one-hot column.
+    - A preallocated row buffer per thread, so single predictions do not allocate.
+
+    :param location_name_map: dictionary from normalized location name to its group (0-9).
+    :param dtype: dtype of the encoded matrices (float32 by default). Use float64 when the raw features are
+        scaled afterwards and the result must match the float64 scaling used to build the training dataset.
+    """
+
+    def __init__(self, location_name_map, dtype=np.float32):
+        self.columns = FEATURE_COLUMNS
+        self.dtype = dtype
+        self.n_features = len(FEATURE_COLUMNS)
+        self.continuous_indexes = np.array([FEATURE_COLUMNS.index(c) for c in CONTINUOUS_FEATURES])
+
+        # Index of the one-hot column of every location name
+        location_offset = len(NUMERIC_COLUMNS)
+        self.location_index = {
+            name: location_offset + group for name, group in location_name_map.items()
+        }
+
+        # Index of the one-hot column of every district name (without the 'DISTRICTS_' prefix)
+        district_offset = len(NUMERIC_COLUMNS) + len(LOCATION_COLUMNS)
+        self.district_index = {
+            column[len('DISTRICTS_'):]: district_offset + i for i, column in enumerate(DISTRICT_COLUMNS)
+        }
+
+        self._numeric_values = attrgetter(*NUMERIC_FIELDS)
+        self._buffers = threading.local()
+
+    @classmethod
+    def from_json(cls, json_path=LOCATION_GROUPS_PATH, dtype=np.float32):
+        """
+        Build the encoder from the json where each location name is mapped to its group.
+
+        :param json_path: path of `locationnameGroup.json`.
+        :param dtype: dtype of the encoded matrices.
+        :return: FeatureEncoder
+        """
+        with open(json_path, 'r', encoding='utf-8') as file:
+            location_name_map = json.load(file)
+
+        return cls(location_name_map, dtype=dtype)
+
+    def location_column(self, name):
+        """Return the index of the location one-hot column of `name`, or None if it is unknown."""
+        return self.location_index.get(normalize_name(name))
+
+    def district_column(self, name):
+        """Return the index of the district one-hot column of `name`, or None if it is unknown."""
+        return self.district_index.get(normalize_name(name))
+
+    def _validate(self, features):
+        """Return the location and district column indexes of `features`, or raise ValueError."""
+        location_column = self.location_column(features.location)
+        if location_column is None:
+            raise ValueError(f"Invalid location name: {normalize_name(features.location)}")
+
+        district_column = self.district_column(features.district)
+        if district_column is None:
+            raise ValueError(f"Invalid district name: DISTRICTS_{normalize_name(features.district)}")
+
+        return location_column, district_column
+
+    def encode_row(self, features, out=None):
+        """
+        Encode a single property into a (1, n_features) row.
+
+        :param features: object with the attributes of `PropertyFeatures`.
+        :param out: optional (1, n_features) buffer. By default, a buffer owned by the
+            current thread is reused, so the result is only valid until the next call in the same thread.
+        :return: the encoded row.
+        :raises ValueError: if the location or district name is not valid.
+        """
+        location_column, district_column = self._validate(features)
+
+        if out is None:
+            out = getattr(self._buffers, 'row', None)
+            if out is None:
+                out = self._buffers.row = np.zeros((1, self.n_features), dtype=self.dtype)
+
+        out.fill(0)
+        out[0, :len(NUMERIC_COLUMNS)] = self._numeric_values(features)
+        out[0, location_column] = 1
+        out[0, district_column] = 1
+
+        return out
+
+    def encode_batch(self, rows, out=None):
+        """
+        Encode a list of properties into a matrix with one row per valid property.
+
+        :param rows: list of objects with the attributes of `PropertyFeatures`.
+        :param out: optional buffer with at least `len(rows)` rows and n_features columns.
+        :return: tuple with the encoded matrix of the valid rows, the positions of those rows in `rows`
+            and a list of `{"index", "detail"}` errors for the rows that could not be encoded.
+        """
+        valid_positions = []
+        numeric_values = []
+        location_columns = []
+        district_columns = []
+        errors = []
+
+        # Resolve the one-hot columns of every row
+        for position, features in enumerate(rows):
+            try:
+                location_column, district_column = self._validate(features)
+            except ValueError as e:
+                errors.append({"index": position, "detail": str(e)})
+                continue
+
+            valid_positions.append(position)
+            numeric_values.append(self._numeric_values(features))
+            location_columns.append(location_column)
+            district_columns.append(district_column)
+
+        n_rows = len(valid_positions)
+        if out is None:
+            X = np.zeros((n_rows, self.n_features), dtype=self.dtype)
+        else:
+            X = out[:n_rows]
+            X.fill(0)
+
+        if n_rows:
+            # Copy the numeric features and set the one-hot columns of the whole batch at once
+            X[:, :len(NUMERIC_COLUMNS)] = numeric_values
+            row_indexes = np.arange(n_rows)
+            X[row_indexes, location_columns] = 1
+            X[row_indexes, district_columns] = 1
+
+        return X, valid_positions, errors
+
+    def _column_indexes(self, names, index):
+        """
+        Return the one-hot column index of every name (-1 if unknown), normalizing each distinct name once.
+
+        :param names: pandas Series with the names.
+        :param index: dictionary from normalized name to column index.
+        """
+        names = pd.Series(names, dtype='category')
+        category_columns = np.array(
+            [index.get(normalize_name(str(name)), -1) for name in names.cat.categories] + [-1], dtype=np.int64
+        )
+        return category_columns[names.cat.codes.to_numpy()]
+
+    def encode_frame(self, df, out=None):
+        """
+        Encode a DataFrame whose columns are the attributes of `PropertyFeatures` (a chunk of a file).
+
+        The numeric columns are copied with a single vectorized assignment and the names are normalized once
+        per distinct value, so the cost per row is much lower than `encode_batch`.
+
+        :param df: DataFrame with the columns of NUMERIC_FIELDS plus `location` and `district`.
+        :param out: optional buffer with at least `len(df)` rows and n_features columns.
+        :return: tuple with the encoded matrix of the valid rows, the positions of those rows in `df`
+            and a list of `{"index", "detail"}` errors for the rows that could not be encoded.
+        """
+        location_columns = self._column_indexes(df['location'], self.location_index)
+        district_columns = self._column_indexes(df['district'], self.district_index)
+        numeric_values = df[NUMERIC_FIELDS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+        # Same messages as `_validate`, a missing numeric value is also an error
+        errors = []
+        invalid_positions = np.flatnonzero(
+            (location_columns < 0) | (district_columns < 0) | np.isnan(numeric_values).any(axis=1)
+        )
+        for position in invalid_positions:
+            if location_columns[position] < 0:
+                detail = f"Invalid location name: {normalize_name(str(df['location'].iloc[position]))}"
+            elif district_columns[position] < 0:
+                detail = f"Invalid district name: DISTRICTS_{normalize_name(str(df['district'].iloc[position]))}"
+            else:
+                missing = [field for field, value in zip(NUMERIC_FIELDS, numeric_values[position]) if np.isnan(value)]
+                detail = f"Missing or invalid numeric values: {', '.join(missing)}"
+            errors.append({"index": int(position), "detail": detail})
+
+        valid_positions = np.setdiff1d(np.arange(len(df)), invalid_positions)
+        n_rows = len(valid_positions)
+        if out is None:
+            X = np.zeros((n_rows, self.n_features), dtype=self.dtype)
+        else:
+            X = out[:n_rows]
+            X.fill(0)
+
+        if n_rows:
+            X[:, :len(NUMERIC_COLUMNS)] = numeric_values[valid_positions]
+            row_indexes = np.arange(n_rows)
+            X[row_indexes, location_columns[valid_positions]] = 1
+            X[row_indexes, district_columns[valid_positions]] = 1
+
+        return X, valid_positions, errors
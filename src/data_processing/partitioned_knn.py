@@ -0,0 +1,224 @@
+import numpy as np
+
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.neighbors import KDTree
+
+from src.data_processing.feature_encoder import FEATURE_COLUMNS, LOCATION_COLUMNS, DISTRICT_COLUMNS
+
+# One-hot columns that partition the training rows: every partition is a location group + district
+PARTITION_COLUMNS = LOCATION_COLUMNS + DISTRICT_COLUMNS
+
+# Metrics of KNeighborsRegressor equivalent to the Manhattan distance
+MANHATTAN_METRICS = {"manhattan", "cityblock", "l1"}
+
+# Queries searched at once, bounds the (queries x partitions) distance matrix
+QUERY_CHUNK_ROWS = 1024
+
+# Below this number of (query, row) pairs a group is scanned with NumPy, cheaper than a KD-tree query
+BRUTE_FORCE_MAX_PAIRS = 65536
+
+
+class PartitionedKNNRegressor(BaseEstimator, RegressorMixin):
+    """
+    Exact Manhattan KNN regressor indexed by partition.
+
+    The Manhattan distance is a sum over the columns, so it splits into the distance between the one-hot
+    location/district columns and the distance between the other columns. The training rows are grouped by
+    their one-hot signature and every group gets a KD-tree on the other columns (the 8 continuous features
+    and the binary flags).
+
+    For a query, the distance to the signature of a group is exact for all the rows of the group, and with
+    the distance to the bounding box of the group in the other columns it is a lower bound of their full
+    distance. The groups are searched from the lowest bound, and a group is skipped once its bound is not
+    lower than the current k-th neighbor, so the neighbors are the same as a brute force search (up to ties
+    at the k-th distance).
+
+    :param signatures: (n_groups, n_partition_columns) one-hot signature of every group.
+    :param X_tree: other columns of the training rows, sorted by group.
+    :param trees: KD-tree of every group, on the other columns of its rows.
+    :param group_start: position of the first row of every group in `y`.
+    :param box_min: minimum of the KD-tree columns of every group.
+    :param box_max: maximum of the KD-tree columns of every group.
+    :param y: target of the training rows, sorted by group.
+    :param partition_indexes: columns of the one-hot signature.
+    :param tree_indexes: columns indexed by the KD-trees.
+    :param n_neighbors: number of neighbors.
+    :param weights: "uniform" or "distance".
+    """
+
+    def __init__(self, signatures, X_tree, trees, group_start, box_min, box_max, y, partition_indexes,
+                 tree_indexes, n_neighbors=5, weights="uniform"):
+        self.signatures = signatures
+        self.X_tree = X_tree
+        self.trees = trees
+        self.group_start = group_start
+        self.box_min = box_min
+        self.box_max = box_max
+        self.y = y
+        self.partition_indexes = partition_indexes
+        self.tree_indexes = tree_indexes
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+
+    def fit(self, X=None, y=None):
+        # Built from a fitted KNeighborsRegressor, there is nothing to fit
+        return self
+
+    def __sklearn_is_fitted__(self):
+        return True
+
+    @classmethod
+    def from_estimator(cls, knn, leaf_size=40):
+        """
+        Index the training rows of a fitted KNeighborsRegressor.
+
+        The KD-trees keep their own copy of the training rows, sorted by partition. When the KNN was loaded with
+        `load_model(mmap=True)`, its memory mapped `_fit_X` is only read here: the index is private to each
+        process, like the model loaded in memory.
+
+        :param knn: KNeighborsRegressor with Manhattan distance, fitted on the layout of FEATURE_COLUMNS.
+        :param leaf_size: leaf size of the KD-trees.
+        :return: PartitionedKNNRegressor
+        :raises ValueError: if the model cannot be indexed exactly.
+        """
+        metric = knn.effective_metric_
+        if metric not in MANHATTAN_METRICS and not (metric == "minkowski" and knn.effective_metric_params_.get("p") == 1):
+            raise ValueError(f"Only the Manhattan distance can be indexed, not {metric}")
+        if callable(knn.weights) or knn.weights not in ("uniform", "distance"):
+            raise ValueError("Only the 'uniform' and 'distance' weights can be indexed")
+        if knn.n_features_in_ != len(FEATURE_COLUMNS):
+            raise ValueError("The KNN was not trained with the column layout of FEATURE_COLUMNS")
+
+        y = np.asarray(knn._y, dtype=np.float64)
+        if y.ndim == 2 and y.shape[1] == 1:
+            y = y[:, 0]
+        if y.ndim != 1:
+            raise ValueError("Only a single target can be indexed")
+
+        # No copy for a float64 `_fit_X` (also memory mapped), the rows are copied below in the order of the index
+        X = np.asarray(knn._fit_X, dtype=np.float64)
+        partition_indexes = np.array([FEATURE_COLUMNS.index(column) for column in PARTITION_COLUMNS])
+        tree_indexes = np.array([i for i in range(len(FEATURE_COLUMNS)) if i not in set(partition_indexes)])
+
+        partition_values = X[:, partition_indexes]
+        if not np.isin(partition_values, (0.0, 1.0)).all():
+            raise ValueError("The location and district columns of the training rows are not one-hot")
+
+        # Sort the rows by signature, every run of equal signatures is a group
+        signatures, group_of_row = np.unique(partition_values, axis=0, return_inverse=True)
+        order = np.argsort(group_of_row.ravel(), kind="stable")
+        group_start = np.searchsorted(group_of_row.ravel()[order], np.arange(len(signatures) + 1))
+
+        X_tree = np.ascontiguousarray(X[order][:, tree_indexes])
+        trees = [KDTree(X_tree[start:end], leaf_size=leaf_size, metric="manhattan")
+                 for start, end in zip(group_start[:-1], group_start[1:])]
+
+        box_min = np.array([X_tree[start:end].min(axis=0) for start, end in zip(group_start[:-1], group_start[1:])])
+        box_max = np.array([X_tree[start:end].max(axis=0) for start, end in zip(group_start[:-1], group_start[1:])])
+
+        return cls(signatures, X_tree, trees, group_start, box_min, box_max, y[order], partition_indexes, tree_indexes,
+                   n_neighbors=knn.n_neighbors, weights=knn.weights)
+
+    def signature_distances(self, X):
+        """Return the Manhattan distance between the one-hot columns of every query and every group signature."""
+        X_partition = X[:, self.partition_indexes]
+
+        # With 0/1 signatures: |x - 0| where the signature is 0 and |x - 1| where it is 1
+        return np.abs(X_partition) @ (1 - self.signatures).T + np.abs(X_partition - 1) @ self.signatures.T
+
+    def lower_bounds(self, X):
+        """
+        Return a lower bound of the distance between every query and every row of every group: the exact
+        distance to the group signature plus the distance to the bounding box of the group in the other columns.
+        """
+        X_tree = X[:, self.tree_indexes]
+        box_distance = np.zeros((len(X), len(self.signatures)))
+        for column in range(X_tree.shape[1]):
+            values = X_tree[:, column, None]
+            box_distance += np.maximum(self.box_min[:, column] - values, 0) + \
+                np.maximum(values - self.box_max[:, column], 0)
+
+        return self.signature_distances(X) + box_distance
+
+    def _query_group(self, group, X_tree, k):
+        """Return the distance and the position in the group of the k nearest rows of the group."""
+        start, end = self.group_start[group], self.group_start[group + 1]
+        if len(X_tree) * (end - start) > BRUTE_FORCE_MAX_PAIRS:
+            return self.trees[group].query(X_tree, k=k)
+
+        distance = np.abs(X_tree[:, None, :] - self.X_tree[None, start:end]).sum(axis=2)
+        index = np.argpartition(distance, k - 1, axis=1)[:, :k] if k < end - start else \
+            np.broadcast_to(np.arange(end - start), distance.shape)
+        distance = np.take_along_axis(distance, index, axis=1)
+        order = np.argsort(distance, axis=1, kind="stable")
+        return np.take_along_axis(distance, order, axis=1), np.take_along_axis(index, order, axis=1)
+
+    def _kneighbors_chunk(self, X):
+        n_queries, k = len(X), self.n_neighbors
+        bounds = self.lower_bounds(X)
+        group_order = np.argsort(bounds, axis=1, kind="stable")
+        offsets = self.signature_distances(X)
+        X_tree = np.ascontiguousarray(X[:, self.tree_indexes])
+
+        best_distance = np.full((n_queries, k), np.inf)
+        best_index = np.full((n_queries, k), -1, dtype=np.int64)
+
+        for rank in range(len(self.signatures)):
+            # Next closest group of every query, searched while it can still beat the current k-th neighbor
+            groups = group_order[:, rank]
+            queries_range = np.arange(n_queries)
+            active = np.flatnonzero(bounds[queries_range, groups] < best_distance[:, -1])
+            if len(active) == 0:
+                break
+
+            # One KD-tree query per group for all its active queries, the candidates of the round are merged
+            # with the current neighbors at once
+            candidates_distance = np.full((len(active), k), np.inf)
+            candidates_index = np.full((len(active), k), -1, dtype=np.int64)
+            active_groups = groups[active]
+            for group in np.unique(active_groups):
+                rows = np.flatnonzero(active_groups == group)
+                queries = active[rows]
+                start, end = self.group_start[group], self.group_start[group + 1]
+                n_found = min(k, end - start)
+                distance, index = self._query_group(group, X_tree[queries], n_found)
+                candidates_distance[rows, :n_found] = distance + offsets[queries, group, None]
+                candidates_index[rows, :n_found] = index + start
+
+            merged_distance = np.hstack([best_distance[active], candidates_distance])
+            merged_index = np.hstack([best_index[active], candidates_index])
+            keep = np.argsort(merged_distance, axis=1, kind="stable")[:, :k]
+            best_distance[active] = np.take_along_axis(merged_distance, keep, axis=1)
+            best_index[active] = np.take_along_axis(merged_index, keep, axis=1)
+
+        return best_distance, best_index
+
+    def kneighbors(self, X):
+        """
+        Return the distance and the position in `y` of the `n_neighbors` nearest training rows of every query.
+
+        :param X: (n_queries, n_features) matrix.
+        :return: tuple of (n_queries, n_neighbors) arrays, sorted by distance
+        """
+        X = np.asarray(X, dtype=np.float64)
+        results = [self._kneighbors_chunk(X[start:start + QUERY_CHUNK_ROWS])
+                   for start in range(0, len(X), QUERY_CHUNK_ROWS)]
+        if not results:
+            return np.empty((0, self.n_neighbors)), np.empty((0, self.n_neighbors), dtype=np.int64)
+        return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+
+    def predict(self, X):
+        distance, index = self.kneighbors(X)
+        neighbors_y = self.y[index]
+
+        if self.weights == "uniform":
+            return neighbors_y.mean(axis=1)
+
+        # Same weights as scikit-learn: 1 / distance, and only the exact matches when there are any
+        with np.errstate(divide="ignore"):
+            weights = 1.0 / distance
+        exact = np.isinf(weights)
+        has_exact = exact.any(axis=1)
+        weights[has_exact] = exact[has_exact]
+
+        return (neighbors_y * weights).sum(axis=1) / weights.sum(axis=1)
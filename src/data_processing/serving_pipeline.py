@@ -0,0 +1,74 @@
+import numpy as np
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+
+from src.data_processing.feature_encoder import FEATURE_COLUMNS, CONTINUOUS_FEATURES
+
+
+class FoldedScaler(BaseEstimator, TransformerMixin):
+    """
+    StandardScaler folded into the full feature layout of the model.
+
+    Instead of scaling a slice of a DataFrame, the scaler keeps one shift and one scale value per column of
+    `FEATURE_COLUMNS` (0 and 1 for the columns that are not scaled), so the transformation is a single
+    array-in/array-out operation over the encoded matrix.
+
+    :param shift: (array) value subtracted from each column (the mean of the StandardScaler).
+    :param scale: (array) value each column is divided by (the scale of the StandardScaler).
+    """
+
+    def __init__(self, shift=None, scale=None):
+        self.shift = shift
+        self.scale = scale
+
+    @classmethod
+    def from_standard_scaler(cls, scaler):
+        """
+        Fold a fitted StandardScaler of the continuous features into the full column layout.
+
+        :param scaler: StandardScaler fitted on `CONTINUOUS_FEATURES` (the one logged by `scaling_dataset.py`).
+        :return: FoldedScaler
+        """
+        scaled_columns = list(getattr(scaler, 'feature_names_in_', CONTINUOUS_FEATURES))
+        column_indexes = [FEATURE_COLUMNS.index(column) for column in scaled_columns]
+
+        shift = np.zeros(len(FEATURE_COLUMNS))
+        scale = np.ones(len(FEATURE_COLUMNS))
+        shift[column_indexes] = scaler.mean_ if scaler.with_mean else 0
+        scale[column_indexes] = scaler.scale_ if scaler.with_std else 1
+
+        return cls(shift=shift, scale=scale)
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.shift) / self.scale
+
+
+def build_serving_pipeline(scaler, model):
+    """
+    Build the single serving artifact: the folded scaler followed by the trained model.
+
+    The pipeline receives the raw encoded matrix (in the order of `FEATURE_COLUMNS`) and returns the
+    predicted prices, so the API does not need to download or apply the scaler separately.
+
+    :param scaler: StandardScaler fitted on the continuous features.
+    :param model: model trained on the scaled dataset.
+    :return: sklearn Pipeline
+    :raises ValueError: if the model was trained with a different column layout.
+    """
+    feature_names = getattr(model, 'feature_names_in_', None)
+    if feature_names is not None and list(feature_names) != FEATURE_COLUMNS:
+        raise ValueError("The model was not trained with the column layout of FEATURE_COLUMNS")
+
+    return Pipeline([
+        ('scaler', FoldedScaler.from_standard_scaler(scaler)),
+        ('model', model),
+    ])
+
+
+def is_serving_pipeline(model):
+    """Return True if `model` already contains the folded scaler."""
+    return isinstance(model, Pipeline) and isinstance(model.steps[0][1], FoldedScaler)
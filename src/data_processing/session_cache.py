@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from sklearn.model_selection import KFold
+
+from src.data_processing.data_preprocessing import load_and_preproces_data
+from src.data_processing.feature_encoder import FEATURE_COLUMNS, project_root
+from utils.file_hash import file_sha256
+
+# Folder of the cached training sessions, one subfolder per dataset file, column group and split
+SESSION_CACHE_DIR = os.environ.get("SESSION_CACHE_DIR", os.path.join(project_root, "session_cache"))
+
+# Version of the preprocessing of the cached sessions, part of the key of a session. Increase it whenever
+# `load_and_preproces_data` (columns, types, stratified split) or the cached arrays change, so the sessions
+# cached by the previous code are not served again
+SESSION_FORMAT_VERSION = 1
+
+# Arrays of a cached session: the features in float32 and the target and row labels as in the dataset
+SESSION_ARRAYS = ["X_train", "X_test", "y_train", "y_test", "index_train", "index_test"]
+
+
+def session_key(data_hash, columns, test_size_fraction, random_state):
+    """Key of a cached session: the dataset file, the column group, the train/test split and the preprocessing."""
+    key = json.dumps({"data": data_hash, "columns": list(columns), "test_size_fraction": test_size_fraction,
+                      "random_state": random_state, "format": SESSION_FORMAT_VERSION})
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class TrainingSession:
+    """
+    Train and test sets of a training session, loaded once and shared by every trainer.
+
+    The first load of a dataset reads and splits the CSV with `load_and_preproces_data` and writes the
+    features as contiguous float32 `.npy` files in SESSION_CACHE_DIR. The next runs memory map them, so the
+    CSV is not read again. The features are read-only DataFrames on top of the memory mapped arrays (no
+    copy), and they are already in the float32 C-contiguous layout that the tree models fit on, so the
+    searches do not copy them into fresh arrays for every candidate either. Memory mapped inputs are also
+    passed by reference to the joblib workers of the searches.
+
+    The cross-validation folds are computed once per number of folds and the same fold indices are given to
+    every model family (`cv=session.folds(5)`).
+
+    :param X_train: DataFrame with the training features.
+    :param X_test: DataFrame with the test features.
+    :param y_train: Series with the training target.
+    :param y_test: Series with the test target.
+    :param key: key of the session in the cache (None if it is not cached).
+    :param path: folder of the session in the cache (None if it is not cached), worker processes memory map
+        it with `from_cache` instead of receiving a copy of the data.
+    """
+
+    def __init__(self, X_train, X_test, y_train, y_test, key=None, path=None):
+        self.X_train = X_train
+        self.X_test = X_test
+        self.y_train = y_train
+        self.y_test = y_test
+        self.key = key
+        self.path = path
+        self._folds = {}
+
+    @classmethod
+    def load(cls, path, test_size_fraction, columns=FEATURE_COLUMNS, random_state=42, cache_dir=SESSION_CACHE_DIR):
+        """
+        Load the train and test sets of a dataset from the session cache, or build and cache them.
+
+        :param path: path of the scaled dataset CSV (a URL is read without cache).
+        :param test_size_fraction: fraction of the dataset used as test set.
+        :param columns: feature columns (column group) of the models.
+        :param random_state: seed of the train/test split.
+        :param cache_dir: folder of the cached sessions.
+        :return: TrainingSession
+        """
+        if not os.path.isfile(path):
+            X_train, X_test, y_train, y_test = load_and_preproces_data(path, test_size_fraction, columns,
+                                                                       random_state)
+            return cls(X_train.astype(np.float32), X_test.astype(np.float32), y_train, y_test)
+
+        key = session_key(file_sha256(path), columns, test_size_fraction, random_state)
+        session_dir = os.path.join(cache_dir, key)
+
+        if not os.path.exists(os.path.join(session_dir, "session.json")):
+            X_train, X_test, y_train, y_test = load_and_preproces_data(path, test_size_fraction, columns,
+                                                                       random_state)
+            arrays = {
+                "X_train": np.ascontiguousarray(X_train, dtype=np.float32),
+                "X_test": np.ascontiguousarray(X_test, dtype=np.float32),
+                "y_train": y_train.to_numpy(),
+                "y_test": y_test.to_numpy(),
+                "index_train": X_train.index.to_numpy(),
+                "index_test": X_test.index.to_numpy(),
+            }
+            metadata = {"path": os.path.abspath(path), "columns": list(X_train.columns), "target": y_train.name,
+                        "test_size_fraction": test_size_fraction, "random_state": random_state}
+
+            # Write the session in a temporary folder and move it at once, a crash can not leave it half written
+            tmp_dir = f"{session_dir}.tmp{os.getpid()}"
+            os.makedirs(tmp_dir, exist_ok=True)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+            with open(os.path.join(tmp_dir, "session.json"), "w") as f:
+                json.dump(metadata, f)
+            try:
+                os.replace(tmp_dir, session_dir)
+            except OSError:
+                # Another run cached the same session first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            print(f"Training session {key} cached in {session_dir}")
+
+        return cls.from_cache(session_dir)
+
+    @classmethod
+    def from_cache(cls, session_dir):
+        """Memory map a cached session, the arrays are read-only."""
+        with open(os.path.join(session_dir, "session.json")) as f:
+            metadata = json.load(f)
+        arrays = {name: np.load(os.path.join(session_dir, f"{name}.npy"), mmap_mode="r") for name in SESSION_ARRAYS}
+
+        def frame(split):
+            return pd.DataFrame(arrays[f"X_{split}"], columns=metadata["columns"],
+                                index=pd.Index(arrays[f"index_{split}"]), copy=False)
+
+        def target(split):
+            return pd.Series(arrays[f"y_{split}"], index=pd.Index(arrays[f"index_{split}"]), name=metadata["target"],
+                             copy=False)
+
+        return cls(frame("train"), frame("test"), target("train"), target("test"),
+                   key=os.path.basename(session_dir), path=session_dir)
+
+    def data(self):
+        """Return the train and test sets like `load_and_preproces_data`: X_train, X_test, y_train, y_test."""
+        return self.X_train, self.X_test, self.y_train, self.y_test
+
+    def folds(self, n_splits):
+        """
+        Return the cross-validation folds of the training set, computed once per number of folds.
+
+        They are the same folds as `cv=n_splits` in GridSearchCV (KFold without shuffling).
+
+        :param n_splits: number of folds.
+        :return: list of (train indices, validation indices)
+        """
+        if n_splits not in self._folds:
+            self._folds[n_splits] = list(KFold(n_splits=n_splits).split(self.X_train))
+        return self._folds[n_splits]
@@ -1,10 +1,13 @@
-from src.data_processing.data_preprocessing import load_and_preproces_data
+from src.data_processing.session_cache import TrainingSession
+from src.models.distillation import distill_ensemble
 from src.models.ensemble_voting_regressor import train_ensemble_model
 from src.models.knn import train_and_log_knn
 from src.models.linear_regressor import train_and_log_linear_regressor
 from src.models.random_forest import train_and_log_random_forest_regressor
+from src.models.search_orchestrator import run_search
 from src.models.svm_regressor import train_and_log_svm_regressor
 from src.models.xgboost_regressor import train_and_log_xgboost_regressor
+from utils.utils import load_scaler
 
 def main():
     # Path where data is stored
@@ -13,26 +16,37 @@ def main():
     # This variable represents the fraction of the original dataset used to create the test set
     test_size_fraction = 0.8
 
-    # Obtain the train and test datasets
-    X_train, X_test, y_train, y_test = load_and_preproces_data(URL, test_size_fraction)
+    # MLflow run where the StandardScaler of the dataset was logged (see src/eda/scaling_dataset.py)
+    scaler_run_id = "3235ac7dbbd24123a5954bc24351ea03"
+
+    # Obtain the train and test datasets, cached as memory mapped float32 matrices between runs
+    session = TrainingSession.load(URL, test_size_fraction)
+    X_train, X_test, y_train, y_test = session.data()
 
     # Train and predict with KNN
-    #train_and_log_knn(X_train, X_test, y_train, y_test)
+    #train_and_log_knn(X_train, X_test, y_train, y_test, cv=session.folds(5))
 
     # Train and predict with Linear Regressor
-    #train_and_log_linear_regressor(X_train, X_test, y_train, y_test)
+    #train_and_log_linear_regressor(X_train, X_test, y_train, y_test, cv=session.folds(5))
 
     # Train and predict with Random Forest
-    train_and_log_random_forest_regressor(X_train, X_test, y_train, y_test)
+    train_and_log_random_forest_regressor(X_train, X_test, y_train, y_test, cv=session.folds(5))
 
     # Train and Predict with XGBoost Regressor
-    #train_and_log_xgboost_regressor(X_train, X_test, y_train, y_test)
+    #train_and_log_xgboost_regressor(X_train, X_test, y_train, y_test, cv=session.folds(3))
 
     # Train and Predict with SVM Regressor
-    #train_and_log_svm_regressor(X_train, X_test, y_train, y_test)
+    #train_and_log_svm_regressor(X_train, X_test, y_train, y_test, cv=session.folds(5))
+
+    # Search the hyperparameters of all the models above on a single process pool, resumable if interrupted
+    #run_search(X_train, X_test, y_train, y_test, threads_per_fit=1, folds=session.folds, session_dir=session.path)
+
+    # Train and Predict with Ensembles, the scaler is folded into the registered model
+    #ensemble = train_ensemble_model(X_train, X_test, y_train, y_test, scaler=load_scaler(scaler_run_id),
+    #                                cv=session.folds(3))
 
-    # Train and Predict with Ensembles
-    #train_ensemble_model(X_train, X_test, y_train, y_test)
+    # Distill the ensemble into a single lightweight model, registered as "voting_regressor_student"
+    #distill_ensemble(ensemble, X_train, X_test, y_train, y_test, scaler=load_scaler(scaler_run_id))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,145 @@
+import mlflow
+import mlflow.sklearn
+import pickle
+import time
+import numpy as np
+import pandas as pd
+
+from xgboost import XGBRegressor
+
+from src.data_processing.compiled_trees import compile_model
+from src.data_processing.feature_encoder import CONTINUOUS_FEATURES
+from utils.utils import calculate_metrics, save_model
+
+# Name of the registered student model, next to the "voting_regressor" ensemble
+STUDENT_MODEL_NAME = "voting_regressor_student"
+
+# Hyperparameters of the student: a single shallow gradient boosted model
+STUDENT_PARAMS = {
+    'n_estimators': 400,
+    'max_depth': 6,
+    'learning_rate': 0.05,
+    'subsample': 0.8,
+    'colsample_bytree': 1.0,
+}
+
+
+def augment_rows(X, n_copies, noise_scale, seed=42):
+    """
+    Return the rows of X plus `n_copies` jittered copies of them.
+
+    Only the continuous (scaled) features are jittered, with a normal noise of `noise_scale` standard
+    deviations, so the one-hot columns stay valid. The teacher labels these rows, so the student also learns
+    how the ensemble behaves between the training listings and not only on them (the KNN with distance
+    weights returns the exact target of a training row).
+
+    :param X: DataFrame with the scaled training features.
+    :param n_copies: number of jittered copies of every row.
+    :param noise_scale: standard deviation of the noise, in standard deviations of the scaled features.
+    :return: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    continuous = [column for column in CONTINUOUS_FEATURES if column in X.columns]
+
+    copies = [X]
+    for _ in range(n_copies):
+        jittered = X.copy()
+        jittered[continuous] += rng.normal(scale=noise_scale, size=(len(X), len(continuous)))
+        copies.append(jittered)
+
+    return pd.concat(copies, ignore_index=True)
+
+
+def measure_latency(model, X, batch_size, repeat=20):
+    """Return the mean time in milliseconds to predict a batch of `batch_size` rows."""
+    X = X.iloc[:batch_size]
+    model.predict(X)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model.predict(X)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def distill_ensemble(ensemble, X_train, X_test, y_train, y_test, scaler=None, n_copies=2, noise_scale=0.1,
+                     student_params=None):
+    """
+    Distill the Voting Regressor into a single XGBoost student and register it as `voting_regressor_student`.
+
+    The student is trained on the predictions of the ensemble (the teacher) over the training rows and
+    jittered copies of them. The accuracy of both models on the test set, the fidelity of the student to the
+    teacher, their latency and their size are logged to MLflow.
+
+    :param ensemble: trained Voting Regressor returned by `train_ensemble_model`.
+    :param scaler: optional StandardScaler used to scale the dataset, folded into the registered student.
+    :param n_copies: number of jittered copies of every training row labeled by the teacher.
+    :param noise_scale: standard deviation of the jitter, in standard deviations of the scaled features.
+    :param student_params: hyperparameters of the student (default: STUDENT_PARAMS).
+    :return: the trained student
+    """
+    # Initial configuration
+    mlflow.set_tracking_uri("http://127.0.0.1:5000")
+
+    # Set the name of the experiment
+    mlflow.set_experiment("TFM_column_group2")
+
+    run_name = f"{STUDENT_MODEL_NAME}_{int(time.time())}"
+
+    with mlflow.start_run(run_name=run_name):
+        params = dict(STUDENT_PARAMS, **(student_params or {}))
+        mlflow.log_params({**params, "n_copies": n_copies, "noise_scale": noise_scale})
+
+        # Label the training rows and their jittered copies with the teacher, the compiled ensemble gives
+        # the same predictions much faster
+        X_distill = augment_rows(X_train, n_copies, noise_scale)
+        teacher = compile_model(ensemble)
+        y_distill = teacher.predict(X_distill)
+
+        # Train the student on the predictions of the teacher
+        student = XGBRegressor(objective='reg:squarederror', n_jobs=-1, **params)
+        student.fit(X_distill, y_distill)
+
+        # Accuracy of the teacher and the student on the test set
+        y_test_teacher = ensemble.predict(X_test)
+        y_test_student = student.predict(X_test)
+        metrics_teacher = calculate_metrics(y_test, y_test_teacher)
+        metrics_student = calculate_metrics(y_test, y_test_student)
+
+        # Fidelity: how well the student reproduces the teacher
+        fidelity = calculate_metrics(y_test_teacher, y_test_student)
+
+        # Latency and size of both models
+        gains = {
+            "latency_1_row_ms_teacher": measure_latency(ensemble, X_test, 1),
+            "latency_1_row_ms_student": measure_latency(student, X_test, 1),
+            "latency_1000_rows_ms_teacher": measure_latency(ensemble, X_test, 1000, repeat=3),
+            "latency_1000_rows_ms_student": measure_latency(student, X_test, 1000, repeat=3),
+            "size_mb_teacher": len(pickle.dumps(ensemble)) / 1024 ** 2,
+            "size_mb_student": len(pickle.dumps(student)) / 1024 ** 2,
+        }
+
+        # Log in MLFlow
+        for metric, value in metrics_student.items():
+            mlflow.log_metric(f"{metric}_test", value)
+            mlflow.log_metric(f"{metric}_test_teacher", metrics_teacher[metric])
+            mlflow.log_metric(f"{metric}_test_delta", value - metrics_teacher[metric])
+        mlflow.log_metric("r2_fidelity", fidelity['r2'])
+        mlflow.log_metric("mae_fidelity", fidelity['mae'])
+        for metric, value in gains.items():
+            mlflow.log_metric(metric, value)
+
+        # Save the student into the model registry
+        save_model(student, STUDENT_MODEL_NAME, scaler=scaler)
+
+        # Show the accuracy delta and the gains
+        print(f"R2 test: teacher {metrics_teacher['r2']:.4f}, student {metrics_student['r2']:.4f} "
+              f"(delta {metrics_student['r2'] - metrics_teacher['r2']:+.4f})")
+        print(f"MAE test: teacher {metrics_teacher['mae']:.2f}, student {metrics_student['mae']:.2f} "
+              f"(delta {metrics_student['mae'] - metrics_teacher['mae']:+.2f})")
+        print(f"R2 of the student vs the teacher: {fidelity['r2']:.4f}")
+        print(f"Latency 1 row: {gains['latency_1_row_ms_teacher']:.2f} ms -> {gains['latency_1_row_ms_student']:.2f} ms, "
+              f"1000 rows: {gains['latency_1000_rows_ms_teacher']:.2f} ms -> "
+              f"{gains['latency_1000_rows_ms_student']:.2f} ms")
+        print(f"Size: {gains['size_mb_teacher']:.1f} MB -> {gains['size_mb_student']:.1f} MB")
+
+        return student
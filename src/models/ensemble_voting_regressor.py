@@ -10,7 +10,15 @@ from sklearn.model_selection import cross_validate
 from utils.utils import get_regression_scorers, calculate_metrics, save_model
 
 
-def train_ensemble_model(X_train, X_test, y_train, y_test):
+def train_ensemble_model(X_train, X_test, y_train, y_test, scaler=None, cv=3):
+    """
+    Train the Voting Regressor (XGBoost, Random Forest and KNN) with the best hyperparameters found and log it.
+
+    :param scaler: optional StandardScaler used to scale the dataset. If given, it is folded into the
+        registered model, so the artifact predicts directly from the unscaled features.
+    :param cv: number of folds or list of (train, validation) indices of the cross-validation
+        (e.g. `session.folds(3)`).
+    """
     # Initial configuration
     mlflow.set_tracking_uri("http://127.0.0.1:5000")
 
@@ -61,7 +69,7 @@ def train_ensemble_model(X_train, X_test, y_train, y_test):
         # Train the model
         ensemble.fit(X_train, y_train)
 
-        cv_results = cross_validate(ensemble, X_train, y_train, cv=3, scoring=get_regression_scorers(), n_jobs=-1)
+        cv_results = cross_validate(ensemble, X_train, y_train, cv=cv, scoring=get_regression_scorers(), n_jobs=-1)
 
         print(f"Cross-validation results: {cv_results}")
         # Predictions on test and training
@@ -79,7 +87,7 @@ def train_ensemble_model(X_train, X_test, y_train, y_test):
             mlflow.log_metric(f"{metric}_test", value)
 
         # Save the model into the model in mlflow
-        save_model(ensemble, model_name)
+        save_model(ensemble, model_name, scaler=scaler)
 
         # Show some key metrics
         print(f"R2 test: {metrics_test['r2']:.2f}")
@@ -10,7 +10,15 @@ from utils.utils import get_regression_scorers, extract_cv_metrics, calculate_me
     show_linear_model_feature_importance, show_tree_model_feature_importance, save_model
 
 
-def train_and_log_knn(X_train, X_test, y_train, y_test):
+# Grid of hyperparameters searched by `train_and_log_knn` and by the search orchestrator
+KNN_GRID = {
+    'n_neighbors': [3, 5, 7, 10],
+    'weights': ['uniform', 'distance'],
+    'metric': ['euclidean', 'manhattan'],
+}
+
+
+def train_and_log_knn(X_train, X_test, y_train, y_test, cv=5):
     # Initial configuration
     mlflow.set_tracking_uri("http://127.0.0.1:5000")
 
@@ -27,11 +35,7 @@ def train_and_log_knn(X_train, X_test, y_train, y_test):
     # Save the results of the model
     with mlflow.start_run(run_name=run_name):
         # Define the Grid
-        grid = {
-            'n_neighbors': [3, 5, 7, 10],
-            'weights': ['uniform', 'distance'],
-            'metric': ['euclidean', 'manhattan'],
-        }
+        grid = KNN_GRID
 
         '''grid = {
         'n_neighbors': [3, 5, 7, 10],
@@ -50,7 +54,7 @@ def train_and_log_knn(X_train, X_test, y_train, y_test):
                               param_grid=grid,
                               scoring=scoring,
                               refit='r2',
-                              cv=5,n_jobs=-1,
+                              cv=cv,n_jobs=-1,
                               return_train_score=True)
 
         # Take an example of input for the log
@@ -11,7 +11,13 @@ from utils.utils import get_regression_scorers, extract_cv_metrics, calculate_me
     show_linear_model_feature_importance, save_model
 
 
-def train_and_log_linear_regressor(X_train, X_test, y_train, y_test):
+# Grid of hyperparameters searched by `train_and_log_linear_regressor` and by the search orchestrator
+LINEAR_GRID = {
+    'fit_intercept': [True, False]
+}
+
+
+def train_and_log_linear_regressor(X_train, X_test, y_train, y_test, cv=5):
     # Initial configuration
     mlflow.set_tracking_uri("http://127.0.0.1:5000")
 
@@ -28,9 +34,7 @@ def train_and_log_linear_regressor(X_train, X_test, y_train, y_test):
     # Save the results of the model
     with mlflow.start_run(run_name=run_name):
         # Define the Grid
-        grid = {
-            'fit_intercept': [True, False]
-        }
+        grid = LINEAR_GRID
 
         # Define the model
         lr = LinearRegression()
@@ -39,7 +43,7 @@ def train_and_log_linear_regressor(X_train, X_test, y_train, y_test):
         lr_cv = GridSearchCV(estimator=lr, param_grid=grid,
                              scoring=scoring,
                              refit='r2',
-                             cv=5, n_jobs=-1,
+                             cv=cv, n_jobs=-1,
                              return_train_score=True)
 
         # Train the model
@@ -3,13 +3,49 @@ import mlflow.sklearn
 import time
 
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import GridSearchCV
 
-from utils.utils import calculate_metrics, extract_cv_metrics, get_regression_scorers, \
-    show_tree_model_feature_importance, save_model
+from src.models.search_modes import build_search, fit_search
+from utils.utils import calculate_metrics, extract_cv_metrics, show_tree_model_feature_importance, save_model
 
 
-def train_and_log_random_forest_regressor(X_train, X_test, y_train, y_test):
+# Grid of hyperparameters searched by `train_and_log_random_forest_regressor` and by the search orchestrator
+RANDOM_FOREST_GRID = {
+    'n_estimators': [100, 150],
+    'max_depth': [20, 30],
+    'min_samples_split': [3, 10]
+}
+
+
+def search_random_forest_hyperparameters(X_train, y_train, search_mode="grid", cv=5):
+    """
+    Search the hyperparameters of the Random Forest.
+
+    :param search_mode: "grid" fits every candidate on every fold, "halving" uses successive halving with the
+        number of trees as budget, "warm_start" grows the forests of the candidates that only differ in
+        `n_estimators` with `warm_start` (see `build_search`).
+    :param cv: number of folds or list of (train, validation) indices, e.g. the folds of a TrainingSession.
+    :return: tuple (fitted search, cross-validation results, index of the best candidate, search time in seconds)
+    """
+    # Define the grid
+    grid = RANDOM_FOREST_GRID
+
+    ''''min_samples_split': [3, 10],
+        'min_samples_leaf': [2,4,6],
+        'boostrap': [True, False],'''
+
+    # Chose the model
+    rf = RandomForestRegressor(n_jobs=-1)
+
+    # Define the cross-validation
+    rf_cv = build_search(rf, grid, cv=cv, search_mode=search_mode, resource="n_estimators")
+
+    # Train the model using cross-validation
+    results, best_idx, search_time = fit_search(rf_cv, X_train, y_train)
+
+    return rf_cv, results, best_idx, search_time
+
+
+def train_and_log_random_forest_regressor(X_train, X_test, y_train, y_test, search_mode="grid", cv=5):
     # Initial configuration
     mlflow.set_tracking_uri("http://127.0.0.1:5000")
 
@@ -20,44 +56,17 @@ def train_and_log_random_forest_regressor(X_train, X_test, y_train, y_test):
 
     run_name = f"{model_name}_{int(time.time())}"
 
-    # Define custom scorers
-    scoring = get_regression_scorers()
-
     # Save the results of the model
     with mlflow.start_run(run_name=run_name):
-        # Define the grid
-        grid = {
-            'n_estimators': [100, 150],
-            'max_depth': [20, 30],
-            'min_samples_split': [3, 10]
-        }
-
-        ''''min_samples_split': [3, 10],
-            'min_samples_leaf': [2,4,6],
-            'boostrap': [True, False],'''
-
-        # Chose the model
-        rf = RandomForestRegressor(n_jobs=-1)
-
-        # Define the cross-validation
-        rf_cv = GridSearchCV(estimator=rf, param_grid=grid,
-                             scoring=scoring,
-                             refit='r2',
-                             cv = 5, n_jobs=-1,
-                             return_train_score=True)
-
-        # Train the model using cross-validation
-        rf_cv.fit(X_train, y_train)
+        # Search the hyperparameters
+        rf_cv, results, best_idx, search_time = search_random_forest_hyperparameters(X_train, y_train, search_mode, cv)
 
         # Important features
         feature_names = X_train.columns
         show_tree_model_feature_importance(rf_cv.best_estimator_, feature_names)
 
         # Prediction and metrics on training
-        r2_train = rf_cv.best_score_
-        best_idx = rf_cv.best_index_
-        results = rf_cv.cv_results_
-
+        r2_train = results['mean_test_r2'][best_idx]
         metrics_train = extract_cv_metrics(results, best_idx)
 
         # Predictions and Metrics on Test with the best model
@@ -69,11 +78,13 @@ def train_and_log_random_forest_regressor(X_train, X_test, y_train, y_test):
 
         # Log with MlFlow
         mlflow.log_param("best_hyperparameters", best_params)
+        mlflow.log_param("search_mode", search_mode)
         for metric, value in metrics_test.items():
             mlflow.log_metric(f"{metric}_test", value)
         for metric, value in metrics_train.items():
             mlflow.log_metric(metric, value)
         mlflow.log_metric("r2_train", r2_train)
+        mlflow.log_metric("search_time_s", search_time)
 
         # Save the model into the model in mlflow
         save_model(rf_cv.best_estimator_, model_name)
@@ -0,0 +1,248 @@
+import time
+import numpy as np
+
+from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, KFold, ParameterGrid, cross_validate, \
+    train_test_split
+
+from utils.utils import get_regression_scorers
+
+# Search modes of the XGBoost and Random Forest trainers
+SEARCH_MODES = ("grid", "halving", "warm_start")
+
+# Fraction of the training rows held out to stop the boosting of XGBoost in the "halving" mode
+EARLY_STOPPING_FRACTION = 0.1
+
+# Boosting rounds without improvement on the held out rows before XGBoost stops
+EARLY_STOPPING_ROUNDS = 20
+
+# Maximum number of boosting rounds when they are chosen by early stopping
+MAX_BOOSTING_ROUNDS = 1000
+
+
+class FixedPredictions(RegressorMixin, BaseEstimator):
+    """Regressor that returns precomputed predictions, to score a stage of an ensemble with the usual scorers."""
+
+    def __init__(self, predictions=None):
+        self.predictions = predictions
+
+    def predict(self, X):
+        return self.predictions
+
+
+class StagedGridSearchCV(BaseEstimator):
+    """
+    Exhaustive grid search that fits every size of an ensemble only once.
+
+    The candidates that only differ in `n_estimators` share their trees: a forest of 150 trees is a forest
+    of 100 trees plus 50 more. For every fold and every combination of the other hyperparameters, a single
+    ensemble is grown up to the largest `n_estimators` of the grid and scored at every size on the way:
+
+    - estimators with `warm_start` (Random Forest) add the missing trees to the previous size.
+    - XGBoost boosts the largest size once and predicts every size with `iteration_range`, which gives the
+      same predictions as a model trained with that number of rounds.
+
+    The results have the same keys and scores as the `cv_results_` of GridSearchCV with the scorers of
+    `get_regression_scorers` and `return_train_score=True`, refitted on the r2 (only the fit and score times
+    differ), and the best candidate is refitted on all the rows.
+
+    :param estimator: unfitted Random Forest or XGBoost estimator.
+    :param param_grid: grid of hyperparameters, with `n_estimators`.
+    :param cv: number of folds or list of (train, validation) indices.
+    :param n_jobs: number of (fold, combination) ensembles grown in parallel.
+    """
+
+    def __init__(self, estimator, param_grid, cv=5, n_jobs=None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.n_jobs = n_jobs
+
+    def _grow(self, params, sizes, X_train, y_train, X_val, y_val):
+        """Grow an ensemble on a fold up to the largest size and return the scores of every size."""
+        scorers = get_regression_scorers()
+        estimator = clone(self.estimator).set_params(**params)
+        warm_start = "warm_start" in estimator.get_params()
+        if warm_start:
+            estimator.set_params(warm_start=True)
+        else:
+            start = time.perf_counter()
+            estimator.set_params(n_estimators=sizes[-1]).fit(X_train, y_train)
+            boosting_time = time.perf_counter() - start
+
+        stages = []
+        for size in sizes:
+            if warm_start:
+                start = time.perf_counter()
+                estimator.set_params(n_estimators=size).fit(X_train, y_train)
+                fit_time = time.perf_counter() - start
+            else:
+                # Every size is charged with its share of the boosting rounds
+                fit_time = boosting_time * size / sizes[-1]
+
+            start = time.perf_counter()
+            stage = {"fit_time": fit_time}
+            for split, X, y in (("test", X_val, y_val), ("train", X_train, y_train)):
+                if warm_start:
+                    predictions = estimator.predict(X)
+                else:
+                    predictions = estimator.predict(X, iteration_range=(0, size))
+                for metric, scorer in scorers.items():
+                    stage[f"{split}_{metric}"] = scorer(FixedPredictions(predictions), X, y)
+            stage["score_time"] = time.perf_counter() - start
+            stages.append(stage)
+
+        return stages
+
+    def fit(self, X, y, **fit_params):
+        candidates = list(ParameterGrid(self.param_grid))
+        y = np.asarray(y)
+
+        # Candidates that only differ in the number of trees share the same ensemble
+        chains = {}
+        for index, params in enumerate(candidates):
+            others = {name: value for name, value in params.items() if name != 'n_estimators'}
+            chains.setdefault(tuple(sorted(others.items())), []).append((params['n_estimators'], index))
+        chains = [(dict(key), sorted(chain)) for key, chain in chains.items()]
+
+        folds = list(KFold(n_splits=self.cv).split(X)) if isinstance(self.cv, int) else list(self.cv)
+        X_rows = X.iloc if hasattr(X, "iloc") else X
+        grown = Parallel(n_jobs=self.n_jobs)(
+            delayed(self._grow)(others, [size for size, _ in chain], X_rows[train], y[train], X_rows[test], y[test])
+            for others, chain in chains for train, test in folds)
+
+        # Scores of every candidate on every fold, in the order of the candidates
+        scores = [[None] * len(folds) for _ in candidates]
+        for position, (others, chain) in enumerate(chains):
+            for fold in range(len(folds)):
+                for (_, index), stage in zip(chain, grown[position * len(folds) + fold]):
+                    scores[index][fold] = stage
+
+        # Same keys as the cv_results_ of GridSearchCV: the value of every parameter, the scores of every split,
+        # their mean and std and the rank of every scorer (tied candidates share the best rank)
+        self.cv_results_ = {}
+        for name in sorted({name for params in candidates for name in params}):
+            values = np.ma.MaskedArray(np.empty(len(candidates), dtype=object), mask=True)
+            for index, params in enumerate(candidates):
+                if name in params:
+                    values[index] = params[name]
+            self.cv_results_[f"param_{name}"] = values
+        self.cv_results_["params"] = candidates
+
+        for name in scores[0][0]:
+            values = np.array([[fold[name] for fold in candidate] for candidate in scores])
+            if name.startswith(("test_", "train_")):
+                for fold in range(len(folds)):
+                    self.cv_results_[f"split{fold}_{name}"] = values[:, fold]
+            self.cv_results_[f"mean_{name}"] = values.mean(axis=1)
+            self.cv_results_[f"std_{name}"] = values.std(axis=1)
+            if name.startswith("test_"):
+                self.cv_results_[f"rank_{name}"] = rankdata(-self.cv_results_[f"mean_{name}"],
+                                                            method="min").astype(np.int32)
+
+        self.n_trees_fitted_ = len(folds) * sum(chain[-1][0] for _, chain in chains)
+        self.best_index_ = int(np.argmax(self.cv_results_["mean_test_r2"]))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = self.cv_results_["mean_test_r2"][self.best_index_]
+
+        # Refit the best candidate on all the rows
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y, **fit_params)
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+
+def build_search(estimator, grid, cv, search_mode="grid", resource="n_samples"):
+    """
+    Return the hyperparameter search of a trainer.
+
+    - "grid": GridSearchCV with all the scorers of `get_regression_scorers`, refitted on the r2. Every
+      candidate is fitted on every fold.
+    - "halving": HalvingGridSearchCV on the r2. Every candidate is first fitted with a small budget, and only
+      the best third of them goes on to the next round, with three times the budget. The budget is the
+      number of training rows (`resource="n_samples"`) or a parameter of the estimator such as
+      `n_estimators`, which is then searched from a third of its largest value in the grid up to it.
+    - "warm_start": StagedGridSearchCV, the same candidates and results as "grid", but the candidates that
+      only differ in `n_estimators` share their trees.
+
+    :param estimator: unfitted estimator.
+    :param grid: grid of hyperparameters.
+    :param cv: number of folds or list of (train, validation) indices.
+    :param search_mode: "grid", "halving" or "warm_start".
+    :param resource: budget of the "halving" mode.
+    :return: unfitted search
+    """
+    if search_mode == "grid":
+        return GridSearchCV(estimator=estimator, param_grid=grid,
+                            scoring=get_regression_scorers(),
+                            refit='r2',
+                            cv=cv, n_jobs=-1,
+                            return_train_score=True)
+
+    if search_mode == "halving":
+        # With the rows as budget every round subsamples them, so fixed fold indices can not be reused: only
+        # their number is kept
+        if resource == "n_samples" and not isinstance(cv, int):
+            cv = len(cv)
+
+        max_resources = "auto"
+        if resource != "n_samples":
+            max_resources = max(grid[resource])
+            grid = {name: values for name, values in grid.items() if name != resource}
+
+        return HalvingGridSearchCV(estimator=estimator, param_grid=grid,
+                                   scoring='r2',
+                                   resource=resource, max_resources=max_resources,
+                                   cv=cv, n_jobs=-1,
+                                   random_state=42)
+
+    if search_mode == "warm_start":
+        return StagedGridSearchCV(estimator=estimator, param_grid=grid, cv=cv, n_jobs=-1)
+
+    raise ValueError(f"Unknown search mode '{search_mode}', use one of {SEARCH_MODES}")
+
+
+def early_stopping_split(X_train, y_train):
+    """Split the training rows into the rows of the search and the rows that stop the boosting."""
+    return train_test_split(X_train, y_train, test_size=EARLY_STOPPING_FRACTION, random_state=42)
+
+
+def fit_search(search, X_train, y_train, **fit_params):
+    """
+    Fit a search and return the cross-validation results of its best candidate.
+
+    The exhaustive searches already have the mean of every scorer of `get_regression_scorers`. The halving
+    search only scores the r2, and its candidates are compared on different budgets, so the best candidate is
+    cross-validated again with all the scorers on the full budget.
+
+    :param search: search returned by `build_search`.
+    :param fit_params: parameters of the `fit` of the estimator (e.g. the `eval_set` of XGBoost).
+    :return: tuple (results like `cv_results_`, index of the best candidate in them, search time in seconds)
+    """
+    start = time.perf_counter()
+    search.fit(X_train, y_train, **fit_params)
+
+    if not isinstance(search, HalvingGridSearchCV):
+        return search.cv_results_, search.best_index_, time.perf_counter() - start
+
+    results = cross_validate_candidate(search.best_estimator_, X_train, y_train, search.cv, **fit_params)
+    return results, 0, time.perf_counter() - start
+
+
+def cross_validate_candidate(estimator, X_train, y_train, cv, **fit_params):
+    """
+    Cross-validate a single candidate with all the scorers of `get_regression_scorers`.
+
+    :param estimator: candidate (cloned before every fit).
+    :param cv: number of folds or list of (train, validation) indices.
+    :return: results like `cv_results_` with a single candidate (index 0)
+    """
+    scores = cross_validate(clone(estimator), X_train, y_train,
+                            scoring=get_regression_scorers(),
+                            cv=cv, n_jobs=-1,
+                            params=fit_params or None)
+    return {f"mean_{name}": np.array([values.mean()]) for name, values in scores.items()}
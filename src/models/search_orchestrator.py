@@ -0,0 +1,325 @@
+import hashlib
+import itertools
+import json
+import os
+import time
+import mlflow
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import KFold
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.svm import SVR
+from xgboost import XGBRegressor
+
+from src.data_processing.feature_encoder import project_root
+from src.data_processing.session_cache import TrainingSession
+from src.models.knn import KNN_GRID
+from src.models.linear_regressor import LINEAR_GRID
+from src.models.random_forest import RANDOM_FOREST_GRID
+from src.models.svm_regressor import SVM_GRID
+from src.models.xgboost_regressor import XGBOOST_GRID
+from utils.thread_budget import limit_process_threads, thread_budget
+from utils.utils import get_regression_scorers, extract_cv_metrics, calculate_metrics, save_model
+
+# Folder of the checkpoints of the searches, one JSON line per finished (model, params, fold) fit
+CHECKPOINT_DIR = os.path.join(project_root, "search_checkpoints")
+
+# Model families of the search: same grids, folds and registered names as the `train_and_log_*` trainers
+MODEL_FAMILIES = {
+    "random_forest": {"model_name": "random_forest_regressor_80pct", "grid": RANDOM_FOREST_GRID, "cv": 5},
+    "xgboost": {"model_name": "xgboost_regressor", "grid": XGBOOST_GRID, "cv": 3},
+    "knn": {"model_name": "knn_regressor", "grid": KNN_GRID, "cv": 5},
+    "svm": {"model_name": "svm_regressor", "grid": SVM_GRID, "cv": 5},
+    "linear": {"model_name": "linear_regressor", "grid": LINEAR_GRID, "cv": 5},
+}
+
+# Training data and folds of the worker processes, set by `init_search_worker`
+worker_data = None
+worker_folds = None
+
+
+def build_estimator(family, params, n_threads):
+    """Return an unfitted estimator of a model family with the given hyperparameters and number of threads."""
+    if family == "random_forest":
+        return RandomForestRegressor(n_jobs=n_threads, **params)
+    if family == "xgboost":
+        return XGBRegressor(objective='reg:squarederror', n_jobs=n_threads, **params)
+    if family == "knn":
+        return KNeighborsRegressor(n_jobs=n_threads, **params)
+    if family == "svm":
+        return SVR(**params)
+    if family == "linear":
+        return LinearRegression(**params)
+    raise ValueError(f"Unknown model family '{family}', use one of {list(MODEL_FAMILIES)}")
+
+
+def expand_grid(grid):
+    """Return the list of candidates of a grid, in the same order as GridSearchCV."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def task_key(family, params, n_splits, fold):
+    """Key of a (model, params, fold) fit in the checkpoint."""
+    return f"{family}|{json.dumps(params, sort_keys=True)}|{n_splits}|{fold}"
+
+
+def data_fingerprint(X_train, y_train):
+    """Hash of the training data, a checkpoint is only resumed with the same rows, columns and target."""
+    digest = hashlib.sha256()
+    digest.update(",".join(map(str, X_train.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(X_train, index=True).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(pd.Series(np.asarray(y_train)), index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_checkpoint(path):
+    """
+    Return the finished fits of a checkpoint by key.
+
+    The checkpoint is appended one line per fit, so a crash can only leave the last line truncated: the
+    lines that cannot be read are ignored and their fits run again.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["key"]] = record
+    return records
+
+
+def open_checkpoint(path):
+    """Open a checkpoint to append fits, a line truncated by a crash is closed so it stays apart from them."""
+    truncated = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            truncated = f.read(1) != b"\n"
+
+    f = open(path, "a")
+    if truncated:
+        f.write("\n")
+    return f
+
+
+def append_checkpoint(f, record):
+    """Append a finished fit to the checkpoint and flush it to disk."""
+    f.write(json.dumps(record) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def init_search_worker(session_dir, X_train, y_train, folds, n_threads):
+    """
+    Initializer of the worker processes: limit the native thread pools and keep the training data and the
+    folds of the search.
+
+    :param session_dir: folder of a cached TrainingSession, memory mapped by the worker (the training data
+        is then not pickled into every worker). None to use `X_train` and `y_train`.
+    :param folds: dict from number of folds to the list of (train indices, validation indices).
+    """
+    global worker_data, worker_folds
+
+    limit_process_threads(n_threads)
+    if session_dir is not None:
+        session = TrainingSession.from_cache(session_dir)
+        X_train, y_train = session.X_train, session.y_train
+    worker_data = (X_train, y_train, n_threads)
+    worker_folds = folds
+
+
+def fit_candidate(family, params, n_splits, fold):
+    """
+    Fit a candidate on the training part of a fold and score it on both parts of the fold.
+
+    The scores use the same scorers as the GridSearchCV of the trainers (the errors are negative).
+
+    :return: dict with the scores, the fit time and the score time
+    """
+    X_train, y_train, n_threads = worker_data
+    train_index, test_index = worker_folds[n_splits][fold]
+    X_fit, y_fit = X_train.iloc[train_index], y_train.iloc[train_index]
+    X_val, y_val = X_train.iloc[test_index], y_train.iloc[test_index]
+
+    start = time.perf_counter()
+    estimator = build_estimator(family, params, n_threads).fit(X_fit, y_fit)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = {}
+    for metric, scorer in get_regression_scorers().items():
+        scores[f"test_{metric}"] = float(scorer(estimator, X_val, y_val))
+        scores[f"train_{metric}"] = float(scorer(estimator, X_fit, y_fit))
+    score_time = time.perf_counter() - start
+
+    return {"fit_time": fit_time, "score_time": score_time, **scores}
+
+
+def refit_candidate(family, params):
+    """Fit a candidate on all the training data of the worker."""
+    X_train, y_train, n_threads = worker_data
+    return build_estimator(family, params, n_threads).fit(X_train, y_train)
+
+
+def build_cv_results(candidates, records, family, n_splits):
+    """
+    Aggregate the fits of every candidate of a family like the `cv_results_` of GridSearchCV.
+
+    :return: dict with the params, the mean and std of every score and the rank of the r2
+    """
+    results = {"params": candidates}
+    names = [f"{split}_{metric}" for split in ("test", "train") for metric in get_regression_scorers()]
+    names += ["fit_time", "score_time"]
+
+    for name in names:
+        values = np.array([[records[task_key(family, params, n_splits, fold)][name] for fold in range(n_splits)]
+                           for params in candidates])
+        results[f"mean_{name}"] = values.mean(axis=1)
+        results[f"std_{name}"] = values.std(axis=1)
+
+    results["rank_test_r2"] = (-results["mean_test_r2"]).argsort().argsort() + 1
+    return results
+
+
+def run_search(X_train, X_test, y_train, y_test, families=None, threads_per_fit=1, max_workers=None,
+               checkpoint_path=None, folds=None, session_dir=None):
+    """
+    Grid search of several model families on a single process pool, resumable and logged to MLflow.
+
+    Every (model, params, fold) fit of every family is a task of the same pool, and every fit uses
+    `threads_per_fit` threads, so the pool never starts more threads than cores (the trainers nest a
+    GridSearchCV with `n_jobs=-1` over estimators with `n_jobs=-1`). Every finished fit is appended to the
+    checkpoint, and a search interrupted at any point resumes from it with the same training data.
+
+    Once all the fits are done, the best candidate of every family (by mean r2 of the folds) is refitted on
+    all the training data, evaluated on the test set and registered with the same name as its trainer. The
+    search is a parent MLflow run with a child run per family, and a child run per candidate of the family.
+
+    :param families: model families to search (default: all the MODEL_FAMILIES).
+    :param threads_per_fit: threads of every fit.
+    :param max_workers: number of worker processes (default: cores // threads_per_fit).
+    :param checkpoint_path: JSON lines file of the finished fits (default: one file per training data in
+        CHECKPOINT_DIR).
+    :param folds: function that returns the list of (train indices, validation indices) of a number of folds,
+        e.g. `session.folds` to use the same folds as the trainers (default: KFold without shuffling). The
+        folds of every number of folds are computed once and sent once to every worker.
+    :param session_dir: folder of the cached TrainingSession of `X_train` (`session.path`). The workers memory
+        map it instead of receiving a pickled copy of the training data.
+    :return: dict with the best estimator of every family
+    """
+    families = families or list(MODEL_FAMILIES)
+    for family in families:
+        if family not in MODEL_FAMILIES:
+            raise ValueError(f"Unknown model family '{family}', use one of {list(MODEL_FAMILIES)}")
+    max_workers, threads_per_fit = thread_budget(workers=max_workers, threads_per_worker=threads_per_fit)
+
+    if checkpoint_path is None:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        checkpoint_path = os.path.join(CHECKPOINT_DIR, f"search_{data_fingerprint(X_train, y_train)}.jsonl")
+
+    # Every (model, params, fold) fit of the search, without the ones already in the checkpoint
+    records = load_checkpoint(checkpoint_path)
+    candidates = {family: expand_grid(MODEL_FAMILIES[family]["grid"]) for family in families}
+    tasks = [(family, params, MODEL_FAMILIES[family]["cv"], fold)
+             for family in families
+             for params in candidates[family]
+             for fold in range(MODEL_FAMILIES[family]["cv"])]
+    pending = [task for task in tasks if task_key(*task) not in records]
+    print(f"Search of {len(tasks)} fits on {max_workers} workers x {threads_per_fit} threads, "
+          f"{len(tasks) - len(pending)} already in {checkpoint_path}")
+
+    # Folds of every number of folds of the search, computed once
+    if folds is None:
+        def folds(n_splits):
+            return list(KFold(n_splits=n_splits).split(X_train))
+    search_folds = {MODEL_FAMILIES[family]["cv"]: folds(MODEL_FAMILIES[family]["cv"]) for family in families}
+
+    # The workers memory map the cached session, or receive a copy of the training data
+    if session_dir is not None:
+        worker_args = (session_dir, None, None)
+    else:
+        worker_args = (None, X_train, pd.Series(np.asarray(y_train), index=X_train.index))
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_search_worker,
+                             initargs=worker_args + (search_folds, threads_per_fit)) as pool:
+        # Run the pending fits, the checkpoint is written as soon as every fit finishes
+        futures = {pool.submit(fit_candidate, *task): task for task in pending}
+        with open_checkpoint(checkpoint_path) as checkpoint:
+            for done, future in enumerate(as_completed(futures), start=1):
+                family, params, n_splits, fold = futures[future]
+                record = {"key": task_key(family, params, n_splits, fold), "family": family, "params": params,
+                          "fold": fold, **future.result()}
+                append_checkpoint(checkpoint, record)
+                records[record["key"]] = record
+                print(f"[{done}/{len(pending)}] {family} {params} fold {fold}: r2 {record['test_r2']:.4f}")
+
+        # Best candidate of every family, refitted on all the training data in the same pool
+        cv_results = {family: build_cv_results(candidates[family], records, family, MODEL_FAMILIES[family]["cv"])
+                      for family in families}
+        best_index = {family: int(np.argmax(results["mean_test_r2"])) for family, results in cv_results.items()}
+        refits = {family: pool.submit(refit_candidate, family, candidates[family][best_index[family]])
+                  for family in families}
+        best_estimators = {family: future.result() for family, future in refits.items()}
+
+    search_time = time.perf_counter() - start
+
+    # Initial configuration
+    mlflow.set_tracking_uri("http://127.0.0.1:5000")
+
+    # Set the name of the experiment
+    mlflow.set_experiment("TFM_column_group2")
+
+    run_name = f"hyperparameter_search_{int(time.time())}"
+
+    with mlflow.start_run(run_name=run_name):
+        mlflow.log_params({"families": ",".join(families), "max_workers": max_workers,
+                           "threads_per_fit": threads_per_fit, "n_fits": len(tasks)})
+        mlflow.log_metric("search_time_s", search_time)
+
+        for family in families:
+            model_name = MODEL_FAMILIES[family]["model_name"]
+            results, best_idx = cv_results[family], best_index[family]
+
+            with mlflow.start_run(run_name=f"{model_name}_{int(time.time())}", nested=True):
+                # A child run per candidate with its mean scores on the folds
+                for index, params in enumerate(candidates[family]):
+                    with mlflow.start_run(run_name=f"{family}_candidate_{index}", nested=True):
+                        mlflow.log_params(params)
+                        for name, values in results.items():
+                            if name.startswith(("mean_", "std_")):
+                                mlflow.log_metric(name, values[index])
+
+                # Metrics of the best candidate, the same as the trainers
+                metrics_train = extract_cv_metrics(results, best_idx)
+                r2_train = results["mean_test_r2"][best_idx]
+                y_pred = best_estimators[family].predict(X_test)
+                metrics_test = calculate_metrics(y_test, y_pred)
+                best_params = candidates[family][best_idx]
+
+                # Log with MlFlow
+                mlflow.log_param("best_hyperparameters", best_params)
+                for metric, value in metrics_test.items():
+                    mlflow.log_metric(f"{metric}_test", value)
+                for metric, value in metrics_train.items():
+                    mlflow.log_metric(metric, value)
+                mlflow.log_metric("r2_train", r2_train)
+
+                # Save the model into the model in mlflow
+                save_model(best_estimators[family], model_name)
+
+                print(f"{family}: R2 on test {metrics_test['r2']:.2f}, R2 on training {r2_train:.2f}, "
+                      f"best params {best_params}")
+
+    print(f"Search finished in {search_time:.1f}s")
+    return best_estimators
@@ -11,7 +11,17 @@ from utils.utils import get_regression_scorers, extract_cv_metrics, calculate_me
     show_linear_model_feature_importance, save_model
 
 
-def train_and_log_svm_regressor(X_train, X_test, y_train, y_test):
+# Grid of hyperparameters searched by `train_and_log_svm_regressor` and by the search orchestrator
+SVM_GRID = {
+    'kernel': ['rbf', 'linear'],
+    'C': [10, 100],
+    'epsilon': [0.2, 0.3],
+    'gamma': ['scale', 'auto'],
+    'degree': [2, 3]
+}
+
+
+def train_and_log_svm_regressor(X_train, X_test, y_train, y_test, cv=5):
     # Initial configuration
     mlflow.set_tracking_uri("http://127.0.0.1:5000")
 
@@ -28,13 +38,7 @@ def train_and_log_svm_regressor(X_train, X_test, y_train, y_test):
 
     with mlflow.start_run(run_name=run_name):
         # Define the grid of hyperparameters
-        grid = {
-            'kernel': ['rbf', 'linear'],
-            'C': [10, 100],
-            'epsilon': [0.2, 0.3],
-            'gamma': ['scale', 'auto'],
-            'degree': [2, 3]
-        }
+        grid = SVM_GRID
 
         # Define the model
         svr = SVR()
@@ -43,7 +47,7 @@ def train_and_log_svm_regressor(X_train, X_test, y_train, y_test):
         svr_cv = GridSearchCV(estimator=svr, param_grid=grid,
                               scoring=scoring,
                               refit='r2',
-                              cv=5, n_jobs=-1,
+                              cv=cv, n_jobs=-1,
                               return_train_score=True)
 
         # Train
@@ -4,38 +4,44 @@ import time
 import numpy as np
 
 from xgboost import XGBRegressor
-from sklearn.model_selection import GridSearchCV
 from sklearn.metrics import mean_absolute_error, r2_score, mean_squared_error
 
-from utils.utils import get_regression_scorers, extract_cv_metrics, calculate_metrics, \
+from src.models.search_modes import EARLY_STOPPING_ROUNDS, MAX_BOOSTING_ROUNDS, build_search, fit_search, \
+    early_stopping_split, cross_validate_candidate
+from utils.utils import extract_cv_metrics, calculate_metrics, \
     show_linear_model_feature_importance, show_tree_model_feature_importance, save_model
 
 
-def train_and_log_xgboost_regressor(X_train, X_test, y_train, y_test):
-    # Initial configuration
-    mlflow.set_tracking_uri("http://127.0.0.1:5000")
+# Grid of hyperparameters searched by `train_and_log_xgboost_regressor` and by the search orchestrator
+XGBOOST_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [3, 6],
+    'learning_rate': [0.01, 0.1, 0.3],
+    'subsample': [0.8, 1.0],
+}
 
-    # Set the name of the experiment
-    mlflow.set_experiment("TFM_column_group2")
 
-    model_name = "xgboost_regressor_80pct"
+def search_xgboost_hyperparameters(X_train, y_train, search_mode="grid", cv=3):
+    """
+    Search the hyperparameters of XGBoost.
 
-    # Name of the model which will be saved
-    run_name = f"{model_name}_{int(time.time())}"
+    In the "halving" mode the number of boosting rounds is not searched: every candidate boosts until the
+    rmse on a held out part of the training rows stops improving (native early stopping), and the budget of
+    the successive halving is the number of training rows. The held out rows only choose the number of rounds:
+    the winner is then cross-validated and refitted on all the training rows with that number of rounds and
+    without early stopping, and `best_estimator_` and `best_params_` are replaced by that model.
 
-    # Define custom scorers
-    scoring = get_regression_scorers()
+    In the "warm_start" mode every combination of the other hyperparameters is boosted once up to the largest
+    `n_estimators` and every smaller `n_estimators` is scored with the first rounds of the same model.
 
-    with mlflow.start_run(run_name=run_name):
-        # Define the grid of hyperparameters
-        grid = {
-            'n_estimators': [100, 200],
-            'max_depth': [3, 6],
-            'learning_rate': [0.01, 0.1, 0.3],
-            'subsample': [0.8, 1.0],
-        }
-
-        '''grid = {
+    :param search_mode: "grid", "halving" or "warm_start" (see `build_search`).
+    :param cv: number of folds or list of (train, validation) indices, e.g. the folds of a TrainingSession.
+    :return: tuple (fitted search, cross-validation results, index of the best candidate, search time in seconds)
+    """
+    # Define the grid of hyperparameters
+    grid = XGBOOST_GRID
+
+    '''grid = {
     'n_estimators': [100, 200],
     'max_depth': [3, 6, 10],
     'learning_rate': [0.01, 0.1, 0.3],
@@ -45,28 +51,56 @@ def train_and_log_xgboost_regressor(X_train, X_test, y_train, y_test):
     'reg_lambda': [1, 2]
 }'''
 
-        # Define the model
-        xgb = XGBRegressor(objective='reg:squarederror', n_jobs=-1)
-
+    if search_mode != "halving":
         # Cross-validation
-        xgb_cv = GridSearchCV(estimator=xgb, param_grid=grid,
-                              scoring=scoring,
-                              refit='r2',
-                              cv=3, n_jobs=-1,
-                              return_train_score=True)
+        xgb = XGBRegressor(objective='reg:squarederror', n_jobs=-1)
+        xgb_cv = build_search(xgb, grid, cv=cv, search_mode=search_mode)
 
         # Train
-        xgb_cv.fit(X_train, y_train)
+        results, best_idx, search_time = fit_search(xgb_cv, X_train, y_train)
+        return xgb_cv, results, best_idx, search_time
+
+    # Boost until the held out rows stop improving
+    start = time.perf_counter()
+    X_fit, X_val, y_fit, y_val = early_stopping_split(X_train, y_train)
+    grid = {name: values for name, values in grid.items() if name != 'n_estimators'}
+    xgb = XGBRegressor(objective='reg:squarederror', n_jobs=-1, n_estimators=MAX_BOOSTING_ROUNDS,
+                       early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+    xgb_cv = build_search(xgb, grid, cv=cv, search_mode=search_mode)
+    xgb_cv.fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False)
+
+    # Cross-validate and refit the winner on all the training rows with the number of rounds it stopped at
+    best_params = dict(xgb_cv.best_params_, n_estimators=xgb_cv.best_estimator_.best_iteration + 1)
+    best_model = XGBRegressor(objective='reg:squarederror', n_jobs=-1, **best_params)
+    results = cross_validate_candidate(best_model, X_train, y_train, cv)
+    xgb_cv.best_estimator_ = best_model.fit(X_train, y_train)
+    xgb_cv.best_params_ = best_params
+
+    return xgb_cv, results, 0, time.perf_counter() - start
+
+
+def train_and_log_xgboost_regressor(X_train, X_test, y_train, y_test, search_mode="grid", cv=3):
+    # Initial configuration
+    mlflow.set_tracking_uri("http://127.0.0.1:5000")
+
+    # Set the name of the experiment
+    mlflow.set_experiment("TFM_column_group2")
+
+    model_name = "xgboost_regressor_80pct"
+
+    # Name of the model which will be saved
+    run_name = f"{model_name}_{int(time.time())}"
+
+    with mlflow.start_run(run_name=run_name):
+        # Search the hyperparameters
+        xgb_cv, results, best_idx, search_time = search_xgboost_hyperparameters(X_train, y_train, search_mode, cv)
 
         # Important features
         feature_names = X_train.columns
         show_tree_model_feature_importance(xgb_cv.best_estimator_, feature_names)
 
         # Prediction and metrics on training
-        r2_train = xgb_cv.best_score_
-        best_idx = xgb_cv.best_index_
-        results = xgb_cv.cv_results_
-
+        r2_train = results['mean_test_r2'][best_idx]
         metrics_train = extract_cv_metrics(results, best_idx)
 
         # Predictions and Metrics on Test with the best model
@@ -78,11 +112,13 @@ def train_and_log_xgboost_regressor(X_train, X_test, y_train, y_test):
 
         # Log with MlFlow
         mlflow.log_param("best_hyperparameters", best_params)
+        mlflow.log_param("search_mode", search_mode)
         for metric, value in metrics_test.items():
             mlflow.log_metric(f"{metric}_test", value)
         for metric, value in metrics_train.items():
             mlflow.log_metric(metric, value)
         mlflow.log_metric("r2_train", r2_train)
+        mlflow.log_metric("search_time_s", search_time)
 
         # Save the model
         save_model(xgb_cv.best_estimator_, "xgboost_regressor")
@@ -0,0 +1,198 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
+from src.data_processing.feature_encoder import FeatureEncoder
+from src.data_processing.serving_pipeline import build_serving_pipeline, is_serving_pipeline
+from utils.model_cache import load_model
+from utils.thread_budget import limit_model_threads, thread_budget
+from utils.utils import load_scaler
+
+# MLflow run where the StandardScaler of the dataset was logged, folded into older model versions
+SCALER_RUN_ID = "3235ac7dbbd24123a5954bc24351ea03"
+
+# Columns of the output file
+PREDICTION_COLUMN = "PREDICTED_PRICE"
+ERROR_COLUMN = "ERROR"
+
+# The layout of the encoded matrix is checked when the pipeline is built
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+# Model and encoder of the current process, loaded once by `init_scorer`
+scorer = {}
+
+
+def load_scoring_model(model_name="voting_regressor", version="latest", mmap=False, scaler_run_id=SCALER_RUN_ID):
+    """
+    Load the serving pipeline of a registered model through the local model cache, the same way as the API.
+
+    :return: the serving pipeline (folded scaler + model)
+    """
+    model, _ = load_model(model_name, version, mmap=mmap)
+    if not is_serving_pipeline(model):
+        model = build_serving_pipeline(load_scaler(scaler_run_id), model)
+    return model
+
+
+def init_scorer(model_name, version, mmap, n_threads=None):
+    """
+    Load the model and the encoder of the current process (also used as the initializer of the pool).
+
+    :param n_threads: threads the model may use to predict a chunk (None: the n_jobs it was trained with).
+    """
+    scorer["model"] = load_scoring_model(model_name, version, mmap=mmap)
+    if n_threads is not None:
+        threadpool_limits(limits=n_threads)
+        limit_model_threads(scorer["model"], n_threads)
+    scorer["encoder"] = FeatureEncoder.from_json(dtype=np.float64)
+
+
+def score_chunk(chunk, id_column=None):
+    """
+    Encode and predict a chunk of properties.
+
+    :param chunk: DataFrame with the attributes of `PropertyFeatures` as columns.
+    :param id_column: column of the input copied to the output.
+    :return: DataFrame with the id column (if any), the prediction and the error of every row
+    """
+    X, valid_positions, errors = scorer["encoder"].encode_frame(chunk)
+
+    predictions = np.full(len(chunk), np.nan)
+    if len(valid_positions):
+        predictions[valid_positions] = scorer["model"].predict(X)
+
+    error_details = np.full(len(chunk), None, dtype=object)
+    for error in errors:
+        error_details[error["index"]] = error["detail"]
+
+    result = pd.DataFrame({PREDICTION_COLUMN: predictions, ERROR_COLUMN: error_details})
+    if id_column is not None:
+        result.insert(0, id_column, chunk[id_column].to_numpy())
+    return result
+
+
+def read_chunks(input_path, chunk_size):
+    """Stream a CSV or Parquet file in DataFrames of at most `chunk_size` rows."""
+    if input_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(input_path, chunksize=chunk_size, encoding="utf-8")
+
+
+class ResultWriter:
+    """Append the results of every chunk to a CSV or Parquet file, so they are never all in memory."""
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.parquet_writer = None
+        self.rows = 0
+
+    def write(self, result):
+        if self.output_path.endswith(".parquet"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(result.astype({ERROR_COLUMN: "string"}), preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.output_path, table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            result.to_csv(self.output_path, mode="w" if self.rows == 0 else "a", header=self.rows == 0, index=False)
+        self.rows += len(result)
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def score_file(input_path, output_path, chunk_size=50_000, workers=0, model_name="voting_regressor",
+               version="latest", mmap=False, id_column=None, threads_per_worker=None):
+    """
+    Score a file of properties chunk by chunk and write the predictions incrementally.
+
+    With `workers > 0` the chunks are predicted by a pool of processes, each one with its own copy of the
+    model (or shared pages with `mmap=True`). At most two chunks per worker are in flight, so the memory
+    stays bounded whatever the size of the input. The output keeps the order of the input. The cores are
+    split between the workers (the "throughput" thread profile), so they are not oversubscribed.
+
+    :param input_path: CSV or Parquet file with the attributes of `PropertyFeatures` as columns.
+    :param output_path: CSV or Parquet file with the predictions.
+    :param chunk_size: rows per chunk.
+    :param workers: number of worker processes (0: score in the current process).
+    :param model_name: registered model to use.
+    :param version: version of the registered model.
+    :param mmap: load the model with memory mapped arrays.
+    :param id_column: column of the input copied to the output.
+    :param threads_per_worker: threads of every worker (None: the cores divided by the workers).
+    :return: dictionary with the number of rows, errors, seconds and rows per second
+    """
+    _, threads_per_worker = thread_budget("throughput", workers=max(workers, 1), threads_per_worker=threads_per_worker)
+    writer = ResultWriter(output_path)
+    errors = 0
+    start = time.perf_counter()
+
+    def report(result):
+        nonlocal errors
+        writer.write(result)
+        errors += int(result[ERROR_COLUMN].notna().sum())
+        elapsed = time.perf_counter() - start
+        print(f"{writer.rows} rows scored, {writer.rows / elapsed:,.0f} rows/s", file=sys.stderr)
+
+    try:
+        if workers > 0:
+            with ProcessPoolExecutor(workers, initializer=init_scorer, initargs=(model_name, version, mmap, threads_per_worker)) as pool:
+                pending = deque()
+                for chunk in read_chunks(input_path, chunk_size):
+                    pending.append(pool.submit(score_chunk, chunk, id_column))
+                    if len(pending) >= 2 * workers:
+                        report(pending.popleft().result())
+                while pending:
+                    report(pending.popleft().result())
+        else:
+            init_scorer(model_name, version, mmap, threads_per_worker)
+            for chunk in read_chunks(input_path, chunk_size):
+                report(score_chunk(chunk, id_column))
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "rows": writer.rows,
+        "errors": errors,
+        "seconds": seconds,
+        "rows_per_second": writer.rows / seconds if seconds else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict the price of every property of a CSV or Parquet file")
+    parser.add_argument("input", help="CSV or Parquet file with the fields of the /api/v1/predict payload as columns")
+    parser.add_argument("output", help="CSV or Parquet file where the predictions are written")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows read and predicted at once")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (0: no pool)")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Threads of every worker (default: the cores divided by the workers)")
+    parser.add_argument("--model-name", default="voting_regressor")
+    parser.add_argument("--model-version", default="latest")
+    parser.add_argument("--mmap", action="store_true", help="Share the model arrays between the workers")
+    parser.add_argument("--id-column", default=None, help="Column of the input copied to the output")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        parser.error("The output file must be different from the input file")
+
+    stats = score_file(args.input, args.output, chunk_size=args.chunk_size, workers=args.workers,
+                       model_name=args.model_name, version=args.model_version, mmap=args.mmap,
+                       id_column=args.id_column, threads_per_worker=args.threads_per_worker)
+    print(f"Scored {stats['rows']} rows ({stats['errors']} errors) in {stats['seconds']:.1f}s, "
+          f"{stats['rows_per_second']:,.0f} rows/s")
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+import numpy as np
+
+from app.serving.inference_executor import InferenceExecutor
+from app.serving.micro_batcher import MicroBatcher
+
+
+class SlowModel:
+    """Predict the sum of every row after `seconds`, and record how many predictions run at the same time."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def predict(self, X):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running -= 1
+        return X.sum(axis=1)
+
+
+async def predict_rows(batcher, n_rows):
+    rows = [np.full(3, i, dtype=np.float64) for i in range(n_rows)]
+    return await asyncio.gather(*(batcher.predict(row) for row in rows))
+
+
+def run_batches(max_workers, max_concurrency, n_rows=64, batch_size=8, seconds=0.05):
+    model = SlowModel(seconds)
+    executor = InferenceExecutor(predict_fn=model.predict, max_workers=max_workers, mode="thread")
+    batcher = MicroBatcher(executor.predict, max_batch_size=batch_size, max_latency_ms=1,
+                           max_concurrency=max_concurrency)
+
+    start = time.perf_counter()
+    predictions = asyncio.run(predict_rows(batcher, n_rows))
+    return predictions, time.perf_counter() - start, model, batcher
+
+
+def test_concurrent_batches_overlap():
+    predictions, elapsed, model, batcher = run_batches(max_workers=4, max_concurrency=4)
+
+    # Every request gets the prediction of its own row
+    assert predictions == [3.0 * i for i in range(64)]
+    assert batcher.stats()["rows"] == 64
+
+    # The 8 batches of 8 rows run 4 at a time on the 4 workers, instead of one after another (8 x 50 ms)
+    assert model.max_running == 4
+    assert elapsed < 0.3
+
+
+def test_single_batch_in_flight():
+    predictions, elapsed, model, batcher = run_batches(max_workers=4, max_concurrency=1)
+
+    assert predictions == [3.0 * i for i in range(64)]
+    assert model.max_running == 1
+
+
+def test_failed_batch_frees_its_slot():
+    calls = []
+
+    async def predict_fn(X):
+        calls.append(len(X))
+        if len(calls) == 1:
+            raise RuntimeError("model failure")
+        return X.sum(axis=1)
+
+    async def scenario():
+        batcher = MicroBatcher(predict_fn, max_batch_size=4, max_latency_ms=1, max_concurrency=1)
+        first = await asyncio.gather(batcher.predict(np.ones(2)), return_exceptions=True)
+        second = await batcher.predict(np.ones(2))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first[0], RuntimeError)
+    assert second == 2.0
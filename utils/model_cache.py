@@ -0,0 +1,351 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import joblib
+import mlflow
+import mlflow.sklearn
+import yaml
+
+from mlflow.tracking import MlflowClient
+
+from src.data_processing.compiled_trees import attach_tree_members, detach_tree_members
+
+logger = logging.getLogger(__name__)
+
+# Root of the project, one level above utils
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# URI where the MLFlow server is running, it is only contacted when the cache misses
+MLFLOW_TRACKING_URI = os.environ.get("MLFLOW_TRACKING_URI", "http://127.0.0.1:5000")
+
+# Directory of the local model cache
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", os.path.join(project_root, "model_cache"))
+
+# Local MLflow stores: `mlruns` keeps the registry metadata and the runs, `mlartifacts` keeps the artifacts
+# uploaded to the tracking server (`mlflow-artifacts:/` URIs)
+LOCAL_MLRUNS_DIR = os.path.join(project_root, "mlruns")
+LOCAL_MLARTIFACTS_DIR = os.path.join(project_root, "mlartifacts")
+
+# Name of the file with the description of a cache entry
+MANIFEST_NAME = "manifest.json"
+
+
+def hash_directory(path):
+    """
+    Compute the content hash of an artifact directory (sha256 over the relative path and content of every file).
+
+    :param path: directory of the artifact.
+    :return: hexadecimal sha256
+    """
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            relative_path = os.path.relpath(file_path, path).replace(os.sep, "/")
+            if relative_path == MANIFEST_NAME:
+                continue
+
+            digest.update(relative_path.encode("utf-8"))
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def resolve_local_version(model_name, version="latest", mlruns_dir=LOCAL_MLRUNS_DIR):
+    """
+    Resolve a registered model version with the registry metadata of the local `mlruns` store.
+
+    :param model_name: name of the registered model.
+    :param version: version number or "latest".
+    :param mlruns_dir: local `mlruns` directory.
+    :return: dictionary with the `meta.yaml` of the version, or None if it is not in the local registry.
+    """
+    versions = []
+    for meta_path in glob.glob(os.path.join(mlruns_dir, "models", model_name, "version-*", "meta.yaml")):
+        with open(meta_path, "r", encoding="utf-8") as file:
+            meta = yaml.safe_load(file)
+        if meta.get("status", "READY") == "READY":
+            versions.append(meta)
+
+    if not versions:
+        return None
+
+    if str(version) == "latest":
+        return max(versions, key=lambda meta: int(meta["version"]))
+
+    return next((meta for meta in versions if str(meta["version"]) == str(version)), None)
+
+
+def local_artifact_path(source):
+    """
+    Translate the source URI of a model version into a directory of the local stores, if it exists.
+
+    :param source: source of the model version (`mlflow-artifacts:/...`, `file://...` or a path).
+    :return: path of the artifact directory, or None.
+    """
+    if source.startswith("mlflow-artifacts:/"):
+        relative_path = source[len("mlflow-artifacts:/"):].lstrip("/")
+        candidates = [os.path.join(LOCAL_MLARTIFACTS_DIR, relative_path),
+                      os.path.join(LOCAL_MLRUNS_DIR, relative_path)]
+    elif source.startswith("file://"):
+        candidates = [source[len("file://"):]]
+    else:
+        candidates = [source]
+
+    return next((path for path in candidates if os.path.isdir(path)), None)
+
+
+def version_artifact_path(meta):
+    """
+    Return the local directory of the artifact of a model version of the local registry, if it exists.
+
+    The `storage_location` of the version is resolved first: the versions registered from a logged model
+    have a `models:/...` source, and only their storage location points to the artifact on disk.
+
+    :param meta: `meta.yaml` of the version (see `resolve_local_version`).
+    :return: path of the artifact directory, or None.
+    """
+    for uri in (meta.get("storage_location"), meta.get("source")):
+        if uri:
+            artifact_path = local_artifact_path(uri)
+            if artifact_path is not None:
+                return artifact_path
+    return None
+
+
+def _entry_dir(cache_dir, *key):
+    return os.path.join(cache_dir, *[str(part) for part in key])
+
+
+def _read_cached_entry(key_dir):
+    """
+    Return the path of the verified cache entry of `key_dir`, or None if it is missing or corrupted.
+
+    The entries are content addressed: `<key_dir>/<sha256>/` holds the artifact and `<key_dir>/CURRENT`
+    holds the hash of the entry in use.
+    """
+    current_path = os.path.join(key_dir, "CURRENT")
+    if not os.path.exists(current_path):
+        return None
+
+    with open(current_path, "r", encoding="utf-8") as file:
+        artifact_hash = file.read().strip()
+
+    entry_path = os.path.join(key_dir, artifact_hash)
+    if not os.path.isdir(entry_path):
+        return None
+
+    # Verify the integrity of the entry before using it
+    if hash_directory(entry_path) != artifact_hash:
+        logger.warning(f"Corrupted cache entry {entry_path}, it will be fetched again")
+        shutil.rmtree(entry_path, ignore_errors=True)
+        return None
+
+    return entry_path
+
+
+def _store_entry(key_dir, artifact_path, manifest):
+    """
+    Copy an artifact directory into the cache under its content hash and mark it as the current entry.
+
+    :return: path of the cache entry.
+    """
+    artifact_hash = hash_directory(artifact_path)
+    entry_path = os.path.join(key_dir, artifact_hash)
+
+    if not os.path.isdir(entry_path):
+        # Copy into a temporary directory first, so a crash never leaves a half written entry
+        os.makedirs(key_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=key_dir)
+        try:
+            shutil.copytree(artifact_path, tmp_path, dirs_exist_ok=True)
+            with open(os.path.join(tmp_path, MANIFEST_NAME), "w", encoding="utf-8") as file:
+                json.dump(dict(manifest, sha256=artifact_hash), file, indent=2)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # Another worker stored the same entry first (the rename fails on a non empty directory)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(entry_path):
+                raise
+
+    current_tmp = os.path.join(key_dir, f"CURRENT.{os.getpid()}")
+    with open(current_tmp, "w", encoding="utf-8") as file:
+        file.write(artifact_hash)
+    os.replace(current_tmp, os.path.join(key_dir, "CURRENT"))
+
+    return entry_path
+
+
+def fetch_model(model_name, version="latest", cache_dir=MODEL_CACHE_DIR, tracking_uri=MLFLOW_TRACKING_URI):
+    """
+    Return a local directory with the artifact of a registered model version.
+
+    The artifact is resolved in this order:
+    1. The local cache, keyed by registered model name + version + artifact hash (integrity verified).
+    2. The local `mlruns`/`mlartifacts` stores, which are copied into the cache.
+    3. The MLflow tracking server, which is only contacted when the previous steps miss.
+
+    :param model_name: name of the registered model.
+    :param version: version number or "latest".
+    :param cache_dir: directory of the local cache.
+    :param tracking_uri: URI of the MLflow tracking server.
+    :return: tuple with the path of the cache entry and its manifest.
+    """
+    meta = resolve_local_version(model_name, version)
+
+    # "latest" is resolved with the local registry. Without it, the most recent cached version is used
+    # and the tracking server is only asked when nothing is cached
+    if meta is not None:
+        resolved_version = str(meta["version"])
+    elif str(version) == "latest":
+        cached_versions = [
+            int(name) for name in os.listdir(_entry_dir(cache_dir, model_name))
+            if name.isdigit()
+        ] if os.path.isdir(_entry_dir(cache_dir, model_name)) else []
+        resolved_version = str(max(cached_versions)) if cached_versions else None
+    else:
+        resolved_version = str(version)
+
+    if resolved_version is not None:
+        key_dir = _entry_dir(cache_dir, model_name, resolved_version)
+        entry_path = _read_cached_entry(key_dir)
+        if entry_path is not None:
+            return entry_path, _read_manifest(entry_path, source="cache")
+
+        # The artifact may be in the local stores
+        artifact_path = version_artifact_path(meta) if meta is not None else None
+        if artifact_path is not None:
+            manifest = {"name": model_name, "version": resolved_version, "origin": meta["source"]}
+            entry_path = _store_entry(key_dir, artifact_path, manifest)
+            return entry_path, _read_manifest(entry_path, source="local")
+
+    # Fall back to the tracking server
+    client = MlflowClient(tracking_uri=tracking_uri, registry_uri=tracking_uri)
+    if str(version) == "latest":
+        model_version = max(client.search_model_versions(f"name='{model_name}'"), key=lambda mv: int(mv.version))
+    else:
+        model_version = client.get_model_version(model_name, str(version))
+
+    mlflow.set_tracking_uri(tracking_uri)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifact_path = mlflow.artifacts.download_artifacts(
+            f"models:/{model_name}/{model_version.version}", dst_path=tmp_dir)
+        manifest = {"name": model_name, "version": str(model_version.version), "origin": model_version.source}
+        entry_path = _store_entry(_entry_dir(cache_dir, model_name, model_version.version), artifact_path, manifest)
+
+    return entry_path, _read_manifest(entry_path, source="server")
+
+
+def _read_manifest(entry_path, source):
+    with open(os.path.join(entry_path, MANIFEST_NAME), "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    manifest["source"] = source
+    return manifest
+
+
+def export_mmap_model(entry_path):
+    """
+    Export the model of a cache entry so that its large arrays can be memory mapped.
+
+    The Random Forest and XGBoost members are compiled into flat node arrays saved as `.npy` files in
+    `<sha256>.trees/` (see `detach_tree_members`), the rest of the model (e.g. the KNN and its training
+    matrix `_fit_X`) is saved as an uncompressed joblib file `<sha256>.joblib`. Both are written next to the
+    entry, so they are tied to the artifact hash and every worker of the API maps the same files.
+
+    :param entry_path: path of the cache entry returned by `fetch_model`.
+    :return: tuple with the path of the joblib file and the directory of the node arrays.
+    """
+    mmap_path = f"{entry_path}.joblib"
+    trees_dir = f"{entry_path}.trees"
+
+    if not os.path.exists(mmap_path):
+        model = mlflow.sklearn.load_model(entry_path)
+
+        # Write into temporary files first, so concurrent workers never map a half written file. The joblib
+        # file is written last, its presence means that the node arrays are complete
+        tmp_dir = f"{trees_dir}.{os.getpid()}.tmp"
+        model = detach_tree_members(model, tmp_dir)
+        if os.path.exists(tmp_dir):
+            try:
+                os.replace(tmp_dir, trees_dir)
+            except OSError:
+                # Another worker exported the same model
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        tmp_path = f"{mmap_path}.{os.getpid()}.tmp"
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, mmap_path)
+
+    return mmap_path, trees_dir
+
+
+def load_model(model_name, version="latest", cache_dir=MODEL_CACHE_DIR, tracking_uri=MLFLOW_TRACKING_URI,
+               mmap=False):
+    """
+    Load a registered sklearn model through the local cache (see `fetch_model`).
+
+    With `mmap=True` the model is loaded from the export of the cache entry (see `export_mmap_model`): the
+    Random Forest and XGBoost members are replaced by compiled ensembles whose node arrays are memory mapped
+    read only, and the other large NumPy arrays (e.g. the training matrix `_fit_X` of the KNN) are mapped
+    with joblib. All the processes that load the same version share those pages through the OS page cache
+    instead of keeping a private copy each. The compiled XGBoost adds its trees in float32 like XGBoost, its
+    predictions may differ in the last digits.
+
+    :param model_name: name of the registered model.
+    :param version: version number or "latest".
+    :param mmap: load the model with memory mapped arrays.
+    :return: tuple with the loaded model and the load stats (name, version, sha256, source and seconds).
+    """
+    start = time.perf_counter()
+
+    entry_path, manifest = fetch_model(model_name, version, cache_dir=cache_dir, tracking_uri=tracking_uri)
+    if mmap:
+        mmap_path, trees_dir = export_mmap_model(entry_path)
+        model = attach_tree_members(joblib.load(mmap_path, mmap_mode="r"), trees_dir, mmap=True)
+    else:
+        model = mlflow.sklearn.load_model(entry_path)
+
+    manifest["mmap"] = mmap
+    manifest["seconds"] = time.perf_counter() - start
+    logger.info(
+        f"Loaded model {model_name} v{manifest['version']} ({manifest['sha256'][:12]}) "
+        f"from {manifest['source']} in {manifest['seconds']:.2f}s"
+    )
+
+    return model, manifest
+
+
+def fetch_run_artifact(run_id, artifact_path, cache_dir=MODEL_CACHE_DIR, tracking_uri=MLFLOW_TRACKING_URI):
+    """
+    Return a local path to a file logged in an MLflow run, using the same cache as the models.
+
+    :param run_id: id of the MLflow run.
+    :param artifact_path: path of the artifact inside the run (e.g. "scaler/scaler.pkl").
+    :return: path of the cached file.
+    """
+    key_dir = _entry_dir(cache_dir, "runs", run_id, *artifact_path.split("/"))
+    entry_path = _read_cached_entry(key_dir)
+
+    if entry_path is None:
+        # Look for the run in the local stores before asking the tracking server
+        local_files = glob.glob(os.path.join(LOCAL_MLRUNS_DIR, "*", run_id, "artifacts", artifact_path)) + \
+            glob.glob(os.path.join(LOCAL_MLARTIFACTS_DIR, "*", run_id, "artifacts", artifact_path))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if local_files:
+                shutil.copy(local_files[0], tmp_dir)
+            else:
+                mlflow.set_tracking_uri(tracking_uri)
+                mlflow.artifacts.download_artifacts(f"runs:/{run_id}/{artifact_path}", dst_path=tmp_dir)
+
+            manifest = {"run_id": run_id, "artifact_path": artifact_path}
+            entry_path = _store_entry(key_dir, tmp_dir, manifest)
+
+    return os.path.join(entry_path, os.path.basename(artifact_path))
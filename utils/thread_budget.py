@@ -0,0 +1,80 @@
+import os
+
+from threadpoolctl import threadpool_limits
+
+# Environment variables read by the native thread pools (OpenMP, BLAS) when a process starts
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+
+def limit_process_threads(n_threads):
+    """
+    Limit the native thread pools of the current process (OpenMP, BLAS) to `n_threads`, e.g. in the
+    initializer of a worker process. The environment variables also cover the pools started afterwards.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(n_threads)
+    threadpool_limits(limits=n_threads)
+
+
+def limit_model_threads(model, n_threads):
+    """
+    Pin the number of threads used by every estimator of a model when it predicts.
+
+    The members of the ensemble are trained with `n_jobs=-1`, so each of them would start one thread per
+    core on every prediction on top of the threads of the API. The `n_jobs` of the scikit-learn estimators
+    and the `n_jobs`/`nthread` of the XGBoost booster are set to `n_threads`.
+
+    :param model: fitted model (Pipeline, VotingRegressor or single estimator).
+    :param n_threads: number of threads of every estimator.
+    :return: the same model
+    """
+    if hasattr(model, "steps"):
+        for _, step in model.steps:
+            limit_model_threads(step, n_threads)
+
+    for estimator in getattr(model, "estimators_", []):
+        limit_model_threads(estimator, n_threads)
+
+    if hasattr(model, "get_booster"):
+        model.set_params(n_jobs=n_threads)
+        model.get_booster().set_param({"nthread": n_threads})
+    elif hasattr(model, "n_jobs"):
+        model.n_jobs = n_threads
+
+    return model
+
+
+def thread_budget(profile="latency", workers=None, threads_per_worker=None, cores=None):
+    """
+    Return the number of workers and the threads per worker of a deployment profile.
+
+    - "latency": one worker per core, every prediction uses a single thread. The single predictions (and the
+      small micro-batches) are too small to split among threads, so extra threads only add synchronization
+      and oversubscribe the cores under concurrent load.
+    - "throughput": a single worker whose predictions use every core, for large batches.
+
+    An explicit number of workers or threads per worker overrides the profile, and the other value is
+    derived from the number of cores.
+
+    :param profile: "latency" or "throughput".
+    :param workers: number of workers (None: from the profile).
+    :param threads_per_worker: threads of every worker (None: from the profile).
+    :param cores: number of cores (None: all the cores of the machine).
+    :return: tuple (workers, threads_per_worker)
+    """
+    cores = cores or os.cpu_count() or 1
+
+    if profile == "latency":
+        default_workers, default_threads = cores, 1
+    elif profile == "throughput":
+        default_workers, default_threads = 1, cores
+    else:
+        raise ValueError(f"Unknown thread profile '{profile}', use 'latency' or 'throughput'")
+
+    if workers is None and threads_per_worker is None:
+        return default_workers, default_threads
+    if workers is None:
+        return max(1, cores // threads_per_worker), threads_per_worker
+    if threads_per_worker is None:
+        return workers, max(1, cores // workers)
+    return workers, threads_per_worker
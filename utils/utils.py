@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import pickle
+import joblib
 import mlflow
 
 from sklearn.metrics import (
@@ -11,6 +12,9 @@ from sklearn.metrics import (
 from minio import Minio
 from pathlib import Path
 
+from src.data_processing.serving_pipeline import build_serving_pipeline
+from utils.model_cache import fetch_run_artifact
+
 # ------------------------
 # -- Feature Importance --
 # ------------------------
@@ -75,11 +79,34 @@ def extract_cv_metrics(results, best_idx):
 # ------------------------
 # -------- Model ---------
 # ------------------------
-def save_model(model, model_name):
+def save_model(model, model_name, scaler=None):
+    """
+    Log a model in MLflow and register it with the given name.
+
+    If the scaler used to build the training dataset is given, it is folded in front of the model,
+    so the registered artifact is a single pipeline that predicts directly from the unscaled features.
+
+    :param model: trained model.
+    :param model_name: name of the registered model.
+    :param scaler: optional StandardScaler fitted on the continuous features.
+    """
+    if scaler is not None:
+        model = build_serving_pipeline(scaler, model)
+
     if mlflow.active_run() is None:
         with mlflow.start_run():
             mlflow.sklearn.log_model(model, artifact_path="model", registered_model_name=model_name)
     else:
         mlflow.sklearn.log_model(model, artifact_path="model", registered_model_name=model_name)
 
-    print(f"Model {model_name} saved and registered in MLflow.")
\ No newline at end of file
+    print(f"Model {model_name} saved and registered in MLflow.")
+
+def load_scaler(scaler_run_id):
+    """
+    Download and load the StandardScaler logged by `src/eda/scaling_dataset.py`.
+
+    :param scaler_run_id: id of the MLflow run where the scaler was logged.
+    :return: StandardScaler
+    """
+    # The scaler goes through the local model cache, so the tracking server is only asked once
+    return joblib.load(fetch_run_artifact(scaler_run_id, "scaler/scaler.pkl"))